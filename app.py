@@ -9,13 +9,15 @@ boot.bootstrap_environment()
 
 import streamlit as st
 import time
-import random
 import traceback
 from src.agent_builder import AgentProfile, HardAttributes, HardPreferences, Persona
 from src.agentscope_adapter import init_agentscope
 from src.engine import ChatSession
+from src.resilience import LLMCallError
 from src.generator import CandidateGenerator
 from src.storage import CloudStorage
+from src.prescreen import rank_candidates
+from src.embedding_index import recall_candidates
 
 # 页面配置
 st.set_page_config(
@@ -51,6 +53,10 @@ def build_agent_profile(data, user_id, preferences):
         )
     )
 
+# 已聊对象的分数标签 (只被漏斗淘汰过的对象没有完整评估分数)
+def _chatted_label(score):
+    return "未晋级" if score is None else f"{score}分"
+
 def main():
     try:
         # 初始化存储
@@ -65,6 +71,14 @@ def main():
                 st.error("请输入 Kimi API Key 才能开始！")
                 st.stop()
             
+            batch_concurrency = st.slider("批量匹配并发数", min_value=1, max_value=10, value=4, help="同时进行的对话组数")
+            use_background_worker = st.toggle("后台 Worker 模式", value=False, help="批量匹配交给后台 Worker 执行，关闭页面也会继续 (需运行 python worker.py)")
+            batch_max_turns = 5 # 批量匹配每位嘉宾的对话轮数上限 (漏斗开启时同样适用)
+            use_funnel = st.toggle(
+                "漏斗筛选", value=True,
+                help=f"先破冰 3 轮，快评达标的嘉宾才继续聊满 {batch_max_turns} 轮并做完整评估；未达标的提前结束，总轮数不会增加"
+            )
+            
             # 初始化 AgentScope
             if 'agentscope_inited' not in st.session_state:
                 try:
@@ -115,14 +129,8 @@ def main():
                     with st.expander(f"{medal} {record['match_score']}分 - {record.get('partner_name', '未知')}"):
                         st.caption(f"📅 {record['created_at']}")
                         st.markdown(f"**简评**: {record.get('report', '暂无')}")
-                        if st.button("📄 记录", key=f"top_{record['id']}"):
-                            chat_log = record['chat_log']
-                            if isinstance(chat_log, str):
-                                try:
-                                    chat_log = json.loads(chat_log)
-                                except:
-                                    pass
-                            st.json(chat_log)
+                        if st.toggle("📄 记录", key=f"top_{record['id']}"):
+                            st.json(storage.get_chat_log(record['id']))
 
             st.divider()
 
@@ -134,16 +142,26 @@ def main():
                 st.caption("暂无对话")
             else:
                 for record in recent_matches:
-                    with st.expander(f"💬 {record.get('partner_name', '未知')} ({record['match_score']}分)"):
+                    # 评估失败的记录没有分数，等待广场扫描重新评估；漏斗淘汰的记录只有快评，不显示分数
+                    score_label = {"failed": "⚠️ 待重新评估", "screened": "🔻 未晋级深聊"}.get(record.get('eval_status'), f"{record['match_score']}分")
+                    with st.expander(f"💬 {record.get('partner_name', '未知')} ({score_label})"):
                         st.caption(f"⏱️ {record['created_at']}")
-                        if st.button("📄 回顾", key=f"recent_{record['id']}"):
-                            chat_log = record['chat_log']
-                            if isinstance(chat_log, str):
-                                try:
-                                    chat_log = json.loads(chat_log)
-                                except:
-                                    pass
-                            st.json(chat_log)
+                        if st.toggle("📄 回顾", key=f"recent_{record['id']}"):
+                            st.json(storage.get_chat_log(record['id']))
+
+            # 3. Background Jobs
+            job_stats = storage.get_match_job_stats(current_user.user_id)
+            if job_stats:
+                st.divider()
+                st.subheader("📨 后台任务")
+                st.caption(
+                    f"⏳ 排队 {job_stats.get('pending', 0)} | 🤖 进行中 {job_stats.get('running', 0)} | "
+                    f"✅ 完成 {job_stats.get('done', 0)} | ❌ 失败 {job_stats.get('failed', 0)}"
+                )
+                if st.button("🔄 刷新进度", key="refresh_jobs"):
+                    # Worker 在其他进程写入，手动刷新时丢弃本会话的查询缓存
+                    storage.invalidate_cache()
+                    st.rerun()
 
         # 初始化 Session State
         if 'messages' not in st.session_state:
@@ -160,7 +178,8 @@ def main():
         # 加载真实用户池
         if st.session_state.candidate_pool is None:
             with st.spinner("正在从云端加载真实嘉宾..."):
-                real_candidates = storage.get_candidate_pool(current_user.user_id)
+                # 硬性择偶标准 (性别/年龄差/城市) 直接在数据库中过滤
+                real_candidates = storage.get_candidate_pool(current_user.user_id, profile=current_user)
                 
                 # 保证池子里至少有 20 个嘉宾，不够就用虚拟人凑
                 min_pool_size = 20
@@ -214,6 +233,11 @@ def main():
                             selected.append(cand)
                     if not selected:
                         st.error("请先选择嘉宾！")
+                    elif use_background_worker:
+                        # 只入队，由后台 Worker 执行；页面可以随时关闭
+                        queued = storage.enqueue_match_jobs(current_user.user_id, selected)
+                        if queued:
+                            st.toast(f"已提交 {queued} 个匹配任务到后台队列", icon="📨")
                     else:
                         st.session_state.batch_processing = True
                         st.session_state.batch_targets = selected
@@ -242,7 +266,7 @@ def main():
                             st.caption(f"{is_real} | {candidate.attributes.age}岁 | {candidate.attributes.job}")
                             
                             if candidate.user_id in chatted_map:
-                                st.info(f"{chatted_map[candidate.user_id]}分")
+                                st.info(_chatted_label(chatted_map[candidate.user_id]))
                             else:
                                 st.checkbox("选", key=f"select_{candidate.user_id}")
             else:
@@ -261,7 +285,7 @@ def main():
                             # 紧凑显示
                             status = ""
                             if candidate.user_id in chatted_map:
-                                status = f" | ✅ {chatted_map[candidate.user_id]}分"
+                                status = f" | ✅ {_chatted_label(chatted_map[candidate.user_id])}"
                             
                             st.markdown(f"**{candidate.name}** {gender_icon} {status}")
                             st.caption(f"{is_real} {candidate.attributes.job}")
@@ -285,50 +309,68 @@ def main():
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                from src.auto_chat import AutoChatController
-                from src.evaluator import MatchEvaluator
+                from src.batch_engine import BatchMatchEngine
+                from src.funnel import FunnelConfig, STAGE_DEEP
+                from src.storage import MATCH_QUERIES
+                from src.write_behind import MatchRecordWriter
                 
                 targets = st.session_state.batch_targets
+                avatar_of = lambda p: "👨" if p.attributes.gender == "male" else "👩"
                 
-                for idx, target in enumerate(targets):
-                    status_text.markdown(f"### 🤖 正在与 **{target.name}** ({idx+1}/{len(targets)}) 深入交流中...")
-                    detail_bar = st.progress(0)
-                    
-                    controller = AutoChatController(current_user, target, model_config_name=api_key)
-                    
-                    chat_history = []
-                    # 1. 开场
-                    msg = controller.agent_a(controller.agent_b(controller.agent_a(agentscope.message.Msg(name="System", content="你们相遇了", role="system")))) 
-                    controller = AutoChatController(current_user, target, model_config_name=api_key)
-                    
-                    with st.expander(f"💬 {target.name} 的实时聊天记录", expanded=True):
-                        msg_a = controller.agent_a(agentscope.message.Msg(name="System", content="请向对方打个招呼。", role="system"))
-                        chat_history.append(msg_a)
-                        current_msg = msg_a
-                        st.chat_message("user", avatar="👨" if current_user.attributes.gender=="male" else "👩").write(f"**{current_user.name}**: {msg_a.content}")
-                        
-                        max_turns = 5
-                        for turn in range(max_turns):
-                            msg_b = controller.agent_b(current_msg)
-                            chat_history.append(msg_b)
-                            st.chat_message("assistant", avatar="👨" if target.attributes.gender=="male" else "👩").write(f"**{target.name}**: {msg_b.content}")
-                            detail_bar.progress((turn * 2 + 1) / (max_turns * 2))
-                            
-                            msg_a = controller.agent_a(msg_b)
-                            chat_history.append(msg_a)
-                            st.chat_message("user", avatar="👨" if current_user.attributes.gender=="male" else "👩").write(f"**{current_user.name}**: {msg_a.content}")
-                            detail_bar.progress((turn * 2 + 2) / (max_turns * 2))
-                            current_msg = msg_a
-                            time.sleep(0.5)
-                    
-                    formatted_history = [{"name": m.name, "content": m.content} for m in chat_history]
-                    evaluator = MatchEvaluator(api_key)
-                    report = evaluator.evaluate(formatted_history, current_user, target)
-                    
-                    score = report.get("total_score", 0)
-                    summary = report.get("final_verdict", "")
-                    storage.save_match_record(current_user.user_id, target.user_id, formatted_history, score, summary)
-                    progress_bar.progress((idx + 1) / len(targets))
+                # 每位嘉宾预先创建独立的展示区，并发对话时各自刷新
+                panels = {}
+                for target in targets:
+                    with st.expander(f"💬 {target.name} 的实时聊天记录", expanded=False):
+                        panels[target.user_id] = {"bar": st.progress(0), "box": st.container()}
+                
+                finished = {"count": 0}
+                
+                def on_progress(event):
+                    target = event["target"]
+                    panel = panels[target.user_id]
+                    if event["type"] == "message":
+                        speaker = current_user if event["name"] == current_user.name else target
+                        role = "user" if speaker is current_user else "assistant"
+                        panel["box"].chat_message(role, avatar=avatar_of(speaker)).write(f"**{event['name']}**: {event['content']}")
+                    elif event["type"] == "stage":
+                        if event["stage"] == STAGE_DEEP:
+                            verdict = event["verdict"]
+                            panel["box"].info(f"✨ 破冰快评 {verdict['score']} 分，晋级深聊" if verdict else "✨ 晋级深聊")
+                    elif event["type"] == "turn":
+                        panel["bar"].progress(event["turn"] / event["max_turns"])
+                    elif event["type"] in ("done", "error"):
+                        finished["count"] += 1
+                        progress_bar.progress(finished["count"] / len(targets))
+                        if event["type"] == "error":
+                            panel["box"].error(f"与 {target.name} 的对话失败: {event['error']}")
+                        status_text.markdown(f"### 🤖 已完成 {finished['count']}/{len(targets)} 位嘉宾的交流...")
+                
+                # 结果先进入写缓冲，由后台线程批量入库，对话过程不再等待逐条提交
+                writer = MatchRecordWriter(storage)
+                
+                def on_result(result):
+                    summary = result.report.get("final_verdict", "")
+                    writer.add(current_user.user_id, result.target.user_id, result.history, result.score, summary,
+                               eval_status=result.eval_status,
+                               user_a_name=current_user.name, user_b_name=result.target.name)
+                
+                status_text.markdown(f"### 🤖 正在同时与 {min(batch_concurrency, len(targets))} 位嘉宾深入交流中 (共 {len(targets)} 位)...")
+                engine = BatchMatchEngine(
+                    current_user, api_key,
+                    concurrency=batch_concurrency,
+                    max_turns=batch_max_turns,
+                    on_progress=on_progress,
+                    on_result=on_result,
+                    # 深聊轮数沿用原有的轮数预算，漏斗只会减少调用、不会增加
+                    funnel=FunnelConfig(deep_turns=batch_max_turns) if use_funnel else None
+                )
+                try:
+                    engine.run(targets)
+                finally:
+                    # 写入结果在 rerun 后的排行榜页展示
+                    st.session_state.batch_write_stats = writer.close()
+                # 后台线程写入时不在 Streamlit 会话中，这里统一失效排行榜缓存
+                storage.invalidate_cache(*MATCH_QUERIES)
                 
                 st.session_state.batch_processing = False
                 st.success("🎉 所有匹配任务已完成！请查看排行榜。")
@@ -348,34 +390,74 @@ def main():
                     st.chat_message(role, avatar=avatar).write(f"**{msg['name']}**: {msg['content']}")
 
                 if not st.session_state.messages:
-                    session = ChatSession(agent_a, agent_b, model_config_name=api_key, on_message=None)
+                    # 流式输出：每条发言一个占位符，收到增量就整体刷新
+                    stream_state = {"name": None, "placeholder": None}
+                    
+                    def on_chunk(name, text):
+                        if stream_state["name"] != name or stream_state["placeholder"] is None:
+                            is_agent_a = name == agent_a.name
+                            role = "user" if is_agent_a else "assistant"
+                            avatar = "👨" if (agent_a.attributes.gender if is_agent_a else agent_b.attributes.gender) == "male" else "👩"
+                            stream_state["name"] = name
+                            stream_state["placeholder"] = st.chat_message(role, avatar=avatar).empty()
+                        stream_state["placeholder"].markdown(f"**{name}**: {text}▌")
+                    
+                    def on_message(name, content):
+                        if stream_state["placeholder"] is not None and stream_state["name"] == name:
+                            stream_state["placeholder"].markdown(f"**{name}**: {content}")
+                        stream_state["name"] = None
+                        stream_state["placeholder"] = None
+                        st.session_state.messages.append({"name": name, "content": content})
+                    
+                    session = ChatSession(agent_a, agent_b, model_config_name=api_key, on_message=on_message, on_chunk=on_chunk)
                     max_turns = 8
-                    for turn in range(1, max_turns + 1):
-                        with st.spinner(f"正在进行第 {turn}/{max_turns} 轮对话..."):
-                            session.run_turn_sync(turn)
-                            last_two = session.history[-2:]
-                            for msg in last_two:
-                                st.session_state.messages.append(msg)
-                                is_agent_a = msg["name"] == agent_a.name
-                                role = "user" if is_agent_a else "assistant"
-                                avatar = "👨" if (agent_a.attributes.gender if is_agent_a else agent_b.attributes.gender) == "male" else "👩"
-                                st.chat_message(role, avatar=avatar).write(f"**{msg['name']}**: {msg['content']}")
-                            time.sleep(1)
+                    turn_status = st.empty()
+                    turn_status.caption(f"正在进行第 1/{max_turns} 轮对话...")
+                    try:
+                        # 整场对话作为一个异步任务运行，轮次之间不再 sleep
+                        session.run(
+                            max_turns,
+                            on_turn=lambda turn: turn_status.caption(f"正在进行第 {min(turn + 1, max_turns)}/{max_turns} 轮对话...")
+                        )
+                    except LLMCallError as e:
+                        # 重试耗尽：中止本次聊天，不保存残缺记录
+                        st.error(f"模型调用失败，对话已中止: {e}")
+                        st.session_state.messages = []
+                        st.session_state.chat_active = False
+                        return
+                    turn_status.empty()
+                    if session.completed:
+                        st.toast(f"对话自然结束：{session.stop_reason}")
+                    elif session.stop_reason:
+                        st.toast(f"对话提前结束：{session.stop_reason}")
                     session.save_log()
                     with st.spinner("正在生成最终裁判报告..."):
-                        from src.evaluator import MatchEvaluator
+                        from src.evaluator import MatchEvaluator, EvaluationError
                         evaluator = MatchEvaluator(api_key)
-                        report = evaluator.evaluate(session.history, agent_a, agent_b)
+                        eval_status = "ok"
+                        try:
+                            report = evaluator.evaluate(session.history, agent_a, agent_b)
+                        except EvaluationError as e:
+                            # 聊天记录照常保存，标记为待重新评估
+                            st.warning(f"裁判报告生成失败，聊天记录已保存: {e}")
+                            report = e.report
+                            eval_status = "failed"
                         st.session_state.report = report
                         score = report.get("total_score", 0)
                         summary = report.get("final_verdict", "")
                         formatted_history = session.history 
-                        storage.save_match_record(current_user.user_id, agent_b.user_id, formatted_history, score, summary)
+                        storage.save_match_record(current_user.user_id, agent_b.user_id, formatted_history, score, summary, eval_status=eval_status,
+                                                  user_a_name=current_user.name, user_b_name=agent_b.name)
                     st.rerun()
 
             # 3. 排行榜
             if st.session_state.get('show_rank', False):
                 st.header("🏆 真爱排行榜")
+                write_stats = st.session_state.pop('batch_write_stats', None)
+                if write_stats and write_stats["spooled"]:
+                    st.warning(f"数据库暂时不可用，{write_stats['spooled']} 条匹配记录已暂存到本地，恢复后会自动补写 (下次批量匹配或后台 Worker 启动时)。")
+                if write_stats and write_stats["rejected"]:
+                    st.error(f"{write_stats['rejected']} 条匹配记录保存失败 (已另存到 spool 目录的 .rejected 文件)。")
                 history = storage.get_match_history(current_user.user_id, current_user_name=current_user.name)
                 if not history:
                     st.info("暂无匹配记录")
@@ -383,12 +465,8 @@ def main():
                     for record in history:
                         with st.expander(f"🏅 {record['match_score']}分 - {record.get('partner_name', '未知用户')}"):
                             st.write(f"**裁判点评**: {record['report']}")
-                            if st.button("查看详细聊天记录", key=f"history_{record['id']}"):
-                                chat_log = record['chat_log']
-                                if isinstance(chat_log, str):
-                                    try: chat_log = json.loads(chat_log)
-                                    except: pass
-                                st.json(chat_log)
+                            if st.toggle("查看详细聊天记录", key=f"history_{record['id']}"):
+                                st.json(storage.get_chat_log(record['id']))
 
             # 4. 评估报告
             if st.session_state.report:
@@ -409,20 +487,14 @@ def main():
             agent_a = current_user
             candidates = st.session_state.candidate_pool
             with st.status("正在运行筛选算法...", expanded=True) as status:
-                st.write("正在分析兴趣契合度...")
-                progress_bar = st.progress(0)
-                scores = []
-                for i, cand in enumerate(candidates):
-                    score = random.randint(50, 95)
-                    common_interests = set(agent_a.persona.interests) & set(cand.persona.interests)
-                    if common_interests:
-                        score += 10
-                        st.write(f"发现共同兴趣 [{', '.join(common_interests)}] -> {cand.name} 加分!")
-                    scores.append((cand, score))
-                    progress_bar.progress((i + 1) / len(candidates))
-                    time.sleep(0.05)
+                st.write("正在计算兴趣与价值观语义相似度...")
+                similarity = {cand.user_id: sim for cand, sim in recall_candidates(agent_a, candidates, top_k=len(candidates))}
+                st.write("正在分析年龄、身高、兴趣与 MBTI 契合度...")
+                # 整个候选池一次向量化打分 (与 Agent 内心评估同一套规则)，语义相似度只在同分时决定先后
+                scores = rank_candidates(agent_a, candidates, top_k=5, tiebreak=[similarity[c.user_id] for c in candidates])
+                for cand, score in scores:
+                    st.write(f"{cand.name} -> {score}/10 (语义相似度 {similarity[cand.user_id]:.2f})")
                 if scores:
-                    scores.sort(key=lambda x: x[1], reverse=True)
                     top_candidate = scores[0][0]
                     st.session_state.selected_candidate = top_candidate
                     status.update(label="筛选完成！", state="complete", expanded=False)
@@ -0,0 +1,35 @@
+import argparse
+import src.boot as boot
+
+# 1. Bootstrap Environment
+boot.bootstrap_environment()
+
+from src.embedding_index import HashingVectorizer
+from src.storage import CloudStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="恋与代理人 - 离线构建用户画像向量 (写入 user_embeddings)")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批写入的用户数")
+    args = parser.parse_args()
+
+    storage = CloudStorage()
+    if not storage.is_connected:
+        raise SystemExit("数据库连接失败")
+
+    # 与 CloudStorage.register_user 相同：一律按数据库中保存的档案编码
+    profiles = storage.get_all_profiles()
+    vectorizer = HashingVectorizer()
+    print(f"正在为 {len(profiles)} 位用户构建画像向量...")
+
+    written = 0
+    for start in range(0, len(profiles), args.batch_size):
+        batch = profiles[start:start + args.batch_size]
+        vectors = vectorizer.encode_many(batch)
+        written += storage.save_user_embeddings([(p.user_id, v) for p, v in zip(batch, vectors)])
+
+    print(f"完成，共写入 {written} 条向量")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,10 +49,8 @@ def main():
 
     session = ChatSession(alex, sarah, model_config_name, on_message=print_msg)
     
-    # 运行 3 轮
-    for i in range(3):
-        print(f"--- Round {i+1} ---")
-        session.run_turn(i+1)
+    # 运行 3 轮 (整场对话一次性异步执行)
+    session.run(3, on_turn=lambda turn: print(f"--- Round {turn} done ---"))
     
     filename = session.save_log()
     print(f"\n对话结束，日志已保存: {filename}")
@@ -0,0 +1,52 @@
+import argparse
+import os
+from datetime import datetime
+import src.boot as boot
+
+# 1. Bootstrap Environment
+boot.bootstrap_environment()
+
+from src.plaza import PlazaSweep
+from src.funnel import FunnelConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description="恋与代理人 - 虚拟广场夜间扫描 (多进程分片)")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1, help="分片 (进程) 数，默认等于 CPU 核数")
+    parser.add_argument("--concurrency", type=int, default=8, help="每个分片同时进行的对话组数")
+    parser.add_argument("--candidates", type=int, default=200, help="每个用户扫描的候选人数")
+    parser.add_argument("--max-turns", type=int, default=5, help="每组对话的轮数")
+    parser.add_argument("--run-id", default=datetime.now().strftime("%Y%m%d"), help="扫描批次 ID，相同 ID 会从检查点续跑")
+    parser.add_argument("--checkpoint-dir", default="checkpoints", help="检查点根目录")
+    parser.add_argument("--max-restarts", type=int, default=3, help="单个分片崩溃后的最大重启次数")
+    parser.add_argument("--icebreak-turns", type=int, default=3, help="破冰轮数，设为 0 关闭漏斗 (每组都按 --max-turns 完整对话)")
+    parser.add_argument("--deep-turns", type=int, default=20, help="晋级后深聊的总轮数")
+    parser.add_argument("--promote-threshold", type=int, default=60, help="破冰快评达到该分数才进入深聊")
+    args = parser.parse_args()
+
+    api_key = os.getenv("KIMI_API_KEY") or os.getenv("MOONSHOT_API_KEY")
+    if not api_key:
+        raise SystemExit("请设置环境变量 KIMI_API_KEY")
+
+    funnel = None
+    if args.icebreak_turns > 0:
+        funnel = FunnelConfig(icebreak_turns=args.icebreak_turns, deep_turns=args.deep_turns, promote_threshold=args.promote_threshold)
+
+    sweep = PlazaSweep(
+        api_key,
+        num_shards=args.shards,
+        checkpoint_dir=os.path.join(args.checkpoint_dir, f"plaza_{args.run_id}"),
+        candidates_per_user=args.candidates,
+        concurrency=args.concurrency,
+        max_turns=args.max_turns,
+        max_restarts=args.max_restarts,
+        funnel=funnel
+    )
+    failed = sweep.run()
+    if failed:
+        raise SystemExit(f"分片 {failed} 未能完成，可使用相同 --run-id 重新运行以续跑")
+    print("🎉 广场扫描完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import argparse
+import os
+from src.llm_replay import ReplayLayer, ReplayStore, MODE_REPLAY
+
+
+def main():
+    parser = argparse.ArgumentParser(description="恋与代理人 - LLM 录制/回放库管理 (配合 LLM_REPLAY_MODE 使用)")
+    parser.add_argument("--db", default=os.getenv("LLM_REPLAY_DB", os.path.join("cache", "llm_replay.sqlite")), help="回放库路径")
+    sub = parser.add_subparsers(dest="command", required=True)
+    seed = sub.add_parser("seed", help="把 logs/ 中的聊天记录导入回放库")
+    seed.add_argument("--pattern", default=os.path.join("logs", "chat_as_*.json"), help="聊天记录文件的 glob")
+    sub.add_parser("stats", help="查看回放库中的记录数")
+    args = parser.parse_args()
+
+    layer = ReplayLayer(MODE_REPLAY, ReplayStore(args.db))
+    if args.command == "seed":
+        count = layer.seed_from_logs(args.pattern)
+        print(f"已导入 {count} 条发言 -> {args.db}")
+    print(layer.store.stats())
+
+
+if __name__ == "__main__":
+    main()
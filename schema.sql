@@ -51,3 +51,78 @@ with check (true);
 create policy "Enable update access for all users"
 on users for update
 using (true);
+
+-- 匹配任务队列 (后台 Worker 消费，UI 只负责入队与轮询)
+create table if not exists match_jobs (
+  id bigint primary key generated always as identity,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  user_a text not null, -- 发起方 username
+  user_b text not null, -- 接受方 username (虚拟嘉宾为 guest_xxx)
+  target_profile jsonb, -- 虚拟嘉宾不在 users 表中，入队时保存档案快照
+  status text not null default 'pending', -- pending / running / done / failed
+  attempts int not null default 0,
+  locked_by text, -- 领取任务的 worker id
+  locked_at timestamp with time zone,
+  error text
+);
+
+-- Worker 按 id 顺序领取待处理任务；UI 按发起方查询进度
+create index if not exists idx_match_jobs_status on match_jobs (status, id);
+create index if not exists idx_match_jobs_user_a on match_jobs (user_a, created_at desc);
+
+-- 候选人硬筛选：WHERE gender = ? AND location = ANY(?) AND age BETWEEN ? AND ?
+create index if not exists idx_users_gender_location_age on users (gender, location, age);
+-- 候选人 Keyset 分页：ORDER BY created_at DESC, id DESC
+create index if not exists idx_users_created_at_id on users (created_at desc, id desc);
+
+-- 用户画像向量 (兴趣 / 价值观 / 校准回答)，用于语义召回候选人
+-- 由 build_embeddings.py 离线构建，注册/更新资料时同步刷新
+create table if not exists user_embeddings (
+  username text primary key references users(username) on delete cascade,
+  embedding real[] not null,
+  model text not null, -- 向量算法版本，算法变更时需要重建
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- 评估状态：对话完成但评估失败时仍保存记录，标记为待重新评估 (不再伪造 50 分)
+alter table match_records add column if not exists eval_status text not null default 'ok'; -- ok / failed / screened (漏斗提前淘汰，分数为快评)
+-- 评估失败的记录不参与排行榜与“已聊过”统计 (漏斗淘汰的记录不参与排行榜)；广场扫描按发起方取出来重新评估
+create index if not exists idx_match_records_failed on match_records (user_a, id) where eval_status = 'failed';
+
+-- 侧边栏查询：排行榜 (WHERE user_a/user_b = ? ORDER BY match_score)、已聊用户 (GROUP BY 对方, MAX(match_score))、最近对话 (ORDER BY created_at)
+create index if not exists idx_match_records_user_a_score on match_records (user_a, match_score desc);
+create index if not exists idx_match_records_user_b_score on match_records (user_b, match_score desc);
+create index if not exists idx_match_records_created_at on match_records (created_at desc);
+
+-- 双方显示名冗余存储 (写入时确定)，排行榜/最近对话不再关联 users 表、也不再解析 chat_log
+alter table match_records add column if not exists user_a_name text;
+alter table match_records add column if not exists user_b_name text;
+alter table match_records add column if not exists user_b_virtual boolean not null default false; -- 虚拟嘉宾 (guest_xxx，不在 users 表)
+
+-- 回填旧记录：真实用户取 users.name；虚拟嘉宾取对话中第一个不是发起方的发言人
+-- 发起方名字未知时无法区分谁是嘉宾，宁可留空 (显示为 AI Guest) 也不猜
+update match_records r set user_a_name = u.name
+from users u
+where r.user_a_name is null and u.username = r.user_a;
+
+update match_records r set user_b_name = u.name
+from users u
+where r.user_b_name is null and u.username = r.user_b;
+
+update match_records r
+set user_b_virtual = true
+where not exists (select 1 from users u where u.username = r.user_b);
+
+update match_records r
+set user_b_name = (
+      select m->>'name'
+      from jsonb_array_elements(r.chat_log) as m
+      where m->>'name' not in (r.user_a_name, r.user_a, 'System')
+      limit 1
+    )
+where r.user_b_virtual and r.user_b_name is null and r.user_a_name is not null;
+
+-- 最近对话按发起方/接受方分别走索引 (UNION ALL 两段)
+create index if not exists idx_match_records_user_a_created on match_records (user_a, created_at desc);
+create index if not exists idx_match_records_user_b_created on match_records (user_b, created_at desc);
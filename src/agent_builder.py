@@ -62,6 +62,19 @@ class AgentProfile:
         """导出为 JSON 格式，用于传递给 LLM"""
         return json.dumps(self, default=lambda o: o.__dict__, ensure_ascii=False, indent=2)
 
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'AgentProfile':
+        """从 to_json() 导出的字典还原档案 (用于任务队列中的档案快照)"""
+        profile = cls(
+            user_id=data["user_id"],
+            name=data["name"],
+            attributes=HardAttributes(**data["attributes"]),
+            preferences=HardPreferences(**data["preferences"]),
+            persona=Persona(**data["persona"])
+        )
+        profile.is_active = data.get("is_active", False)
+        return profile
+
     def generate_system_prompt(self, turn_count: int = 1, target_profile: Optional['AgentProfile'] = None) -> str:
         """
         生成用于 LLM 的 System Prompt (增强版 - 注入灵魂 + 渐进式深度 + 动态态度)
@@ -70,6 +83,37 @@ class AgentProfile:
             turn_count (int): 当前对话轮数，用于控制话题深度
             target_profile (AgentProfile): 对方的资料，用于评估匹配度
         """
+        return self.generate_persona_prompt(target_profile) + "\n" + self.generate_phase_prompt(turn_count)
+
+    def pick_trap_question(self) -> str:
+        """
+        从自己的校准数据中随机挑一个话题作为“必考题”
+        """
+        if self.persona.turing_calibration_data:
+            import random
+            return random.choice(self.persona.turing_calibration_data)['question']
+        return "你对未来有什么规划？" # 默认兜底
+
+    def generate_phase_prompt(self, turn_count: int = 1, trap_question: Optional[str] = None) -> str:
+        """
+        生成随对话阶段变化的增量提示 (很短，每轮只需替换这一段)
+        """
+        if trap_question is None:
+            trap_question = self.pick_trap_question()
+
+        if turn_count <= 2:
+            phase_instruction = "【阶段1：破冰】\n- 刚开始认识，简单寒暄。\n- 如果态度是High，可以主动找话题；如果Low，就礼貌回复即可。"
+        elif turn_count <= 5:
+            phase_instruction = f"【阶段2：价值观探测 (Value Probing)】\n- 这是一个关键阶段！你需要通过提问来了解对方的价值观。\n- **强制任务**: 请自然地向对方抛出以下问题（这是你非常看重的一点）：\n  “{trap_question}”\n- 仔细观察对方的回答是否符合你的期待。"
+        else:
+            phase_instruction = "【阶段3：收尾 (Closing)】\n- 如果已经约定了下次聊/见面的时间，请直接简短告别（如“好的，那就这么定了，拜拜！”），**绝对不要**再发表长篇大论的感言。\n- 严禁复读对方的“一起成长”、“成为好朋友”等客套话。\n- 目标是干净利落地结束对话。"
+
+        return f"# Current Phase\n{phase_instruction}\n"
+
+    def generate_persona_prompt(self, target_profile: Optional['AgentProfile'] = None) -> str:
+        """
+        生成与对话轮次无关的静态人设提示 (整场对话保持不变，便于前缀复用)
+        """
         # 1. 基础人设与风格
         mbti_style = {
             "I": "你比较内向，说话不用太长，喜欢倾听，偶尔会有点社恐。",
@@ -122,24 +166,6 @@ class AgentProfile:
 目前你还不了解对方，请保持礼貌和好奇，尝试通过对话了解对方的信息。
 """
 
-        # 3. 渐进式对话深度控制
-        phase_instruction = ""
-        
-        # 尝试从自己的校准数据中提取一个话题作为“必考题”
-        trap_question = "你对未来有什么规划？" # 默认兜底
-        if self.persona.turing_calibration_data:
-            import random
-            # 随机选一个校准问题
-            calib_item = random.choice(self.persona.turing_calibration_data)
-            trap_question = calib_item['question']
-        
-        if turn_count <= 2:
-            phase_instruction = "【阶段1：破冰】\n- 刚开始认识，简单寒暄。\n- 如果态度是High，可以主动找话题；如果Low，就礼貌回复即可。"
-        elif turn_count <= 5:
-            phase_instruction = f"【阶段2：价值观探测 (Value Probing)】\n- 这是一个关键阶段！你需要通过提问来了解对方的价值观。\n- **强制任务**: 请自然地向对方抛出以下问题（这是你非常看重的一点）：\n  “{trap_question}”\n- 仔细观察对方的回答是否符合你的期待。"
-        else:
-            phase_instruction = "【阶段3：收尾 (Closing)】\n- 如果已经约定了下次聊/见面的时间，请直接简短告别（如“好的，那就这么定了，拜拜！”），**绝对不要**再发表长篇大论的感言。\n- 严禁复读对方的“一起成长”、“成为好朋友”等客套话。\n- 目标是干净利落地结束对话。"
-
         prompt = f"""
 # Role
 你不是AI，你是 **{self.name}**。
@@ -168,9 +194,6 @@ class AgentProfile:
 - **Follow-up**: 回答完之后，再决定是否反问或开启新话题。
 - 避免自说自话。
 
-# Current Phase
-{phase_instruction}
-
 # Context
 你正在和一个刚认识的陌生人聊天。只输出你回复的内容，不要输出心理活动。
 """
@@ -240,6 +263,27 @@ class AgentProfile:
             
         return min(max(score, 0), 10)
 
+    def hard_violations(self, target: 'AgentProfile') -> List[str]:
+        """
+        列出对方违反的硬性择偶标准，全部满足时返回空列表
+        只包含 _evaluate_match 已经在用的规则 (年龄差 / 身高)；地域与性别在候选人筛选阶段处理
+        """
+        prefs = getattr(self, 'preferences', None)
+        if prefs is None:
+            return []
+        violations = []
+        try:
+            if abs(int(self.attributes.age) - int(target.attributes.age)) > int(prefs.max_age_gap):
+                violations.append(f"年龄差超过 {prefs.max_age_gap} 岁")
+        except (TypeError, ValueError):
+            pass
+        try:
+            if int(target.attributes.height) < int(prefs.min_height):
+                violations.append(f"身高低于 {prefs.min_height}cm")
+        except (TypeError, ValueError):
+            pass
+        return violations
+
     def _get_attitude_guide(self, level):
         if level == "HIGH":
             return """
@@ -1,8 +1,13 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
 import agentscope
 from agentscope.agent import AgentBase
 from agentscope.message import Msg
-from agentscope.model import OpenAIChatModel
 from src.agent_builder import AgentProfile
+from src.llm_gateway import get_gateway, sanitize_api_key, DEFAULT_MODEL
+from src.rate_limiter import Priority
+from src.resilience import LLMCallError, RetryPolicy, INTERACTIVE_POLICY
+from src.prompt_builder import PromptBuilder
 import logging
 
 class SimpleMemory:
@@ -18,11 +23,82 @@ class SimpleMemory:
     def get_memory(self):
         return self.history
 
+class RollingSummaryMemory(SimpleMemory):
+    """
+    有界 Memory：保留最近 keep_last 条原文，更早的消息在后台增量折叠进一段摘要
+
+    - 折叠在后台 Task 中进行，不阻塞当前轮次；折叠完成前旧消息仍以原文保留
+    - 无论对话多长，进入 prompt 的只有 摘要 + 最近 K 条，长度基本恒定
+    - 摘要失败 (API 报错/限流) 后退避：跳过接下来 fold_batch * 2^(n-1) 次 add 再尝试，
+      连续失败 max_failures 次后本场对话不再折叠 (原文由 PromptBuilder 按 Token 预算截断)
+    """
+    def __init__(self, summarizer: Callable[[str, list], Awaitable[str]] = None, keep_last: int = 8, fold_batch: int = 4, max_failures: int = 3):
+        super().__init__()
+        self.summarizer = summarizer
+        self.keep_last = keep_last
+        self.fold_batch = fold_batch
+        self.max_failures = max_failures
+        self.summary = ""
+        self._folding: Optional[asyncio.Task] = None
+        self._failures = 0   # 连续失败次数
+        self._skip_adds = 0  # 退避中，还需跳过的 add 次数
+
+    def add(self, msg):
+        super().add(msg)
+        if self._skip_adds > 0:
+            self._skip_adds -= 1
+            return
+        self._maybe_fold()
+
+    def _maybe_fold(self):
+        if self.summarizer is None or self._failures >= self.max_failures:
+            return
+        if self._folding and not self._folding.done():
+            return
+        if len(self.history) < self.keep_last + self.fold_batch:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # 没有运行中的事件循环，下次 add 时再尝试
+        chunk = self.history[:self.fold_batch]
+        self._folding = loop.create_task(self._fold(chunk))
+
+    async def _fold(self, chunk: list):
+        try:
+            new_summary = await self.summarizer(self.summary, chunk)
+        except Exception as e:
+            self._failures += 1
+            self._skip_adds = self.fold_batch * 2 ** (self._failures - 1)
+            if self._failures >= self.max_failures:
+                print(f"[Memory] Summarize failed {self._failures} times, giving up folding for this chat: {e}")
+            else:
+                print(f"[Memory] Summarize failed, keeping messages verbatim (retry after {self._skip_adds} messages): {e}")
+            return
+        self._failures = 0
+        self.summary = new_summary.strip()
+        # 只移除已经折叠进摘要的消息 (期间可能有新消息加入)
+        folded = set(id(m) for m in chunk)
+        self.history = [m for m in self.history if id(m) not in folded]
+        self._folding = None
+        self._maybe_fold()
+
+    async def flush(self):
+        """等待进行中的折叠完成"""
+        while self._folding and not self._folding.done():
+            await self._folding
+
+    def cancel(self):
+        """对话结束时取消尚未完成的折叠"""
+        if self._folding and not self._folding.done():
+            self._folding.cancel()
+        self._folding = None
+
 class DatingAgent(AgentBase):
     """
     适配 AgentScope 的相亲 Agent
     """
-    def __init__(self, profile: AgentProfile, api_key: str, target_profile: AgentProfile = None):
+    def __init__(self, profile: AgentProfile, api_key: str, target_profile: AgentProfile = None, priority: Priority = Priority.INTERACTIVE):
         # 初始化 AgentBase (不带参数)
         super().__init__()
         
@@ -32,94 +108,115 @@ class DatingAgent(AgentBase):
         self.target_profile = target_profile # 记录对方信息
         self.turn_count = 1
         
-        # 生成初始 System Prompt (传入对方信息)
-        self.sys_prompt = profile.generate_system_prompt(turn_count=1, target_profile=target_profile)
+        # 静态人设只生成一次 (传入对方信息)，整场对话保持不变以复用前缀
+        # “必考题”也在开场时定下来，避免每轮随机导致阶段提示抖动
+        self.persona_prompt = profile.generate_persona_prompt(target_profile=target_profile)
+        self.trap_question = profile.pick_trap_question()
+        self.phase_prompt = profile.generate_phase_prompt(turn_count=1, trap_question=self.trap_question)
+        self.prompt_builder = PromptBuilder(self.persona_prompt)
         
-        # 净化 API Key：去除空白字符
-        if api_key:
-            # 强力净化：去除首尾空格，并强制只保留 ASCII 字符
-            api_key = api_key.strip()
-            try:
-                # 尝试编码为 ascii，忽略无法编码的字符（如中文、特殊符号）
-                api_key = api_key.encode('ascii', 'ignore').decode('ascii')
-            except Exception as e:
-                print(f"[Warning] Failed to sanitize API Key: {e}")
-                
-            # 简单的 ASCII 检查，如果包含非 ASCII 字符则打印警告
-            if not api_key.isascii():
-                print(f"[Warning] API Key contains non-ASCII characters! This may cause connection errors. Key: {api_key[:5]}...")
-        
-        # 直接初始化 OpenAIChatModel
-        # 使用 Kimi (Moonshot AI) 的配置
-        self.model = OpenAIChatModel(
-            model_name="moonshot-v1-8k",
-            api_key=api_key,
-            stream=False, # 禁用流式输出，确保返回完整的 ChatResponse 对象
-            client_kwargs={
-                "base_url": "https://api.moonshot.cn/v1",
-            }
-        )
+        # 模型调用统一走进程级网关 (复用连接池)
+        self.api_key = sanitize_api_key(api_key)
+        self.model_name = DEFAULT_MODEL
+        self.priority = priority # 限流调度优先级
+        # 交互式对话启用对冲请求，后台任务使用网关默认策略
+        self.retry_policy: RetryPolicy = INTERACTIVE_POLICY if priority == Priority.INTERACTIVE else None
+        self.gateway = get_gateway()
         
-        # 初始化 Memory
-        self.memory = SimpleMemory()
+        # 初始化 Memory (最近若干条原文 + 滚动摘要)
+        self.memory = RollingSummaryMemory(summarizer=self._summarize)
 
-    async def reply(self, x: dict = None) -> dict:
+    async def reply(self, x: dict = None, on_chunk: Optional[Callable[[str], None]] = None) -> dict:
         """
         AgentScope Agent 的核心回复方法
+
+        on_chunk: 可选，流式输出时以“目前为止的完整文本”逐段回调
         """
         # 1. 记录对方的消息到 memory
         if x:
             self.memory.add(x)
             
-        # 2. 准备 prompt
-        # 手动构造 OpenAI 格式的消息列表
-        messages = [{"role": "system", "content": self.sys_prompt}]
-        
-        # 将历史记录转换为 OpenAI 格式
-        for msg in self.memory.get_memory():
-            role = msg.role
-            content = msg.content
-            # 确保 role 是 user/assistant/system 之一
-            if role not in ["user", "assistant", "system"]:
-                role = "user" # 默认 fallback
-            messages.append({"role": role, "content": content})
-            
-        # 3. 调用模型
-        # OpenAIChatModel.__call__ 是异步的，直接 await
-        response = await self.model(messages=messages)
-        
-        # 4. 解析响应
-        # response 是 ChatResponse 对象
-        # content 是一个 list，包含 TextBlock 等 (但可能是 dict 形式)
-        text_content = ""
-        for block in response.content:
-            # 兼容对象属性访问和字典访问
-            block_type = block.type if hasattr(block, "type") else block.get("type")
+        # 2. 准备 prompt: 静态人设 + 历史 (按 Token 预算截断) + 阶段增量
+        messages = self.prompt_builder.build(self._history_messages(), self.phase_prompt, summary=self.memory.summary)
             
-            if block_type == "text":
-                text = block.text if hasattr(block, "text") else block.get("text")
-                text_content += text
-            elif block_type == "thinking":
-                # 可以选择是否包含思考过程
-                pass
+        # 3. 调用模型 (通过共享网关，异步；超时/退避重试/对冲由网关负责)
+        try:
+            text_content = await self.gateway.chat(
+                messages, self.api_key,
+                model=self.model_name,
+                priority=self.priority,
+                retry_policy=self.retry_policy,
+                on_chunk=on_chunk
+            )
+        except LLMCallError:
+            # 回滚本轮写入的对方消息，保证调用方重试时 memory 不重复
+            if x and self.memory.history and self.memory.history[-1] is x:
+                self.memory.history.pop()
+            raise
                 
-        # 5. 记录自己的回复
+        # 4. 记录自己的回复
         msg = Msg(self.name, text_content, role="assistant")
         self.memory.add(msg)
         
         return msg
 
+    def _history_messages(self) -> list:
+        """
+        将 memory 转换为 OpenAI 格式：自己说的是 assistant，对方说的是 user
+        """
+        messages = []
+        for msg in self.memory.get_memory():
+            role = msg.role
+            if role != "system":
+                role = "assistant" if msg.name == self.name else "user"
+            messages.append({"role": role, "content": msg.content})
+        return messages
+
+    async def _summarize(self, summary: str, msgs: list) -> str:
+        """
+        将若干条旧消息增量合并进已有摘要 (后台任务，低优先级)
+        """
+        dialogue = "\n".join(f"{m.name}: {m.content}" for m in msgs)
+        prompt = f"""你是 {self.name} 的记忆助手。请把【新对话】合并进【已有摘要】，输出更新后的摘要。
+要求：第三人称，保留双方透露的关键信息 (经历、观点、约定、价值观表态)，不超过 150 字，只输出摘要本身。
+
+【已有摘要】
+{summary or "（无）"}
+
+【新对话】
+{dialogue}
+"""
+        return await self.gateway.chat(
+            [{"role": "user", "content": prompt}], self.api_key,
+            model=self.model_name,
+            temperature=0.3,
+            priority=Priority.BATCH,
+            max_tokens=300
+        )
+
+    @property
+    def sys_prompt(self) -> str:
+        """完整的 System Prompt (人设 + 当前阶段)，仅用于展示/调试"""
+        return self.persona_prompt + "\n" + self.phase_prompt
+
+    async def prepare_turn(self):
+        """
+        为下一次发言做准备 (更新阶段提示 + 预热 prompt 构造)
+
+        ChatSession 在对方生成回复期间并发调用，轮到自己时只需追加对方的最新消息
+        """
+        self.update_system_prompt()
+        self.prompt_builder.warm(self._history_messages())
+
     def update_system_prompt(self):
         """
-        根据轮次更新 system prompt
+        根据轮次更新阶段提示 (静态人设不变，只替换很短的阶段增量)
         """
         self.turn_count += 1
-        # 更新时同样传入 target_profile
-        new_prompt = self.profile.generate_system_prompt(
-            turn_count=self.turn_count, 
-            target_profile=self.target_profile
+        self.phase_prompt = self.profile.generate_phase_prompt(
+            turn_count=self.turn_count,
+            trap_question=self.trap_question
         )
-        self.sys_prompt = new_prompt
 
 _agentscope_inited = False
 
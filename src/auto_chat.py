@@ -1,10 +1,13 @@
+import time
 import agentscope
 from agentscope.agent import AgentBase, UserAgent
 from agentscope.message import Msg
-# 彻底放弃 agentscope 的模型封装，直接用 openai 原生库，稳如老狗
-from openai import OpenAI
 from src.agent_builder import AgentProfile
 from src.agentscope_adapter import SimpleMemory
+from src.llm_gateway import get_gateway, sanitize_api_key, DEFAULT_MODEL
+from src.rate_limiter import Priority
+from src.resilience import LLMCallError
+from src.termination import TerminationDetector
 
 # 手动定义 DialogAgent，适配 agentscope 1.0.15+
 class DialogAgent(AgentBase):
@@ -14,15 +17,9 @@ class DialogAgent(AgentBase):
         self.sys_prompt = sys_prompt
         self.memory = SimpleMemory()  # 初始化 memory
         
-        # 使用原生 OpenAI 客户端（同步模式）
-        try:
-            self.client = OpenAI(
-                api_key=api_key,
-                base_url="https://api.moonshot.cn/v1", # 既然是 Kimi，直接指定 base_url
-            )
-        except Exception as e:
-            print(f"Warning: Failed to instantiate OpenAI Client: {e}")
-            self.client = None
+        # 模型调用统一走进程级网关 (同步包装，复用连接池)
+        self.api_key = sanitize_api_key(api_key)
+        self.gateway = get_gateway()
 
     def __call__(self, *args, **kwargs) -> Msg:
         # 强制覆盖父类 AgentBase 的 async __call__
@@ -57,25 +54,17 @@ class DialogAgent(AgentBase):
                 msgs.append({"role": role, "content": content})
         
         # 调用模型 (同步调用，绝对不会返回 coroutine)
-        if self.client:
-            try:
-                completion = self.client.chat.completions.create(
-                    model="moonshot-v1-8k",
-                    messages=msgs,
-                    temperature=0.7,
-                )
-                
-                content_str = completion.choices[0].message.content
-                
-                # 构造返回的 Msg
-                res_msg = Msg(name=self.name, content=content_str, role="assistant")
-                self.memory.add(res_msg)
-                return res_msg
-                
-            except Exception as e:
-                return Msg(name=self.name, content=f"[Model Error: {e}]", role="assistant")
-        else:
-            return Msg(name=self.name, content="[Error: No model loaded]", role="assistant")
+        # 网关内部负责超时与退避重试；重试耗尽抛出 LLMCallError，
+        # 不再把错误文本伪装成回复写进对话 (否则会污染后续对话与评估)
+        if not self.api_key:
+            raise LLMCallError("No API key configured")
+
+        content_str = self.gateway.chat_sync(msgs, self.api_key, model=DEFAULT_MODEL, temperature=0.7, priority=Priority.BATCH)
+        
+        # 构造返回的 Msg
+        res_msg = Msg(name=self.name, content=content_str, role="assistant")
+        self.memory.add(res_msg)
+        return res_msg
 
     def reply(self, x: dict = None) -> Msg:
         return self._reply_sync(x)
@@ -89,6 +78,9 @@ class AutoChatController:
         self.profile_b = agent_b_profile
         self.api_key = model_config_name # 这里其实传进来的是 api_key
         self.history = []
+        # 本地终止检测：道别 / 复读 / 一方敷衍时提前结束
+        self.terminator = TerminationDetector()
+        self.stop_reason = None
         
         # 初始化 Agents
         self.agent_a = self._create_agent(self.profile_a)
@@ -144,6 +136,10 @@ class AutoChatController:
             self.history.append(msg_a)
             
             current_msg = msg_a
+
+            self.stop_reason = self.terminator.check([{"name": m.name, "content": m.content} for m in self.history])
+            if self.stop_reason:
+                break
             
             # 简单模拟思考时间，避免请求过快
             time.sleep(1)
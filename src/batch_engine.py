@@ -0,0 +1,143 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import List, Dict, Callable, Optional
+from src.agent_builder import AgentProfile
+from src.engine import ChatSession
+from src.evaluator import MatchEvaluator, EvaluationBatcher, EvaluationError
+from src.funnel import FunnelConfig, MatchFunnel, STAGE_DEEP, verdict_report
+from src.rate_limiter import Priority
+from src.llm_gateway import run_sync
+
+
+@dataclass
+class PairResult:
+    """单个嘉宾的匹配结果"""
+    target: AgentProfile
+    history: List[Dict[str, str]] = field(default_factory=list)
+    report: Dict = field(default_factory=dict)
+    score: int = 0
+    error: Optional[str] = None
+    stage: str = STAGE_DEEP # 漏斗阶段 (未启用漏斗时即完整对话)
+    evaluation_failed: bool = False # 对话完成但评估失败：记录照常保存，标记为待重新评估
+
+    @property
+    def eval_status(self) -> str:
+        """
+        保存记录时的评估状态：'failed' 待重新评估；'screened' 被漏斗提前淘汰，只有快评分数
+        """
+        if self.evaluation_failed:
+            return "failed"
+        return "ok" if self.stage == STAGE_DEEP else "screened"
+
+
+class BatchMatchEngine:
+    """
+    并发批量匹配引擎：同时运行多组双人对话，受并发上限约束
+
+    - 每组对话基于异步的 DatingAgent.reply (通过 ChatSession)
+    - on_progress: 每条消息/每组完成时回调，用于 UI 实时展示
+    - on_result: 每组对话评估完成后立即回调，用于持久化
+    - funnel: 传入 FunnelConfig 时按“破冰 -> 快评晋级 -> 深聊”分阶段推进，
+      只有完成深聊的嘉宾才做完整评估 (此时 max_turns 由 funnel.deep_turns 决定)
+    """
+    def __init__(
+        self,
+        user_profile: AgentProfile,
+        api_key: str,
+        concurrency: int = 4,
+        max_turns: int = 5,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+        on_result: Optional[Callable[[PairResult], None]] = None,
+        funnel: Optional[FunnelConfig] = None
+    ):
+        self.user_profile = user_profile
+        self.api_key = api_key
+        self.concurrency = max(1, concurrency)
+        self.max_turns = max_turns
+        self.on_progress = on_progress
+        self.on_result = on_result
+        # 批量任务属于后台工作，让位于交互式的深度聊天
+        self.evaluator = MatchEvaluator(api_key, priority=Priority.BATCH)
+        # 相近时间结束的对话合并评估，减少评估请求的往返次数
+        self.batcher = EvaluationBatcher(self.evaluator, max_pack_size=min(MatchEvaluator.MAX_PACK_SIZE, self.concurrency))
+        self.funnel = MatchFunnel(self.evaluator, funnel) if funnel else None
+
+    def _emit(self, event: Dict):
+        if self.on_progress:
+            try:
+                self.on_progress(event)
+            except Exception as e:
+                print(f"[BatchEngine] on_progress error: {e}")
+
+    async def _run_pair(self, target: AgentProfile, semaphore: asyncio.Semaphore) -> PairResult:
+        async with semaphore:
+            result = PairResult(target=target)
+            self._emit({"type": "start", "target": target})
+
+            def on_message(name: str, content: str):
+                self._emit({"type": "message", "target": target, "name": name, "content": content})
+
+            try:
+                session = ChatSession(
+                    self.user_profile, target,
+                    model_config_name=self.api_key,
+                    on_message=on_message,
+                    priority=Priority.BATCH
+                )
+                if self.funnel:
+                    outcome = await self.funnel.run_async(
+                        session, self.user_profile, target,
+                        on_turn=lambda turn, max_turns: self._emit({"type": "turn", "target": target, "turn": turn, "max_turns": max_turns}),
+                        on_stage=lambda stage, verdict: self._emit({"type": "stage", "target": target, "stage": stage, "verdict": verdict})
+                    )
+                    result.stage = outcome.stage
+                else:
+                    await session.run_async(
+                        self.max_turns,
+                        on_turn=lambda turn: self._emit({"type": "turn", "target": target, "turn": turn, "max_turns": self.max_turns})
+                    )
+
+                result.history = session.history
+                if result.stage == STAGE_DEEP:
+                    try:
+                        result.report = await self.batcher.submit(session.history, self.user_profile, target)
+                    except EvaluationError as e:
+                        # 对话本身代价高昂，评估失败也不丢弃
+                        print(f"[BatchEngine] {target.name} evaluation failed: {e}")
+                        result.report = e.report
+                        result.evaluation_failed = True
+                else:
+                    # 破冰未晋级 / 深聊止损：不再花一次完整评估
+                    result.report = verdict_report(outcome)
+                result.score = result.report.get("total_score", 0)
+            except Exception as e:
+                print(f"[BatchEngine] {target.name} failed: {e}")
+                result.error = str(e)
+                self._emit({"type": "error", "target": target, "error": result.error})
+                return result
+
+            # 评估完成立即持久化，不等待整批结束
+            if self.on_result:
+                try:
+                    self.on_result(result)
+                except Exception as e:
+                    print(f"[BatchEngine] on_result error: {e}")
+
+            self._emit({"type": "done", "target": target, "result": result})
+            return result
+
+    async def run_async(self, targets: List[AgentProfile], semaphore: Optional[asyncio.Semaphore] = None) -> List[PairResult]:
+        """
+        并发执行所有嘉宾的对话与评估，返回顺序与 targets 一致
+
+        semaphore: 可选，多个引擎共享同一个并发上限 (如广场扫描时同一分片内的多个用户)
+        """
+        semaphore = semaphore or asyncio.Semaphore(self.concurrency)
+        tasks = [self._run_pair(target, semaphore) for target in targets]
+        return await asyncio.gather(*tasks)
+
+    def run(self, targets: List[AgentProfile]) -> List[PairResult]:
+        """
+        同步包装器 (供 Streamlit 调用)
+        """
+        return run_sync(self.run_async(targets))
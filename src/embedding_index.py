@@ -0,0 +1,165 @@
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from src.agent_builder import AgentProfile
+
+EMBEDDING_DIM = 256
+EMBEDDING_MODEL = "hash-ngram-v1" # 写入数据库的向量版本，算法变更时需要重建
+
+# 各字段权重：兴趣最能反映共同话题，校准回答偏长且噪声较多
+FIELD_WEIGHTS = {
+    "interests": 1.0,
+    "values": 0.8,
+    "calibration": 0.5,
+}
+
+
+def _is_cjk(ch: str) -> bool:
+    return "一" <= ch <= "鿿"
+
+
+def _ngrams(text: str) -> Iterable[str]:
+    """
+    中文按字符 1-3 gram (“科幻”与“科幻电影”共享 gram)，英文按小写单词
+    """
+    text = text.strip().lower()
+    word = ""
+    cjk_run = ""
+    for ch in text + " ":
+        if _is_cjk(ch):
+            if word:
+                yield word
+                word = ""
+            cjk_run += ch
+            continue
+        if cjk_run:
+            for n in (1, 2, 3):
+                for i in range(len(cjk_run) - n + 1):
+                    yield cjk_run[i:i + n]
+            cjk_run = ""
+        if ch.isalnum():
+            word += ch
+        elif word:
+            yield word
+            word = ""
+
+
+class HashingVectorizer:
+    """
+    确定性哈希向量化 (无需下载模型)：n-gram 经 crc32 映射到固定维度，带符号哈希减少冲突偏差
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _add_text(self, vec: np.ndarray, text: str, weight: float):
+        for gram in _ngrams(text):
+            h = zlib.crc32(gram.encode("utf-8"))
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            # 长 gram 更具区分度，给更高权重
+            vec[h % self.dim] += sign * weight * len(gram)
+
+    def encode(self, profile: AgentProfile) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for tag in profile.persona.interests or []:
+            self._add_text(vec, tag, FIELD_WEIGHTS["interests"])
+        calibration = list(profile.persona.turing_calibration_data or [])
+        for kw in profile.persona.values_keywords or []:
+            if isinstance(kw, dict):
+                # 生成器的虚拟用户把校准问答放在了 values_keywords 位置
+                calibration.append(kw)
+                continue
+            self._add_text(vec, kw, FIELD_WEIGHTS["values"])
+        for item in calibration:
+            self._add_text(vec, str(item.get("answer", "")), FIELD_WEIGHTS["calibration"])
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def encode_many(self, profiles: Sequence[AgentProfile]) -> np.ndarray:
+        if not profiles:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.encode(p) for p in profiles])
+
+
+class EmbeddingIndex:
+    """
+    近似最近邻索引：随机超平面 LSH (多表 + 单比特多探针)，候选集再用精确余弦重排
+
+    数据量较小时直接暴力计算，结果精确
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM, num_tables: int = 8, num_bits: int = 10, brute_force_below: int = 2000, seed: int = 42):
+        self.dim = dim
+        self.num_bits = num_bits
+        self.brute_force_below = brute_force_below
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((num_tables, num_bits, dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(num_bits)).astype(np.int64)
+        self.ids: List[str] = []
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.tables: List[Dict[int, List[int]]] = [dict() for _ in range(num_tables)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _hash(self, vectors: np.ndarray) -> np.ndarray:
+        # (tables, n) 的桶编号
+        bits = np.einsum("tbd,nd->tnb", self.planes, vectors) > 0
+        return bits.astype(np.int64) @ self._bit_weights
+
+    def build(self, ids: List[str], vectors: np.ndarray):
+        self.ids = list(ids)
+        self.vectors = np.asarray(vectors, dtype=np.float32).reshape(len(self.ids), self.dim)
+        self.tables = [dict() for _ in range(len(self.planes))]
+        if not self.ids:
+            return
+        keys = self._hash(self.vectors)
+        for t, table in enumerate(self.tables):
+            for row, key in enumerate(keys[t]):
+                table.setdefault(int(key), []).append(row)
+
+    def _candidate_rows(self, vector: np.ndarray) -> np.ndarray:
+        keys = self._hash(vector[None, :])[:, 0]
+        rows = set()
+        for t, table in enumerate(self.tables):
+            key = int(keys[t])
+            rows.update(table.get(key, ()))
+            # 多探针：翻转任意一位的相邻桶
+            for b in range(self.num_bits):
+                rows.update(table.get(key ^ (1 << b), ()))
+        return np.fromiter(rows, dtype=np.int64)
+
+    def query(self, vector: np.ndarray, top_k: int = 50, exclude: Optional[set] = None) -> List[Tuple[str, float]]:
+        """
+        返回与 vector 最相似的 top_k 个 (id, 余弦相似度)
+        """
+        if not self.ids:
+            return []
+        exclude = exclude or set()
+        if len(self.ids) < self.brute_force_below:
+            rows = np.arange(len(self.ids))
+        else:
+            rows = self._candidate_rows(vector)
+            if len(rows) < top_k + len(exclude):
+                rows = np.arange(len(self.ids)) # 桶太稀疏，退回精确计算
+        sims = self.vectors[rows] @ vector
+        order = np.argsort(-sims, kind="stable")
+        result = []
+        for i in order:
+            item_id = self.ids[rows[i]]
+            if item_id in exclude:
+                continue
+            result.append((item_id, float(sims[i])))
+            if len(result) >= top_k:
+                break
+        return result
+
+
+def recall_candidates(user: AgentProfile, candidates: List[AgentProfile], top_k: int = 10, vectorizer: Optional[HashingVectorizer] = None) -> List[Tuple[AgentProfile, float]]:
+    """
+    在给定候选池内做语义召回 (按兴趣/价值观/校准回答的相似度排序)
+    """
+    if not candidates:
+        return []
+    vectorizer = vectorizer or HashingVectorizer()
+    sims = vectorizer.encode_many(candidates) @ vectorizer.encode(user)
+    order = np.argsort(-sims, kind="stable")[:top_k]
+    return [(candidates[i], float(sims[i])) for i in order]
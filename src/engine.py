@@ -1,21 +1,30 @@
 import time
 import json
 import os
+import inspect
 from datetime import datetime
-from typing import List, Dict, Callable, Optional
+from typing import List, Dict, Callable, Optional, Union, Awaitable
 from src.agent_builder import AgentProfile
 from src.agentscope_adapter import DatingAgent
+from src.rate_limiter import Priority
+from src.llm_gateway import run_sync
+from src.termination import TerminationDetector, FAREWELL_REASON
 from agentscope.message import Msg
 
 import asyncio
 
+DEFAULT_TERMINATOR = TerminationDetector()
+
 class ChatSession:
     def __init__(
         self, 
         agent_a_profile: AgentProfile, 
         agent_b_profile: AgentProfile, 
         model_config_name: str, # 这里其实接收的是 api_key，如果我们在 app.py 里改一下的话
-        on_message: Optional[Callable[[str, str], None]] = None
+        on_message: Optional[Callable[[str, str], None]] = None,
+        priority: Priority = Priority.INTERACTIVE,
+        on_chunk: Optional[Callable[[str, str], None]] = None,
+        terminator: Optional[TerminationDetector] = DEFAULT_TERMINATOR
     ):
         # 兼容性处理：如果 model_config_name 是 "kimi_chat" 这种字符串，
         # 说明 app.py 还没改。我们需要 api_key。
@@ -30,12 +39,23 @@ class ChatSession:
         
         # 使用 AgentScope 的 Agent
         # 互相传入对方的 profile，实现知己知彼
-        self.agent_a = DatingAgent(agent_a_profile, self.api_key, target_profile=agent_b_profile)
-        self.agent_b = DatingAgent(agent_b_profile, self.api_key, target_profile=agent_a_profile)
+        # priority: 深度聊天室为交互优先级，批量匹配传入 Priority.BATCH
+        self.agent_a = DatingAgent(agent_a_profile, self.api_key, target_profile=agent_b_profile, priority=priority)
+        self.agent_b = DatingAgent(agent_b_profile, self.api_key, target_profile=agent_a_profile, priority=priority)
         
         self.history: List[Dict[str, str]] = [] 
         self.on_message = on_message
+        # on_chunk(name, text_so_far): 传入时开启流式输出，用于聊天室逐字展示
+        self.on_chunk = on_chunk
         self.max_turns = 8
+        # 本地终止检测：双方道别 / 复读 / 一方敷衍时提前结束，传 None 关闭
+        self.terminator = terminator
+        # 已完成的轮数与提前结束原因 (run_async 可分多次调用，在同一场对话上继续)
+        self.turns_done = 0
+        self.stop_reason: Optional[str] = None
+        # 因双方道别而结束 (正常聊完)；为 False 时 stop_reason 表示冷场或快评止损
+        self.completed = False
+        self._pending_prep = None
 
     async def run_turn_async(self, turn: int):
         """
@@ -53,24 +73,106 @@ class ChatSession:
             last_msg = Msg(name=last_entry["name"], content=last_entry["content"], role="assistant")
 
         # Agent A 发言 (异步调用)
-        response_a = await self.agent_a(last_msg)
+        response_a = await self.agent_a(last_msg, on_chunk=self._chunk_callback(self.agent_a.name))
         self._record_message(self.agent_a.name, response_a.content)
         
         # Agent B 发言 (异步调用)
-        response_b = await self.agent_b(response_a)
+        response_b = await self.agent_b(response_a, on_chunk=self._chunk_callback(self.agent_b.name))
         self._record_message(self.agent_b.name, response_b.content)
 
+    def _chunk_callback(self, name: str) -> Optional[Callable[[str], None]]:
+        if not self.on_chunk:
+            return None
+        return lambda text: self.on_chunk(name, text)
+
+    async def run_async(
+        self,
+        max_turns: Optional[int] = None,
+        on_turn: Optional[Callable[[int], None]] = None,
+        should_stop: Optional[Callable[[int, List[Dict[str, str]]], Union[Optional[str], Awaitable[Optional[str]]]]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        以单个异步任务跑完整场对话 (流水线模式)
+
+        一方生成回复 (等待网络/流式输出) 期间，另一方并发完成阶段更新与 prompt 预热；
+        轮次之间不再人为 sleep。
+
+        - max_turns: 对话总轮数；再次调用时从已完成的轮数继续 (漏斗的破冰 -> 深聊)
+        - should_stop(turn, history): 每轮结束后调用 (可为 async)，返回非空原因即提前结束，
+          原因记录在 self.stop_reason；本地终止检测 (self.terminator) 先于它执行
+          双方道别时 self.completed 为 True (正常聊完，不算提前结束)
+        """
+        max_turns = max_turns or self.max_turns
+        self.stop_reason = None
+        self.completed = False
+        if self.turns_done >= max_turns:
+            return self.history
+
+        prep_a = self._pending_prep or asyncio.ensure_future(self.agent_a.prepare_turn())
+        self._pending_prep = None
+        prep_b = None
+        try:
+            for turn in range(self.turns_done + 1, max_turns + 1):
+                await prep_a
+                if not self.history:
+                    last_msg = Msg(name="System", content="你们现在开始相亲了，请开始聊天。", role="system")
+                else:
+                    last_entry = self.history[-1]
+                    last_msg = Msg(name=last_entry["name"], content=last_entry["content"], role="assistant")
+
+                # A 发言的同时，B 准备
+                prep_b = asyncio.ensure_future(self.agent_b.prepare_turn())
+                response_a = await self.agent_a(last_msg, on_chunk=self._chunk_callback(self.agent_a.name))
+                self._record_message(self.agent_a.name, response_a.content)
+                await prep_b
+
+                # B 发言的同时，A 为下一轮准备
+                if turn < max_turns:
+                    prep_a = asyncio.ensure_future(self.agent_a.prepare_turn())
+                response_b = await self.agent_b(response_a, on_chunk=self._chunk_callback(self.agent_b.name))
+                self._record_message(self.agent_b.name, response_b.content)
+                self.turns_done = turn
+
+                if on_turn:
+                    on_turn(turn)
+
+                reason = self.terminator.check(self.history) if self.terminator else None
+                if not reason and should_stop:
+                    reason = should_stop(turn, self.history)
+                    if inspect.isawaitable(reason):
+                        reason = await reason
+                if reason:
+                    self.stop_reason = reason
+                    self.completed = reason == FAREWELL_REASON
+                    # A 已为下一轮做好准备，留给后续的 run_async 继续使用
+                    if turn < max_turns:
+                        self._pending_prep = prep_a
+                    break
+        finally:
+            for task in (prep_a, prep_b):
+                if task and task is not self._pending_prep and not task.done():
+                    task.cancel()
+            self.agent_a.memory.cancel()
+            self.agent_b.memory.cancel()
+
+        return self.history
+
+    def run(
+        self,
+        max_turns: Optional[int] = None,
+        on_turn: Optional[Callable[[int], None]] = None,
+        should_stop: Optional[Callable[[int, List[Dict[str, str]]], Union[Optional[str], Awaitable[Optional[str]]]]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        同步包装器：整场对话只进入一次事件循环
+        """
+        return run_sync(self.run_async(max_turns, on_turn, should_stop))
+
     def run_turn_sync(self, turn: int):
         """
         执行一轮对话 (Agent A -> Agent B) - 同步包装器
         """
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-        loop.run_until_complete(self.run_turn_async(turn))
+        run_sync(self.run_turn_async(turn))
 
     # 保留旧方法名以兼容（如果不改 app.py 的话），但建议改 app.py
     def run_turn(self, turn: int):
@@ -0,0 +1,135 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def _normalize_text(text: str) -> str:
+    # 折叠空白，避免同一段对话因换行/空格差异得到不同的键
+    return " ".join(str(text or "").split())
+
+
+def _profile_digest(profile) -> Dict:
+    """
+    评估 prompt 中用到的档案字段 (嘉宾资料行)
+    """
+    return {
+        "name": profile.name,
+        "age": profile.attributes.age,
+        "job": profile.attributes.job,
+        "mbti": profile.persona.mbti,
+    }
+
+
+def evaluation_key(chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile, prompt_version: str) -> str:
+    """
+    内容寻址的缓存键：sha256(规范化的聊天记录 + 甲方校准数据 + 双方资料 + 评估 prompt 版本)
+    """
+    payload = {
+        "v": prompt_version,
+        "chat": [[_normalize_text(m.get("name")), _normalize_text(m.get("content"))] for m in chat_history],
+        "calibration": [
+            [_normalize_text(item.get("question")), _normalize_text(item.get("answer"))]
+            for item in agent_a_profile.persona.turing_calibration_data or []
+            if isinstance(item, dict)
+        ],
+        "a": _profile_digest(agent_a_profile),
+        "b": _profile_digest(agent_b_profile),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EvaluationCache:
+    """
+    评估报告缓存：内存 LRU + 磁盘 (每个键一个 JSON 文件)，线程安全
+
+    同一段对话重复评估 (排行榜回看、重试、崩溃后重跑) 时直接返回同一份报告，不再调用 LLM
+    """
+    def __init__(self, capacity: int = 512, disk_dir: Optional[str] = None):
+        self.capacity = capacity
+        self.disk_dir = disk_dir
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        # 按前两位分目录，避免单目录文件过多
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            report = self._memory.get(key)
+            if report is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(report)
+
+        report = self._read_disk(key)
+        with self._lock:
+            if report is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, report)
+        return copy.deepcopy(report)
+
+    def put(self, key: str, report: Dict):
+        report = copy.deepcopy(report)
+        with self._lock:
+            self._remember(key, report)
+        self._write_disk(key, report)
+
+    def _remember(self, key: str, report: Dict):
+        self._memory[key] = report
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"[EvalCache] unreadable entry {key[:12]}: {e}")
+            return None
+
+    def _write_disk(self, key: str, report: Dict):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False)
+            # 原子替换：并发进程 (Worker/广场分片) 不会读到半个文件
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[EvalCache] write failed {key[:12]}: {e}")
+
+
+_cache: Optional[EvaluationCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_evaluation_cache() -> EvaluationCache:
+    """
+    进程级共享缓存；磁盘目录由环境变量 EVAL_CACHE_DIR 指定 (默认 cache/evaluations，设为空串只用内存)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            disk_dir = os.getenv("EVAL_CACHE_DIR", os.path.join("cache", "evaluations")) or None
+            _cache = EvaluationCache(capacity=int(os.getenv("EVAL_CACHE_SIZE", "512")), disk_dir=disk_dir)
+        return _cache
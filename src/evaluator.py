@@ -1,55 +1,31 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Set, Tuple, Union
+import asyncio
+import dataclasses
 import json
-from agentscope.model import OpenAIChatModel
+from src.llm_gateway import get_gateway, sanitize_api_key, run_sync, DEFAULT_MODEL
+from src.rate_limiter import Priority
+from src.prompt_builder import count_tokens
+from src.prejudge import PreJudge, prejudge_report
+from src.json_repair import parse_partial_json, IncrementalJSONParser
+from src.resilience import LLMCallError
+from src.eval_cache import get_evaluation_cache, evaluation_key
 
-class MatchEvaluator:
-    """
-    严苛的对话质量评估器
-    """
-    def __init__(self, api_key: str):
-        # 使用独立的 Evaluation Model (通常可以使用更强大的模型，这里复用 Kimi)
-        self.model = OpenAIChatModel(
-            model_name="moonshot-v1-8k",
-            api_key=api_key,
-            stream=False,
-            client_kwargs={
-                "base_url": "https://api.moonshot.cn/v1",
-            }
-        )
-
-    def evaluate(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Dict:
-        """
-        对聊天记录进行多维度评分 (引入图灵校准作为基准)
-        """
-        # 1. 整理对话记录
-        dialogue_text = ""
-        for msg in chat_history:
-            dialogue_text += f"{msg['name']}: {msg['content']}\n"
+# 评估报告的字段约定 (单段与批量评估共用)
+REPORT_SCORE_FIELDS = ("interaction_score", "values_score", "chemistry_score", "total_score")
+REPORT_TEXT_FIELDS = ("interaction_comment", "values_comment", "chemistry_comment", "final_verdict", "suggestion")
+# 必须由模型给出的字段 (缺失时追问)；其余文本字段缺失时补空串
+REPORT_REQUIRED_FIELDS = REPORT_SCORE_FIELDS + ("final_verdict",)
 
-        # 2. 提取用户 (Agent A) 的校准基准
-        calibration_benchmark = ""
-        if agent_a_profile.persona.turing_calibration_data:
-            calibration_benchmark = "【甲方（用户）的价值观基准】\n"
-            for item in agent_a_profile.persona.turing_calibration_data:
-                calibration_benchmark += f"- 问题: {item['question']}\n  - 甲方期望的理想回答/甲方自己的回答: {item['answer']}\n"
-        else:
-            calibration_benchmark = "（甲方未提供价值观校准数据，请根据常理判断）"
+# Moonshot 的 JSON Mode：保证输出是合法的 JSON 对象
+JSON_MODE = {"type": "json_object"}
 
-        # 3. 构造 Evaluation Prompt
-        prompt = f"""
-你是一位极其严苛、目光毒辣的**情感与沟通专家**。
-请根据以下两人的聊天记录，评估他们是否真的合适。
+# 评估 prompt / 报告字段的版本号，参与缓存键计算；修改评估标准时递增，旧缓存自动失效
+EVALUATOR_PROMPT_VERSION = "2"
 
-【嘉宾资料】
-甲方 (用户): {agent_a_profile.name} ({agent_a_profile.attributes.age}岁, {agent_a_profile.attributes.job}, {agent_a_profile.persona.mbti})
-乙方 (候选人): {agent_b_profile.name} ({agent_b_profile.attributes.age}岁, {agent_b_profile.attributes.job}, {agent_b_profile.persona.mbti})
+# 一段待评估的对话：(聊天记录, 甲方档案, 乙方档案)
+EvaluationCase = Tuple[List[Dict[str, str]], object, object]
 
-{calibration_benchmark}
-
-【聊天记录】
-{dialogue_text}
-
-【评估维度与标准】
+EVALUATION_CRITERIA = """【评估维度与标准】
 请从以下三个维度进行打分（0-100分），并给出理由：
 
 1. **互动质量 (Interaction Quality)**: 
@@ -69,10 +45,9 @@ class MatchEvaluator:
 【最终结论】
 综合以上分数，给出一个总分（Total Score）。
 - 如果价值观（维度2）严重冲突，总分不得超过 60 分（一票否决）。
-- 只有在价值观匹配且聊得来的情况下，才能给高分。
+- 只有在价值观匹配且聊得来的情况下，才能给高分。"""
 
-请以 JSON 格式输出，格式如下：
-{{
+REPORT_FORMAT = """{
     "interaction_score": 0,
     "interaction_comment": "...",
     "values_score": 0,
@@ -82,38 +57,424 @@ class MatchEvaluator:
     "total_score": 0,
     "final_verdict": "...",
     "suggestion": "..."
-}}
+}"""
+
+
+class EvaluationError(Exception):
+    """
+    评估在追问后仍缺少必需字段。partial 为已经拿到的合法字段，report 为带失败标记的报告
+    (调用方据此保存对话并标记“待重新评估”，而不是当作真实分数)
+    """
+    def __init__(self, message: str, partial: Optional[Dict] = None):
+        super().__init__(message)
+        self.partial = partial or {}
+
+    @property
+    def report(self) -> Dict:
+        return failed_report(str(self), self.partial)
+
+
+def extract_report_fields(report, only: Optional[List[str]] = None) -> Tuple[Dict, List[str]]:
+    """
+    按报告字段约定逐个校验：分数必须是 0-100 的数字，文本字段必须非空
+
+    返回 (合法字段, 缺失或不合法的必需字段)；only 用于只检查追问的那几个字段
+    """
+    fields: Dict = {}
+    if not isinstance(report, dict):
+        report = {}
+    for key in REPORT_SCORE_FIELDS:
+        if only is not None and key not in only:
+            continue
+        value = report.get(key)
+        if isinstance(value, bool):
+            continue
+        try:
+            score = int(round(float(value)))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= score <= 100:
+            fields[key] = score
+    for key in REPORT_TEXT_FIELDS:
+        if only is not None and key not in only:
+            continue
+        value = report.get(key)
+        if isinstance(value, str):
+            if value.strip():
+                fields[key] = value
+        elif value is not None:
+            fields[key] = json.dumps(value, ensure_ascii=False)
+    required = [key for key in REPORT_REQUIRED_FIELDS if only is None or key in only]
+    missing = [key for key in required if key not in fields]
+    return fields, missing
+
+
+def validate_report(report) -> Dict:
+    """
+    校验并规范化一份完整的报告 (可选文本字段补空串)，缺少必需字段时抛出 ValueError
+    """
+    fields, missing = extract_report_fields(report)
+    if missing:
+        raise ValueError(f"invalid or missing fields: {', '.join(missing)}")
+    normalized = {k: v for k, v in report.items() if k not in REPORT_SCORE_FIELDS + REPORT_TEXT_FIELDS}
+    normalized.update(fields)
+    for key in REPORT_TEXT_FIELDS:
+        normalized.setdefault(key, "")
+    return normalized
+
+
+def failed_report(reason: str, partial: Optional[Dict] = None) -> Dict:
+    """
+    评估失败时的报告：不再伪造 50 分，缺失的分数记为 0 并带 evaluation_failed 标记
+    """
+    report = {key: 0 for key in REPORT_SCORE_FIELDS}
+    report.update({key: "评估失败" for key in ("interaction_comment", "values_comment", "chemistry_comment")})
+    report.update(partial or {})
+    report["final_verdict"] = f"评估失败，待重新评估: {reason}"
+    report.setdefault("suggestion", "")
+    report["evaluation_failed"] = True
+    return report
+
+
+def _format_case(chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> str:
+    """
+    单段对话的评估材料：嘉宾资料 + 甲方价值观基准 + 聊天记录
+    """
+    # 1. 整理对话记录
+    dialogue_text = ""
+    for msg in chat_history:
+        dialogue_text += f"{msg['name']}: {msg['content']}\n"
+
+    # 2. 提取用户 (Agent A) 的校准基准
+    calibration_benchmark = ""
+    if agent_a_profile.persona.turing_calibration_data:
+        calibration_benchmark = "【甲方（用户）的价值观基准】\n"
+        for item in agent_a_profile.persona.turing_calibration_data:
+            calibration_benchmark += f"- 问题: {item['question']}\n  - 甲方期望的理想回答/甲方自己的回答: {item['answer']}\n"
+    else:
+        calibration_benchmark = "（甲方未提供价值观校准数据，请根据常理判断）"
+
+    return f"""【嘉宾资料】
+甲方 (用户): {agent_a_profile.name} ({agent_a_profile.attributes.age}岁, {agent_a_profile.attributes.job}, {agent_a_profile.persona.mbti})
+乙方 (候选人): {agent_b_profile.name} ({agent_b_profile.attributes.age}岁, {agent_b_profile.attributes.job}, {agent_b_profile.persona.mbti})
+
+{calibration_benchmark}
+
+【聊天记录】
+{dialogue_text}"""
+
+
+class MatchEvaluator:
+    """
+    严苛的对话质量评估器
+    """
+    # 批量评估时单次请求的 Token 上限 (输入 + 每段预留的输出)，需小于模型上下文
+    PACK_TOKEN_BUDGET = 6000
+    REPORT_TOKENS = 450
+    MAX_PACK_SIZE = 4
+    MAX_REASKS = 2 # 报告缺字段时最多追问的次数
+    DECODE_TOKENS_PER_SECOND = 20 # 估算生成速度，批量评估的单次超时按输出长度放宽
+
+    def __init__(self, api_key: str, priority: Priority = Priority.EVALUATION, use_prejudge: bool = True, use_cache: bool = True):
+        # 使用独立的 Evaluation Model (通常可以使用更强大的模型，这里复用 Kimi)
+        # 连接池由进程级网关统一持有
+        self.api_key = sanitize_api_key(api_key)
+        self.model_name = DEFAULT_MODEL
+        self.priority = priority
+        self.gateway = get_gateway()
+        # 本地预判：结果显而易见 (报错/冷场/违反硬性标准) 时不再调用 LLM
+        self.prejudge = PreJudge() if use_prejudge else None
+        # 内容寻址的报告缓存：同一段对话重复评估时直接返回同一份报告
+        self.cache = get_evaluation_cache() if use_cache else None
+
+    def evaluate(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Dict:
+        """
+        对聊天记录进行多维度评分 (同步包装器)
+        """
+        return run_sync(self.evaluate_async(chat_history, agent_a_profile, agent_b_profile))
+
+    def evaluate_batch(self, cases: List[EvaluationCase]) -> List[Union[Dict, "EvaluationError"]]:
+        """
+        批量评估 (同步包装器)，返回顺序与 cases 一致
+        """
+        return run_sync(self.evaluate_batch_async(cases))
+
+    async def quick_judge_async(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Optional[Dict]:
+        """
+        轻量快评 (漏斗晋级/中途止损用)：只看最近几轮，输出 {"score", "continue", "reason"}
+
+        失败时返回 None，由调用方按“无结论”处理 (不因评估出错淘汰嘉宾)
+        """
+        dialogue_text = ""
+        for msg in chat_history[-8:]:
+            dialogue_text += f"{msg['name']}: {msg['content']}\n"
+
+        prompt = f"""
+你是相亲对话的快速质检员。请根据以下聊天片段判断这段对话是否值得继续深入。
+
+甲方: {agent_a_profile.name} ({agent_a_profile.persona.mbti})，兴趣: {'、'.join(agent_a_profile.persona.interests or [])}
+乙方: {agent_b_profile.name} ({agent_b_profile.persona.mbti})，兴趣: {'、'.join(agent_b_profile.persona.interests or [])}
+
+【聊天片段】
+{dialogue_text}
+
+判断标准：双方是否有来有回、找到共同话题、没有敷衍或冷场。
+只输出 JSON：{{"score": 0-100 的整数, "continue": true 或 false, "reason": "不超过 20 字的理由"}}
 """
-        import asyncio
         try:
-            # 调用模型
-            # 简单的同步包装
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-            response = loop.run_until_complete(self.model(messages=[{"role": "user", "content": prompt}]))
-            
-            # 解析 JSON
-            content = response.content[0].text if hasattr(response.content[0], 'text') else response.content[0].get('text')
-            
-            # 清理可能的 markdown 标记
-            content = content.replace("```json", "").replace("```", "").strip()
-            
-            return json.loads(content)
-            
-        except Exception as e:
-            print(f"[Evaluator Error] {e}")
+            content = await self.gateway.chat(
+                [{"role": "user", "content": prompt}], self.api_key,
+                model=self.model_name, temperature=0.2, priority=self.priority,
+                response_format=JSON_MODE, max_tokens=80
+            )
+            verdict = parse_partial_json(content)
+            if not isinstance(verdict, dict) or "score" not in verdict:
+                raise ValueError(f"unparseable verdict: {content!r}")
             return {
-                "interaction_score": 50,
-                "interaction_comment": "评估失败",
-                "values_score": 50,
-                "values_comment": "评估失败",
-                "chemistry_score": 50,
-                "chemistry_comment": "评估失败",
-                "total_score": 50,
-                "final_verdict": "评估出错",
-                "suggestion": f"系统错误: {e}"
+                "score": int(verdict.get("score", 0)),
+                "continue": bool(verdict.get("continue", True)),
+                "reason": str(verdict.get("reason", "")),
             }
+        except Exception as e:
+            print(f"[Evaluator QuickJudge Error] {e}")
+            return None
+
+    async def evaluate_async(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Dict:
+        """
+        对聊天记录进行多维度评分 (引入图灵校准作为基准) - 异步版本
+
+        追问后仍拿不到完整报告时抛出 EvaluationError (e.report 为带失败标记的报告)
+        """
+        report = self._prejudge(chat_history, agent_a_profile, agent_b_profile)
+        if report:
+            return report
+        key = self._cache_key(chat_history, agent_a_profile, agent_b_profile)
+        report = self.cache.get(key) if key else None
+        if report:
+            return report
+
+        # 构造 Evaluation Prompt
+        prompt = f"""
+你是一位极其严苛、目光毒辣的**情感与沟通专家**。
+请根据以下两人的聊天记录，评估他们是否真的合适。
+
+{_format_case(chat_history, agent_a_profile, agent_b_profile)}
+{EVALUATION_CRITERIA}
+
+请以 JSON 格式输出，格式如下：
+{REPORT_FORMAT}
+"""
+        report = await self._request_report_async([{"role": "user", "content": prompt}])
+        if key:
+            self.cache.put(key, report)
+        return report
+
+    def _cache_key(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Optional[str]:
+        if not self.cache:
+            return None
+        return evaluation_key(chat_history, agent_a_profile, agent_b_profile, f"{EVALUATOR_PROMPT_VERSION}:{self.model_name}")
+
+    async def _request_report_async(self, messages: List[Dict[str, str]]) -> Dict:
+        """
+        JSON Mode + 流式增量解析拿到报告；缺失或不合法的字段只追问这几项，仍然缺失则抛出 EvaluationError
+
+        即使流在中途断开，已经完整输出的字段也会保留下来，不必整段重评
+        """
+        parser = IncrementalJSONParser()
+        content = ""
+        try:
+            # 调用模型 (通过共享网关，异步)
+            content = await self.gateway.chat(
+                messages, self.api_key, model=self.model_name, priority=self.priority,
+                response_format=JSON_MODE, on_chunk=parser.feed
+            )
+            parsed = parse_partial_json(content)
+        except LLMCallError as e:
+            print(f"[Evaluator Error] {e}")
+            parsed = parser.partial
+            content = parser.text
+
+        fields, missing = extract_report_fields(parsed)
+        if not fields and not content:
+            raise EvaluationError("模型调用失败，未拿到任何评估结果")
+
+        for _ in range(self.MAX_REASKS):
+            if not missing:
+                break
+            print(f"[Evaluator] re-asking for fields: {missing}")
+            followup = messages + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": f"你上面的输出缺少或包含无效的字段：{', '.join(missing)}。"
+                                            f"请只输出一个 JSON 对象，仅包含这些字段 (分数为 0-100 的整数)。"}
+            ]
+            try:
+                content = await self.gateway.chat(
+                    followup, self.api_key, model=self.model_name, priority=self.priority,
+                    response_format=JSON_MODE, max_tokens=200
+                )
+            except LLMCallError as e:
+                print(f"[Evaluator Error] re-ask failed: {e}")
+                break
+            more, _ = extract_report_fields(parse_partial_json(content), only=missing)
+            fields.update(more)
+            missing = [key for key in missing if key not in fields]
+
+        if missing:
+            raise EvaluationError(f"缺少字段 {', '.join(missing)}", partial=fields)
+        return validate_report(fields)
+
+    def _prejudge(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Optional[Dict]:
+        if not self.prejudge:
+            return None
+        judgement = self.prejudge.judge(chat_history, agent_a_profile, agent_b_profile)
+        if not judgement.confident:
+            return None
+        print(f"[Evaluator] prejudge {agent_a_profile.name} x {agent_b_profile.name}: {judgement.score} ({judgement.reason})")
+        return prejudge_report(judgement)
+
+    def _pack(self, cases: List[EvaluationCase]) -> List[List[int]]:
+        """
+        按 Token 预算把多段对话贪心装箱，返回每个包内的下标
+        """
+        packs, current, used = [], [], 0
+        for i, case in enumerate(cases):
+            cost = count_tokens(_format_case(*case)) + self.REPORT_TOKENS
+            if current and (used + cost > self.PACK_TOKEN_BUDGET or len(current) >= self.MAX_PACK_SIZE):
+                packs.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    async def evaluate_batch_async(self, cases: List[EvaluationCase]) -> List[Union[Dict, EvaluationError]]:
+        """
+        批量评估多段对话：本地预判能确定的、缓存里已有的直接出结果，其余较短的对话装进同一个请求，各个请求并发执行
+
+        每份报告都按字段约定校验，打包结果缺失或不合法的对话单独重评；
+        单独重评仍然失败的对话，对应位置是 EvaluationError 实例 (而不是报告)
+        """
+        reports: List[Optional[Dict]] = [self._prejudge(*case) for case in cases]
+        keys = [self._cache_key(*case) if report is None else None for case, report in zip(cases, reports)]
+        for i, key in enumerate(keys):
+            if key:
+                reports[i] = self.cache.get(key)
+        pending = [i for i, r in enumerate(reports) if r is None]
+        packs = self._pack([cases[i] for i in pending])
+        results = await asyncio.gather(*(self._evaluate_pack_async([cases[pending[j]] for j in pack]) for pack in packs))
+        for pack, pack_reports in zip(packs, results):
+            for j, report in zip(pack, pack_reports):
+                i = pending[j]
+                reports[i] = report
+                if keys[i] and isinstance(report, dict):
+                    self.cache.put(keys[i], report)
+        return reports
+
+    async def _evaluate_pack_async(self, cases: List[EvaluationCase]) -> List[Union[Dict, EvaluationError]]:
+        if len(cases) == 1:
+            try:
+                return [await self.evaluate_async(*cases[0])]
+            except EvaluationError as e:
+                return [e]
+
+        sections = "\n".join(f"===== 对话 #{i} =====\n{_format_case(*case)}" for i, case in enumerate(cases))
+        prompt = f"""
+你是一位极其严苛、目光毒辣的**情感与沟通专家**。
+下面有 {len(cases)} 段互相独立的相亲对话，请分别评估每一对是否真的合适 (不要互相比较，也不要混用信息)。
+
+{sections}
+{EVALUATION_CRITERIA}
+
+请以 JSON 格式输出，每段对话一份报告，index 为对话编号：
+{{"reports": [{{"index": 0, ...}}, {{"index": 1, ...}}]}}
+其中每份报告的格式如下：
+{REPORT_FORMAT}
+"""
+        reports: List[Optional[Dict]] = [None] * len(cases)
+        max_tokens = self.REPORT_TOKENS * len(cases)
+        policy = self.gateway.retry_policy
+        policy = dataclasses.replace(policy, timeout=max(policy.timeout, max_tokens / self.DECODE_TOKENS_PER_SECOND))
+        try:
+            content = await self.gateway.chat(
+                [{"role": "user", "content": prompt}], self.api_key,
+                model=self.model_name, priority=self.priority,
+                retry_policy=policy,
+                response_format=JSON_MODE,
+                max_tokens=max_tokens
+            )
+            parsed = parse_partial_json(content)
+            items = parsed.get("reports", []) if isinstance(parsed, dict) else []
+            for item in items:
+                try:
+                    index = int(item.get("index"))
+                    if 0 <= index < len(cases) and reports[index] is None:
+                        report = validate_report(item)
+                        report.pop("index", None)
+                        reports[index] = report
+                except (TypeError, ValueError, AttributeError) as e:
+                    print(f"[Evaluator Batch] invalid report skipped: {e}")
+        except LLMCallError as e:
+            print(f"[Evaluator Batch Error] {e}")
+
+        # 缺失或不合法的报告逐段重评 (并发)，仍失败的位置放 EvaluationError
+        missing = [i for i, r in enumerate(reports) if r is None]
+        if missing:
+            retried = await asyncio.gather(*(self.evaluate_async(*cases[i]) for i in missing), return_exceptions=True)
+            for i, report in zip(missing, retried):
+                if isinstance(report, BaseException) and not isinstance(report, EvaluationError):
+                    report = EvaluationError(str(report))
+                reports[i] = report
+        return reports
+
+
+class EvaluationBatcher:
+    """
+    评估请求的微批处理：各组对话各自 await submit()，短时间内到达的请求合并成一次批量评估
+
+    - 攒满 max_pack_size 份立即发出
+    - 否则最多等待 max_wait 秒 (并发对话通常在相近时间结束)
+    """
+    def __init__(self, evaluator: MatchEvaluator, max_pack_size: int = MatchEvaluator.MAX_PACK_SIZE, max_wait: float = 0.5):
+        self.evaluator = evaluator
+        self.max_pack_size = max_pack_size
+        self.max_wait = max_wait
+        self._pending: List[Tuple[EvaluationCase, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set() # 持有进行中的批次任务引用，防止被垃圾回收
+
+    async def submit(self, chat_history: List[Dict[str, str]], agent_a_profile, agent_b_profile) -> Dict:
+        """
+        提交一段对话并等待它的报告；评估失败时抛出 EvaluationError
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((chat_history, agent_a_profile, agent_b_profile), future))
+        if len(self._pending) >= self.max_pack_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[EvaluationCase, asyncio.Future]]):
+        try:
+            reports = await self.evaluator.evaluate_batch_async([case for case, _ in batch])
+        except Exception as e:
+            reports = [EvaluationError(str(e)) for _ in batch]
+        for (_, future), report in zip(batch, reports):
+            if future.done():
+                continue
+            if isinstance(report, BaseException):
+                future.set_exception(report)
+            else:
+                future.set_result(report)
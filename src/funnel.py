@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from src.agent_builder import AgentProfile
+
+if TYPE_CHECKING:
+    # 仅用于类型标注：广场扫描的主进程只需要 FunnelConfig，不必加载对话引擎
+    from src.engine import ChatSession
+    from src.evaluator import MatchEvaluator
+
+# 漏斗阶段
+STAGE_ICEBREAK = "icebreak"     # 破冰后未晋级
+STAGE_EARLY_EXIT = "early_exit" # 深聊中途止损 (冷场或快评不达标)
+STAGE_DEEP = "deep"             # 完成深聊 (含双方提前道别，正常聊完)
+
+
+@dataclass
+class FunnelConfig:
+    """
+    三层漏斗 (硬筛选 -> 破冰 -> 深聊) 中后两层的参数
+
+    - icebreak_turns: 破冰轮数，结束后做一次快评
+    - promote_threshold: 快评分数达到该值才晋级深聊
+    - deep_turns: 深聊总轮数 (含破冰轮数)
+    - judge_every: 深聊中每隔多少轮快评一次
+    - exit_threshold: 深聊快评低于该值即提前结束
+    """
+    icebreak_turns: int = 3
+    promote_threshold: int = 60
+    deep_turns: int = 20
+    judge_every: int = 4
+    exit_threshold: int = 40
+
+
+@dataclass
+class FunnelOutcome:
+    """一组对话在漏斗中的结果"""
+    stage: str
+    verdict: Optional[Dict] = None # 最近一次快评结果 (快评失败时为 None)
+    reason: str = ""
+
+
+class MatchFunnel:
+    """
+    在同一场 ChatSession 上分阶段推进：先破冰，快评达标再继续深聊，深聊期间定期快评止损
+
+    快评失败 (返回 None) 一律视为“继续”，不会因为评估出错而淘汰嘉宾
+    """
+    def __init__(self, evaluator: "MatchEvaluator", config: Optional[FunnelConfig] = None):
+        self.evaluator = evaluator
+        self.config = config or FunnelConfig()
+
+    async def run_async(
+        self,
+        session: "ChatSession",
+        user: AgentProfile,
+        target: AgentProfile,
+        on_turn: Optional[Callable[[int, int], None]] = None,
+        on_stage: Optional[Callable[[str, Optional[Dict]], None]] = None
+    ) -> FunnelOutcome:
+        """
+        on_turn(turn, max_turns): 每轮结束回调；on_stage(stage, verdict): 进入新阶段时回调
+        """
+        cfg = self.config
+        icebreak_turns = min(cfg.icebreak_turns, cfg.deep_turns)
+
+        def turn_callback(max_turns: int):
+            if not on_turn:
+                return None
+            return lambda turn: on_turn(turn, max_turns)
+
+        # 1. 破冰
+        if on_stage:
+            on_stage(STAGE_ICEBREAK, None)
+        await session.run_async(icebreak_turns, on_turn=turn_callback(icebreak_turns))
+        if session.stop_reason and not session.completed:
+            # 破冰阶段就已冷场 (本地终止检测)，不再晋级，也不必再花一次快评
+            return FunnelOutcome(STAGE_ICEBREAK, None, session.stop_reason)
+        verdict = await self.evaluator.quick_judge_async(session.history, user, target)
+        if verdict is not None and verdict["score"] < cfg.promote_threshold:
+            return FunnelOutcome(STAGE_ICEBREAK, verdict, verdict["reason"])
+        if session.completed or icebreak_turns >= cfg.deep_turns:
+            # 已经聊完 (双方道别)，直接进入完整评估
+            return FunnelOutcome(STAGE_DEEP, verdict, session.stop_reason or "")
+        last_verdict = verdict
+
+        # 2. 深聊 (定期快评止损)
+        if on_stage:
+            on_stage(STAGE_DEEP, verdict)
+
+        async def should_stop(turn: int, history: List[Dict[str, str]]) -> Optional[str]:
+            nonlocal last_verdict
+            if (turn - icebreak_turns) % max(1, cfg.judge_every) != 0 or turn >= cfg.deep_turns:
+                return None
+            v = await self.evaluator.quick_judge_async(history, user, target)
+            if v is None:
+                return None
+            last_verdict = v
+            if v["score"] < cfg.exit_threshold or not v["continue"]:
+                return v["reason"] or "对话没有进展"
+            return None
+
+        await session.run_async(
+            cfg.deep_turns,
+            on_turn=turn_callback(cfg.deep_turns),
+            should_stop=should_stop
+        )
+        if session.stop_reason and not session.completed:
+            return FunnelOutcome(STAGE_EARLY_EXIT, last_verdict, session.stop_reason)
+        return FunnelOutcome(STAGE_DEEP, last_verdict, session.stop_reason or "")
+
+
+def verdict_report(outcome: FunnelOutcome) -> Dict:
+    """
+    未完成深聊的嘉宾不再调用完整评估，用快评结果生成简版报告 (字段与 MatchEvaluator 一致)
+    快评分数与完整评估不可比，保存时以 eval_status = 'screened' 标记，不参与排行榜与分数统计
+    """
+    score = outcome.verdict["score"] if outcome.verdict else 0
+    label = "破冰阶段未晋级" if outcome.stage == STAGE_ICEBREAK else "深聊中途结束"
+    return {
+        "interaction_score": score,
+        "interaction_comment": outcome.reason,
+        "values_score": score,
+        "values_comment": "未进入完整评估",
+        "chemistry_score": score,
+        "chemistry_comment": "未进入完整评估",
+        "total_score": score,
+        "final_verdict": f"{label}: {outcome.reason}",
+        "suggestion": "",
+        "stage": outcome.stage,
+    }
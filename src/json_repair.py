@@ -0,0 +1,208 @@
+from typing import Any, Optional
+
+_LITERALS = {
+    "true": True, "false": False, "null": None,
+    "True": True, "False": False, "None": None,
+}
+_CLOSERS = "}]"
+
+
+class _PartialInput(Exception):
+    """输入在某个值的中途结束"""
+
+
+class _TolerantParser:
+    """
+    宽松的 JSON 递归下降解析器，能够处理模型输出中常见的问题：
+
+    - 前后的说明文字、```json 代码块标记
+    - 尾随逗号、// 与 /* */ 注释、单引号字符串、Python 风格的 True/False/None
+    - 未加引号的文本值 (读到右括号、换行、行内注释，或后面紧跟下一个键的逗号为止)
+    - 输出被截断：已完整解析的字段保留，截断处的字段丢弃
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def _peek(self) -> str:
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def _skip(self):
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if ch.isspace():
+                self.pos += 1
+            elif self.text.startswith("//", self.pos):
+                end = self.text.find("\n", self.pos)
+                self.pos = len(self.text) if end < 0 else end + 1
+            elif self.text.startswith("/*", self.pos):
+                end = self.text.find("*/", self.pos + 2)
+                self.pos = len(self.text) if end < 0 else end + 2
+            else:
+                break
+
+    def parse_value(self, in_object: bool = False) -> Any:
+        self._skip()
+        ch = self._peek()
+        if not ch:
+            raise _PartialInput()
+        if ch == "{":
+            return self._parse_object()
+        if ch == "[":
+            return self._parse_array()
+        if ch in "\"'":
+            return self._parse_string(ch)
+        return self._parse_bare(in_object=in_object)
+
+    def _parse_object(self) -> dict:
+        self.pos += 1
+        result = {}
+        while True:
+            self._skip()
+            ch = self._peek()
+            if not ch:
+                return result
+            if ch in "}]": # 括号不匹配时也视为对象结束
+                self.pos += 1
+                return result
+            if ch == ",":
+                self.pos += 1
+                continue
+            try:
+                key = self._parse_string(ch) if ch in "\"'" else str(self._parse_bare(stop=":"))
+                self._skip()
+                if self._peek() != ":":
+                    return result # 截断在键名之后
+                self.pos += 1
+                value = self.parse_value(in_object=True)
+            except _PartialInput:
+                return result # 截断在值中途：丢弃这个字段
+            result[key] = value
+
+    def _parse_array(self) -> list:
+        self.pos += 1
+        result = []
+        while True:
+            self._skip()
+            ch = self._peek()
+            if not ch:
+                return result
+            if ch in "]}":
+                self.pos += 1
+                return result
+            if ch == ",":
+                self.pos += 1
+                continue
+            try:
+                result.append(self.parse_value())
+            except _PartialInput:
+                return result
+
+    def _parse_string(self, quote: str) -> str:
+        self.pos += 1
+        chars = []
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if ch == "\\" and self.pos + 1 < len(self.text):
+                esc = self.text[self.pos + 1]
+                if esc == "u" and self.pos + 6 <= len(self.text):
+                    try:
+                        chars.append(chr(int(self.text[self.pos + 2:self.pos + 6], 16)))
+                        self.pos += 6
+                        continue
+                    except ValueError:
+                        pass
+                chars.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(esc, esc))
+                self.pos += 2
+                continue
+            if ch == quote:
+                self.pos += 1
+                return "".join(chars)
+            chars.append(ch)
+            self.pos += 1
+        raise _PartialInput()
+
+    def _key_follows(self, pos: int) -> bool:
+        """
+        对象中的裸文本值遇到逗号时向后看：后面是下一个 “键:” (或对象结束) 才把逗号当作分隔符，
+        否则逗号属于文本本身 (如 不错, 可以继续)
+        """
+        saved = self.pos
+        self.pos = pos
+        try:
+            self._skip()
+            ch = self._peek()
+            if not ch or ch == "}":
+                return True
+            if ch in "\"'":
+                self._parse_string(ch)
+            else:
+                while self.pos < len(self.text) and (self.text[self.pos].isalnum() or self.text[self.pos] in "_-"):
+                    self.pos += 1
+            self._skip()
+            return self._peek() in ("", ":") # 截断在下一个键名之后也算
+        except _PartialInput:
+            return True # 截断在下一个键名中途
+        finally:
+            self.pos = saved
+
+    def _parse_bare(self, stop: str = "", in_object: bool = False) -> Any:
+        start = self.pos
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if ch == "\n" or ch in _CLOSERS + stop:
+                break
+            if ch == "," and (not in_object or self._key_follows(self.pos + 1)):
+                break
+            if self.text.startswith(("//", "/*"), self.pos) and (self.pos == start or self.text[self.pos - 1].isspace()):
+                break # 值后面的行内注释 (http:// 之类的文本不受影响)
+            self.pos += 1
+        if self.pos >= len(self.text):
+            raise _PartialInput() # 数字/字面量可能还没输出完
+        token = self.text[start:self.pos].strip()
+        if token in _LITERALS:
+            return _LITERALS[token]
+        try:
+            return int(token)
+        except ValueError:
+            pass
+        try:
+            return float(token)
+        except ValueError:
+            return token
+
+
+def parse_partial_json(text: str) -> Optional[Any]:
+    """
+    从模型输出中尽量恢复出 JSON 对象/数组；完全找不到时返回 None
+    """
+    if not text:
+        return None
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    parser = _TolerantParser(text)
+    parser.pos = min(starts)
+    try:
+        return parser.parse_value()
+    except _PartialInput:
+        return None
+
+
+class IncrementalJSONParser:
+    """
+    流式解析：配合 LLMGateway.chat(on_chunk=...) 使用，随时可以取到目前为止恢复出的部分对象
+
+    即使流在中途断开，已经输出完整的字段也不会丢失
+    """
+    def __init__(self):
+        self.text = ""
+        self.partial: Optional[Any] = None
+
+    def feed(self, text_so_far: str) -> Optional[Any]:
+        # 网关回调的是“目前为止的完整文本”，重试时会从空串重新开始
+        self.text = text_so_far
+        parsed = parse_partial_json(text_so_far)
+        if parsed is not None:
+            self.partial = parsed
+        return self.partial
@@ -0,0 +1,287 @@
+import asyncio
+import dataclasses
+import threading
+import time
+import weakref
+from typing import Callable, List, Dict, Optional
+import httpx
+from openai import AsyncOpenAI, RateLimitError
+from src.rate_limiter import Priority, get_rate_limiter, estimate_tokens
+from src.resilience import RetryPolicy, LatencyTracker, call_with_retry
+from src.llm_replay import ReplayLayer
+
+MOONSHOT_BASE_URL = "https://api.moonshot.cn/v1"
+DEFAULT_MODEL = "moonshot-v1-8k"
+
+
+def sanitize_api_key(api_key: str) -> str:
+    """
+    净化 API Key：去除首尾空白，并强制只保留 ASCII 字符
+    """
+    if not api_key:
+        return api_key
+
+    api_key = api_key.strip()
+    try:
+        # 尝试编码为 ascii，忽略无法编码的字符（如中文、特殊符号）
+        api_key = api_key.encode('ascii', 'ignore').decode('ascii')
+    except Exception as e:
+        print(f"[Warning] Failed to sanitize API Key: {e}")
+
+    if not api_key.isascii():
+        print(f"[Warning] API Key contains non-ASCII characters! This may cause connection errors. Key: {api_key[:5]}...")
+    return api_key
+
+
+class LLMGateway:
+    """
+    进程级 LLM 网关：所有 Agent 与裁判共用的模型调用入口
+
+    - 按 (base_url, api_key) 复用长连接客户端，避免每个 Agent 重复建连/TLS 握手
+    - httpx 的异步连接池绑定在事件循环上，因此每个事件循环各持有一份连接池
+    - 同步调用方统一投递到网关自带的后台事件循环，共享同一份连接池
+    - 所有请求先经过按 API Key 共享的限流器排队 (RPM + TPM，带优先级)
+    - 失败请求按 RetryPolicy 做抖动指数退避重试，可选在 p95 延迟后发出对冲请求
+    - 可选的录制/回放层 (LLM_REPLAY_MODE)，用于离线开发与可复现的压测
+    """
+    def __init__(
+        self,
+        max_connections: int = 50,
+        max_keepalive: int = 20,
+        timeout: float = 60.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        replay: Optional[ReplayLayer] = None
+    ):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._bg_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.replay = replay or ReplayLayer.from_env()
+
+    def get_client(self, api_key: str, base_url: str = MOONSHOT_BASE_URL) -> AsyncOpenAI:
+        """
+        获取当前事件循环下 (base_url, api_key) 对应的复用客户端
+        """
+        loop = asyncio.get_running_loop()
+        key = (base_url, sanitize_api_key(api_key))
+        with self._lock:
+            # 已关闭的事件循环上的客户端不可能再被使用，及时丢弃 (asyncio.run 结束后循环即关闭)
+            for closed in [l for l in self._clients if l.is_closed()]:
+                del self._clients[closed]
+            clients = self._clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=key[1],
+                    base_url=base_url,
+                    max_retries=0, # 重试由网关统一负责，避免与 SDK 内置重试叠加
+                    http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout),
+                )
+                clients[key] = client
+            return client
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        api_key: str,
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.7,
+        base_url: str = MOONSHOT_BASE_URL,
+        priority: Priority = Priority.BATCH,
+        retry_policy: Optional[RetryPolicy] = None,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        **kwargs
+    ) -> str:
+        """
+        统一的异步对话接口，返回模型回复的文本
+
+        - on_chunk: 传入时使用流式输出，每收到一段增量就以“目前为止的完整文本”回调一次
+          (重试时会从空字符串重新开始，UI 直接整体覆盖即可)
+        - 重试耗尽后抛出 LLMCallError，调用方不应把错误当作对话内容继续使用
+        """
+        if self.replay.replaying:
+            # 回放命中时不访问网络，也不占用限流配额
+            text = await self.replay.serve(model, messages, temperature, kwargs, on_chunk)
+            if text is not None:
+                return text
+
+        client = self.get_client(api_key, base_url)
+        limiter = get_rate_limiter(sanitize_api_key(api_key))
+        estimated = estimate_tokens(messages, kwargs.get("max_tokens", 300))
+
+        async def gate():
+            # 每次尝试 (含重试/对冲) 都要先排队拿令牌
+            await limiter.acquire(estimated, priority)
+
+        async def attempt():
+            if on_chunk is not None:
+                return await stream_attempt()
+            try:
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=policy.timeout, # 与外层 wait_for 一致，避免被客户端默认超时提前截断
+                    **kwargs
+                )
+            except RateLimitError as e:
+                # 429：整体暂停发放令牌，交由重试层重新排队
+                retry_after = self._retry_after(e) or 2.0
+                print(f"[Gateway] 429 received, pausing {retry_after}s")
+                limiter.pause(retry_after)
+                raise
+
+            usage = getattr(completion, "usage", None)
+            if usage is not None:
+                limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            return completion.choices[0].message.content or ""
+
+        async def stream_attempt():
+            text = ""
+            usage = None
+            try:
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    stream=True,
+                    timeout=policy.timeout,
+                    **kwargs
+                )
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        text += delta
+                        on_chunk(text)
+            except RateLimitError as e:
+                retry_after = self._retry_after(e) or 2.0
+                print(f"[Gateway] 429 received, pausing {retry_after}s")
+                limiter.pause(retry_after)
+                raise
+
+            if usage is not None:
+                limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            return text
+
+        policy = retry_policy or self.retry_policy
+        if on_chunk is not None and policy.hedge:
+            # 流式输出不做对冲，否则两路增量会同时刷到界面上
+            policy = dataclasses.replace(policy, hedge=False)
+
+        tracker = self._latency.setdefault(model, LatencyTracker())
+        started = time.monotonic()
+        text = await call_with_retry(
+            attempt, policy, tracker,
+            describe=f"{model} chat", gate=gate
+        )
+        if self.replay.recording:
+            self.replay.record(model, messages, temperature, kwargs, text, time.monotonic() - started)
+        return text
+
+    async def aclose_clients(self):
+        """
+        关闭当前事件循环上的全部客户端 (释放连接池)，在废弃事件循环之前调用
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.pop(loop, {})
+        for client in clients.values():
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"[Gateway] client close error: {e}")
+
+    @staticmethod
+    def _retry_after(error: RateLimitError) -> Optional[float]:
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except Exception:
+            return None
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._bg_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True)
+                thread.start()
+                self._bg_loop = loop
+            return self._bg_loop
+
+    def chat_sync(self, messages: List[Dict[str, str]], api_key: str, **kwargs) -> str:
+        """
+        同步调用方 (DialogAgent / KimiLLMService) 使用的包装器
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.chat(messages, api_key, **kwargs),
+            self._background_loop()
+        )
+        return future.result()
+
+
+# run_sync 为每个调用线程维护的事件循环；线程退出后 (Streamlit 每次 rerun 可能换一个线程) 由后续调用回收
+_sync_loops: Dict[threading.Thread, asyncio.AbstractEventLoop] = {}
+_sync_loops_lock = threading.Lock()
+
+
+def _dispose_loop(loop: asyncio.AbstractEventLoop):
+    """
+    关闭已无人使用的事件循环：先关闭网关在其上的客户端，再关闭循环本身
+    """
+    try:
+        if not loop.is_closed():
+            loop.run_until_complete(get_gateway().aclose_clients())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+    except Exception as e:
+        print(f"[Gateway] dispose event loop error: {e}")
+    finally:
+        if not loop.is_closed():
+            loop.close()
+
+
+def run_sync(coro):
+    """
+    在当前线程的持久事件循环上同步执行协程 (供 Streamlit 等同步调用方使用)
+
+    同一线程复用同一个事件循环，网关在该循环上建立的连接池可以跨调用复用；
+    调用线程退出后，其事件循环与连接池在下一次 run_sync 时关闭回收
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from a running event loop; await the async API instead")
+
+    thread = threading.current_thread()
+    with _sync_loops_lock:
+        orphaned = [_sync_loops.pop(t) for t in list(_sync_loops) if not t.is_alive()]
+        loop = _sync_loops.get(thread)
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            _sync_loops[thread] = loop
+    for old in orphaned:
+        _dispose_loop(old)
+    asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coro)
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+def get_gateway() -> LLMGateway:
+    """
+    获取进程级单例网关
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
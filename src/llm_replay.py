@@ -0,0 +1,259 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 运行模式 (环境变量 LLM_REPLAY_MODE)
+MODE_OFF = "off"       # 直接调用 API
+MODE_RECORD = "record" # 调用 API 并记录 (请求哈希 -> 回复)
+MODE_REPLAY = "replay" # 只用已记录的回复，不访问网络
+
+# 回放未命中时的处理 (环境变量 LLM_REPLAY_MISS)
+MISS_ERROR = "error"   # 抛出 LLMCallError，保证离线可复现
+MISS_LIVE = "live"     # 退回真实调用并记录下来
+
+# 影响回复内容的请求参数，参与请求哈希
+_KEY_KWARGS = ("max_tokens", "response_format", "top_p", "stop")
+
+_SPEAKER_PATTERN = re.compile(r"你是 \*\*(.+?)\*\*")
+_PARTNER_PATTERN = re.compile(r"- 名字: (.+)")
+_DIALOGUE_CONTEXT = 2 # 对话键只看最近两条发言 (更早的内容可能已被滚动摘要折叠)
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    读取非负浮点数环境变量；格式错误时打印警告并使用默认值，而不是让网关初始化失败
+    """
+    raw = os.getenv(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        value = -1.0
+    if not value >= 0: # 同时排除负数与 nan
+        print(f"[Replay] invalid {name}={raw!r}, using {default}")
+        return default
+    return value
+
+
+def _digest(payload) -> str:
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def request_key(model: str, messages: List[Dict[str, str]], temperature: float, kwargs: Dict) -> str:
+    """
+    精确键：sha256(模型 + 完整消息列表 + 温度 + 影响输出的参数)
+    """
+    extra = {k: kwargs[k] for k in _KEY_KWARGS if k in kwargs}
+    return _digest({"model": model, "messages": messages, "temperature": temperature, "extra": extra})
+
+
+def dialogue_key(speaker: str, partner: Optional[str], context: List[str]) -> str:
+    """
+    对话键：(发言人, 对方, 最近两条发言) -> 下一句。用于从 logs/ 的聊天记录回放对话 (日志里没有完整 prompt)
+    """
+    return _digest({
+        "speaker": speaker,
+        "partner": partner,
+        "context": [" ".join(c.split()) for c in context[-_DIALOGUE_CONTEXT:]],
+    })
+
+
+def dialogue_key_for_messages(messages: List[Dict[str, str]]) -> Optional[str]:
+    """
+    从 DatingAgent 的请求中还原对话键：人设 prompt 里有“你是 **名字**”与对方的“- 名字: xxx”，
+    非 system 消息即对话内容
+    """
+    speaker, partner = None, None
+    for msg in messages:
+        if msg.get("role") == "system":
+            content = msg.get("content") or ""
+            match = _SPEAKER_PATTERN.search(content)
+            if match:
+                speaker = match.group(1)
+                partner_match = _PARTNER_PATTERN.search(content)
+                partner = partner_match.group(1).strip() if partner_match else None
+                break
+    if speaker is None:
+        return None
+    context = [m.get("content") or "" for m in messages if m.get("role") != "system"]
+    return dialogue_key(speaker, partner, context)
+
+
+class ReplayStore:
+    """
+    本地 SQLite 存储：key -> (回复, 录制时的耗时)，多线程共享一个连接
+    """
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            create table if not exists responses (
+                key text primary key,
+                kind text not null, -- request / dialogue
+                model text,
+                response text not null,
+                latency real,
+                created_at real not null
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        with self._lock:
+            row = self._conn.execute("select response, latency from responses where key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, key: str, kind: str, model: Optional[str], response: str, latency: Optional[float]):
+        with self._lock:
+            self._conn.execute(
+                "insert or replace into responses (key, kind, model, response, latency, created_at) values (?, ?, ?, ?, ?, ?)",
+                (key, kind, model, response, latency, time.time())
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("select kind, count(*) from responses group by kind").fetchall()
+        return {kind: count for kind, count in rows}
+
+
+class ReplayLayer:
+    """
+    网关之下的录制/回放层 (开发与压测用)
+
+    - record: 真实调用，并按请求哈希记录回复与耗时
+    - replay: 先按精确请求哈希查找，再按 (发言人, 对方, 最近发言) 的对话键查找；
+      命中时按配置的合成延迟返回 (流式调用会逐段回调)，不访问网络、不占用限流配额
+    """
+    def __init__(
+        self,
+        mode: str = MODE_OFF,
+        store: Optional[ReplayStore] = None,
+        latency: Optional[float] = None,
+        jitter: float = 0.0,
+        miss: str = MISS_ERROR
+    ):
+        self.mode = mode
+        self.store = store
+        self.latency = latency # None 表示使用录制时的真实耗时
+        self.jitter = jitter
+        self.miss = miss
+
+    @classmethod
+    def from_env(cls) -> "ReplayLayer":
+        """
+        LLM_REPLAY_MODE=off|record|replay, LLM_REPLAY_DB=路径,
+        LLM_REPLAY_LATENCY=秒数|recorded, LLM_REPLAY_JITTER=比例, LLM_REPLAY_MISS=error|live
+        """
+        mode = os.getenv("LLM_REPLAY_MODE", MODE_OFF).lower()
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            return cls(MODE_OFF)
+        latency_env = os.getenv("LLM_REPLAY_LATENCY", "0").strip().lower()
+        latency = None if latency_env == "recorded" else _env_float("LLM_REPLAY_LATENCY", 0.0)
+        store = ReplayStore(os.getenv("LLM_REPLAY_DB", os.path.join("cache", "llm_replay.sqlite")))
+        layer = cls(
+            mode, store, latency,
+            jitter=_env_float("LLM_REPLAY_JITTER", 0.0),
+            miss=os.getenv("LLM_REPLAY_MISS", MISS_ERROR).lower()
+        )
+        print(f"[Replay] mode={mode} db={store.path} latency={'recorded' if latency is None else latency}")
+        return layer
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == MODE_REPLAY
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == MODE_RECORD or (self.mode == MODE_REPLAY and self.miss == MISS_LIVE)
+
+    def _delay(self, key: str, recorded: Optional[float]) -> float:
+        base = self.latency if self.latency is not None else (recorded or 0.0)
+        if not self.jitter:
+            return base
+        # 抖动由键决定，同一请求每次回放的耗时相同 (可复现)
+        unit = int(key[:8], 16) / 0xFFFFFFFF
+        return max(0.0, base * (1 + self.jitter * (2 * unit - 1)))
+
+    def lookup(self, model: str, messages: List[Dict[str, str]], temperature: float, kwargs: Dict) -> Optional[Tuple[str, str, Optional[float]]]:
+        key = request_key(model, messages, temperature, kwargs)
+        hit = self.store.get(key)
+        if hit is None:
+            dkey = dialogue_key_for_messages(messages)
+            if dkey:
+                key, hit = dkey, self.store.get(dkey)
+        if hit is None:
+            return None
+        return key, hit[0], hit[1]
+
+    async def serve(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        kwargs: Dict,
+        on_chunk: Optional[Callable[[str], None]] = None
+    ) -> Optional[str]:
+        """
+        回放模式下返回记录的回复；未命中且允许真实调用时返回 None
+        """
+        found = self.lookup(model, messages, temperature, kwargs)
+        if found is None:
+            if self.miss == MISS_LIVE:
+                return None
+            from src.resilience import LLMCallError
+            raise LLMCallError(f"replay miss for {model} request ({len(messages)} messages)")
+
+        key, text, recorded = found
+        delay = self._delay(key, recorded)
+        if on_chunk is None:
+            await asyncio.sleep(delay)
+            return text
+        # 流式：把合成延迟平均分到若干段增量上
+        steps = max(1, min(len(text), 8))
+        size = -(-len(text) // steps)
+        for i in range(1, steps + 1):
+            await asyncio.sleep(delay / steps)
+            on_chunk(text[:i * size])
+        return text
+
+    def record(self, model: str, messages: List[Dict[str, str]], temperature: float, kwargs: Dict, text: str, latency: float):
+        try:
+            self.store.put(request_key(model, messages, temperature, kwargs), "request", model, text, latency)
+        except sqlite3.Error as e:
+            print(f"[Replay] record failed: {e}")
+
+    def seed_from_logs(self, pattern: str = os.path.join("logs", "chat_as_*.json")) -> int:
+        """
+        把 logs/ 里的聊天记录导入为对话键，返回导入的发言数
+        """
+        count = 0
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[Replay] skip {path}: {e}")
+                continue
+            participants = data.get("participants") or []
+            contents: List[str] = []
+            for msg in data.get("history", []):
+                if not isinstance(msg, dict) or "name" not in msg:
+                    continue
+                partner = next((p for p in participants if p != msg["name"]), None)
+                self.store.put(dialogue_key(msg["name"], partner, contents), "dialogue", None, msg.get("content") or "", None)
+                contents.append(msg.get("content") or "")
+                count += 1
+        return count
@@ -1,7 +1,8 @@
 import os
 import random
 from abc import ABC, abstractmethod
-from openai import OpenAI
+from src.llm_gateway import get_gateway
+from src.rate_limiter import Priority
 
 class LLMService(ABC):
     @abstractmethod
@@ -44,10 +45,9 @@ class KimiLLMService(LLMService):
     使用 Moonshot (Kimi) API 的真实 LLM 服务
     """
     def __init__(self, api_key: str, model: str = "moonshot-v1-8k"):
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.moonshot.cn/v1",
-        )
+        # 连接池由进程级网关统一持有
+        self.api_key = api_key
+        self.gateway = get_gateway()
         self.model = model
 
     def generate_response(self, system_prompt: str, chat_history: list) -> str:
@@ -55,11 +55,12 @@ class KimiLLMService(LLMService):
         messages = [{"role": "system", "content": system_prompt}] + chat_history
         
         try:
-            completion = self.client.chat.completions.create(
+            return self.gateway.chat_sync(
+                messages,
+                self.api_key,
                 model=self.model,
-                messages=messages,
                 temperature=0.7, # 让对话稍微活泼一点
+                priority=Priority.INTERACTIVE,
             )
-            return completion.choices[0].message.content
         except Exception as e:
             return f"[系统错误] API 调用失败: {str(e)}"
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+import zlib
+from typing import List, Optional, Set, Tuple
+from src.funnel import FunnelConfig
+
+# 每个用户最多向后翻的候选人页数 (已聊过的嘉宾较多时，继续翻页补足未聊过的)
+MAX_CANDIDATE_PAGES = 5
+
+
+def shard_of(username: str, num_shards: int) -> int:
+    """
+    稳定分片：同一个用户每次都落在同一个分片 (不依赖 Python 的随机化 hash)
+    """
+    return zlib.crc32(username.encode("utf-8")) % num_shards
+
+
+class ShardCheckpoint:
+    """
+    分片检查点：每完成一对 (user_a, user_b) 追加一行 JSONL，崩溃重启后跳过已完成的配对
+    """
+    def __init__(self, checkpoint_dir: str, shard_index: int):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.path = os.path.join(checkpoint_dir, f"shard_{shard_index}.jsonl")
+
+    def load(self) -> Set[Tuple[str, str]]:
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    done.add((item["user_a"], item["user_b"]))
+                except (ValueError, KeyError):
+                    # 崩溃时可能留下半行，忽略即可
+                    continue
+        return done
+
+    def mark(self, user_a: str, user_b: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"user_a": user_a, "user_b": user_b, "ts": time.time()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+async def run_shard_async(
+    shard_index: int,
+    num_shards: int,
+    api_key: str,
+    checkpoint_dir: str,
+    candidates_per_user: int = 200,
+    concurrency: int = 8,
+    max_turns: int = 5,
+    funnel: Optional[FunnelConfig] = None
+):
+    """
+    单个分片的扫描逻辑：为分片内的每个用户与候选人进行对话评估
+    分片内所有用户共享同一个并发上限；传入 funnel 时只有破冰达标的配对才会深聊
+    """
+    from src.batch_engine import BatchMatchEngine
+    from src.embedding_index import HashingVectorizer
+    from src.evaluator import MatchEvaluator, EvaluationError
+    from src.rate_limiter import Priority
+    from src.storage import CloudStorage
+    from src.write_behind import MatchRecordWriter
+
+    storage = CloudStorage()
+    # 分片内所有用户共享一个写缓冲，批量入库；记录入库 (或安全落盘) 后才推进检查点
+    writer = MatchRecordWriter(storage)
+    # 画像向量索引在分片内只加载一次，用于语义召回
+    index = await asyncio.to_thread(storage.load_embedding_index)
+    vectorizer = HashingVectorizer()
+    checkpoint = ShardCheckpoint(checkpoint_dir, shard_index)
+    done_pairs = checkpoint.load()
+    semaphore = asyncio.Semaphore(concurrency)
+    evaluator = MatchEvaluator(api_key, priority=Priority.BATCH)
+
+    usernames = [u for u in await asyncio.to_thread(storage.get_all_usernames) if shard_of(u, num_shards) == shard_index]
+    print(f"[Plaza shard {shard_index}] {len(usernames)} users, {len(done_pairs)} pairs already done")
+
+    async def reevaluate(user, record: dict):
+        """
+        对话已完成但评估失败的记录：只重新评估，不重新对话；再次失败则保持 failed 等下一轮
+        """
+        target = await asyncio.to_thread(storage.get_user_by_username, record["user_b"])
+        if target is None:
+            return # 虚拟嘉宾没有保存档案，无法重新评估
+        async with semaphore:
+            try:
+                report = await evaluator.evaluate_async(record["chat_log"], user, target)
+            except EvaluationError as e:
+                print(f"[Plaza shard {shard_index}] re-evaluation of record {record['id']} failed again: {e}")
+                return
+        await asyncio.to_thread(storage.update_match_evaluation, record["id"], report.get("total_score", 0), report.get("final_verdict", ""))
+
+    async def sweep_user(username: str):
+        user = await asyncio.to_thread(storage.get_user_by_username, username)
+        if user is None:
+            return
+        failed = await asyncio.to_thread(storage.get_failed_evaluations, username)
+        if failed:
+            await asyncio.gather(*(reevaluate(user, r) for r in failed))
+        # 有评估失败记录的配对只重新评估，不再重复对话
+        pending = {r["user_b"] for r in failed}
+        # 硬筛选放宽取数，再用语义召回挑出最可能聊得来的 candidates_per_user 位
+        # 已聊过的嘉宾会被滤掉，不足时沿 keyset 游标继续翻页，而不是每轮都只看最新的一页
+        chatted = await asyncio.to_thread(storage.get_chatted_users, username)
+        targets, cursor = [], None
+        for _ in range(MAX_CANDIDATE_PAGES):
+            page, cursor = await asyncio.to_thread(storage.get_candidate_page, username, candidates_per_user * 3, user, cursor)
+            targets += [c for c in page if c.user_id not in chatted and c.user_id not in pending and (username, c.user_id) not in done_pairs]
+            if cursor is None or len(targets) >= candidates_per_user * 3:
+                break
+        if len(index) and len(targets) > candidates_per_user:
+            neighbors = index.query(vectorizer.encode(user), top_k=candidates_per_user * 10, exclude={username})
+            rank = {uid: i for i, (uid, _) in enumerate(neighbors)}
+            targets.sort(key=lambda c: rank.get(c.user_id, len(rank))) # 未召回的保持 SQL 顺序排在后面
+        targets = targets[:candidates_per_user]
+        if not targets:
+            return
+
+        def on_result(result):
+            writer.add(user.user_id, result.target.user_id, result.history, result.score, result.report.get("final_verdict", ""),
+                       eval_status=result.eval_status,
+                       user_a_name=user.name, user_b_name=result.target.name,
+                       on_saved=lambda target_id=result.target.user_id: checkpoint.mark(user.user_id, target_id))
+
+        engine = BatchMatchEngine(user, api_key, concurrency=concurrency, max_turns=max_turns, on_result=on_result, funnel=funnel)
+        results = await engine.run_async(targets, semaphore=semaphore)
+        failed = sum(1 for r in results if r.error)
+        print(f"[Plaza shard {shard_index}] {username}: {len(results) - failed} done, {failed} failed")
+
+    try:
+        await asyncio.gather(*(sweep_user(u) for u in usernames))
+    finally:
+        await asyncio.to_thread(writer.close)
+
+
+def _shard_main(shard_index: int, num_shards: int, api_key: str, checkpoint_dir: str, candidates_per_user: int, concurrency: int, max_turns: int, funnel: Optional[FunnelConfig] = None):
+    """
+    子进程入口：每个进程拥有独立的事件循环与 LLM 连接池
+    """
+    # 总配额按分片平分，避免多个进程叠加后超出 API 限流
+    for var, default in (("MOONSHOT_RPM", "60"), ("MOONSHOT_TPM", "64000")):
+        total = int(os.getenv(var, default))
+        os.environ[var] = str(max(1, total // num_shards))
+
+    asyncio.run(run_shard_async(shard_index, num_shards, api_key, checkpoint_dir, candidates_per_user, concurrency, max_turns, funnel))
+
+
+class PlazaSweep:
+    """
+    “虚拟广场”多进程扫描：按用户名分片到多个进程，崩溃的分片会从检查点自动恢复
+    """
+    def __init__(
+        self,
+        api_key: str,
+        num_shards: Optional[int] = None,
+        checkpoint_dir: str = "checkpoints/plaza",
+        candidates_per_user: int = 200,
+        concurrency: int = 8,
+        max_turns: int = 5,
+        max_restarts: int = 3,
+        funnel: Optional[FunnelConfig] = None
+    ):
+        self.api_key = api_key
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.checkpoint_dir = checkpoint_dir
+        self.candidates_per_user = candidates_per_user
+        self.concurrency = concurrency
+        self.max_turns = max_turns
+        self.max_restarts = max_restarts
+        self.funnel = funnel
+
+    def _spawn(self, ctx, shard_index: int):
+        proc = ctx.Process(
+            target=_shard_main,
+            args=(shard_index, self.num_shards, self.api_key, self.checkpoint_dir,
+                  self.candidates_per_user, self.concurrency, self.max_turns, self.funnel),
+            name=f"plaza-shard-{shard_index}",
+        )
+        proc.start()
+        return proc
+
+    def run(self) -> List[int]:
+        """
+        启动所有分片并等待结束；返回最终失败的分片编号
+        """
+        # spawn：子进程不继承父进程的事件循环/连接池
+        ctx = multiprocessing.get_context("spawn")
+        procs = {i: self._spawn(ctx, i) for i in range(self.num_shards)}
+        restarts = {i: 0 for i in range(self.num_shards)}
+        failed = []
+
+        while procs:
+            for shard_index, proc in list(procs.items()):
+                proc.join(timeout=1.0)
+                if proc.exitcode is None:
+                    continue
+                del procs[shard_index]
+                if proc.exitcode == 0:
+                    print(f"[Plaza] shard {shard_index} finished")
+                elif restarts[shard_index] < self.max_restarts:
+                    restarts[shard_index] += 1
+                    print(f"[Plaza] shard {shard_index} crashed (exit {proc.exitcode}), resuming from checkpoint ({restarts[shard_index]}/{self.max_restarts})")
+                    procs[shard_index] = self._spawn(ctx, shard_index)
+                else:
+                    print(f"[Plaza] shard {shard_index} failed after {self.max_restarts} restarts")
+                    failed.append(shard_index)
+        return failed
@@ -0,0 +1,161 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from src.agent_builder import AgentProfile
+from src.termination import is_filler
+
+# 旧版本把模型报错当作回复写进了对话，这类记录没有评估价值
+ERROR_MARKERS = ("[Model Error]", "Model Error", "系统错误", "Error code")
+
+EMOJI_PATTERN = re.compile("[\U0001F300-\U0001FAFF☀-➿]")
+QUESTION_PATTERN = re.compile(r"[?？]|吗|呢|什么|怎么|为什么|哪")
+EXCLAMATION_PATTERN = re.compile(r"[!！]")
+CJK_PATTERN = re.compile(r"[一-鿿]+")
+
+# 校准关键词里没有区分度的常见二字词
+STOP_BIGRAMS = {"我会", "我们", "自己", "一个", "这个", "那个", "觉得", "可以", "就是", "如果", "什么", "然后", "还是", "因为", "所以", "不会", "没有"}
+
+
+@dataclass
+class ChatMetrics:
+    """聊天记录的互动指标 (按发言人统计)"""
+    turns: int = 0
+    error_messages: int = 0
+    avg_len: Dict[str, float] = field(default_factory=dict)
+    questions: Dict[str, int] = field(default_factory=dict)
+    filler_ratio: Dict[str, float] = field(default_factory=dict)
+    length_ratio: float = 0.0       # 较短一方 / 较长一方的平均长度 (1 为完全平衡)
+    emoji_density: float = 0.0      # 每条消息的 emoji 数
+    exclamation_density: float = 0.0
+    calibration_alignment: Optional[float] = None # 乙方发言覆盖甲方校准关键词的比例，无校准数据时为 None
+
+
+@dataclass
+class PreJudgement:
+    """本地预判结果：confident 为 True 时可直接采用 score，无需再调用 LLM"""
+    score: int
+    confident: bool
+    reason: str
+    metrics: ChatMetrics
+    violations: List[str] = field(default_factory=list)
+
+
+def _bigrams(text: str) -> set:
+    grams = set()
+    for run in CJK_PATTERN.findall(text or ""):
+        grams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return grams - STOP_BIGRAMS
+
+
+def calibration_alignment(history: List[Dict[str, str]], profile_a: AgentProfile, name_b: str) -> Optional[float]:
+    """
+    甲方每条校准回答的关键词 (中文二字词) 是否在乙方发言中出现，返回命中的回答比例
+    """
+    answers = [item.get("answer", "") for item in profile_a.persona.turing_calibration_data or [] if isinstance(item, dict)]
+    answers = [a for a in answers if _bigrams(a)]
+    if not answers:
+        return None
+    spoken = set()
+    for msg in history:
+        if msg["name"] == name_b:
+            spoken |= _bigrams(msg["content"])
+    hits = sum(1 for a in answers if _bigrams(a) & spoken)
+    return hits / len(answers)
+
+
+def compute_metrics(history: List[Dict[str, str]], profile_a: AgentProfile, profile_b: AgentProfile) -> ChatMetrics:
+    metrics = ChatMetrics()
+    by_speaker: Dict[str, List[str]] = {profile_a.name: [], profile_b.name: []}
+    for msg in history:
+        content = msg.get("content") or ""
+        if any(marker in content for marker in ERROR_MARKERS):
+            metrics.error_messages += 1
+            continue
+        by_speaker.setdefault(msg["name"], []).append(content)
+
+    metrics.turns = min(len(by_speaker[profile_a.name]), len(by_speaker[profile_b.name]))
+    total = sum(len(msgs) for msgs in by_speaker.values())
+    for name, msgs in by_speaker.items():
+        metrics.avg_len[name] = sum(len(m) for m in msgs) / len(msgs) if msgs else 0.0
+        metrics.questions[name] = sum(1 for m in msgs if QUESTION_PATTERN.search(m))
+        metrics.filler_ratio[name] = sum(1 for m in msgs if is_filler(m)) / len(msgs) if msgs else 1.0
+
+    lengths = [metrics.avg_len[profile_a.name], metrics.avg_len[profile_b.name]]
+    metrics.length_ratio = min(lengths) / max(lengths) if max(lengths) > 0 else 0.0
+    if total:
+        all_text = [m for msgs in by_speaker.values() for m in msgs]
+        metrics.emoji_density = sum(len(EMOJI_PATTERN.findall(m)) for m in all_text) / total
+        metrics.exclamation_density = sum(len(EXCLAMATION_PATTERN.findall(m)) for m in all_text) / total
+    metrics.calibration_alignment = calibration_alignment(history, profile_a, profile_b.name)
+    return metrics
+
+
+class PreJudge:
+    """
+    本地启发式评分 (0-100)，用于跳过结果显而易见的 LLM 评估
+
+    - 对话失败 (报错/几乎没聊)、违反硬性标准：直接给出确定的低分
+    - 其余情况按互动平衡、提问、情绪信号、校准关键词命中率打分，低于 uncertain_low 视为确定的低分；
+      高分一律交给 LLM 评估 —— 校准关键词重叠只说明乙方提到了同样的话题，看不出立场是否一致，
+      价值观冲突只有 LLM 裁判能否决
+    """
+    def __init__(self, uncertain_low: int = 35, min_turns: int = 2):
+        self.uncertain_low = uncertain_low
+        self.min_turns = min_turns
+
+    def judge(self, history: List[Dict[str, str]], profile_a: AgentProfile, profile_b: AgentProfile) -> PreJudgement:
+        metrics = compute_metrics(history, profile_a, profile_b)
+        name_a, name_b = profile_a.name, profile_b.name
+
+        # 1. 明显失败的对话
+        if metrics.error_messages and metrics.error_messages * 2 >= len(history):
+            return PreJudgement(0, True, "对话因模型报错未能正常进行", metrics)
+        if metrics.turns < self.min_turns:
+            return PreJudgement(10, True, "双方几乎没有交流", metrics)
+        if max(metrics.filler_ratio[name_a], metrics.filler_ratio[name_b]) >= 0.5:
+            return PreJudgement(15, True, "一方基本只在回复语气词", metrics)
+
+        # 2. 违反硬性择偶标准 (与 _evaluate_match 相同的年龄差 / 身高规则)
+        violations = profile_a.hard_violations(profile_b)
+        if violations:
+            return PreJudgement(20, True, "违反硬性标准：" + "，".join(violations), metrics, violations)
+
+        # 3. 启发式打分
+        score = 20.0
+        score += 30 * metrics.length_ratio
+        asked = min(metrics.questions[name_a], metrics.questions[name_b]) / max(1, metrics.turns)
+        score += 15 * min(1.0, asked * 2) # 双方都会提问，说明不是单方面输出
+        score += 5 * min(1.0, (metrics.emoji_density + metrics.exclamation_density) / 2)
+        if metrics.calibration_alignment is not None:
+            score += 30 * metrics.calibration_alignment
+        else:
+            score += 15
+        score = int(round(min(100, max(0, score))))
+
+        confident = score < self.uncertain_low
+        reason = "互动指标明显偏弱" if confident else "结果不确定，需要 LLM 评估"
+        return PreJudgement(score, confident, reason, metrics)
+
+
+def prejudge_report(judgement: PreJudgement) -> Dict:
+    """
+    把本地预判结果转成与 MatchEvaluator 相同字段的报告
+    """
+    m = judgement.metrics
+    interaction_comment = f"回复长度平衡度 {m.length_ratio:.2f}，完成 {m.turns} 轮对话"
+    if m.calibration_alignment is None:
+        values_comment = "甲方未提供价值观校准数据"
+    else:
+        values_comment = f"乙方发言覆盖了 {m.calibration_alignment:.0%} 的价值观基准关键词"
+    return {
+        "interaction_score": judgement.score,
+        "interaction_comment": interaction_comment,
+        "values_score": judgement.score,
+        "values_comment": values_comment,
+        "chemistry_score": judgement.score,
+        "chemistry_comment": f"每条消息 emoji {m.emoji_density:.1f} 个、感叹号 {m.exclamation_density:.1f} 个",
+        "total_score": judgement.score,
+        "final_verdict": judgement.reason,
+        "suggestion": "本地预判结果，未调用 LLM 评估",
+        "source": "prejudge",
+    }
@@ -0,0 +1,111 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from src.agent_builder import AgentProfile
+
+
+def _to_int(value) -> float:
+    try:
+        return float(int(value))
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _mbti_letter(mbti: str, idx: int) -> int:
+    if mbti and len(mbti) > idx:
+        return ord(mbti[idx])
+    return 0
+
+
+class CandidateMatrix:
+    """
+    将候选人档案编码为 NumPy 数组 (编码一次，可对任意用户重复打分)
+
+    - ages / heights: float 数组，无法解析时为 NaN
+    - mbti_ei / mbti_ns: MBTI 第 1、2 个字母的编码，缺失为 0
+    - interests: (候选人数 x 兴趣词表) 的 0/1 矩阵
+    """
+    def __init__(self, candidates: List[AgentProfile]):
+        self.candidates = list(candidates)
+        n = len(self.candidates)
+
+        self.ages = np.array([_to_int(c.attributes.age) for c in self.candidates], dtype=np.float64)
+        self.heights = np.array([_to_int(c.attributes.height) for c in self.candidates], dtype=np.float64)
+        self.has_mbti = np.array([bool(c.persona.mbti) for c in self.candidates], dtype=bool)
+        self.mbti_ei = np.array([_mbti_letter(c.persona.mbti, 0) for c in self.candidates], dtype=np.int32)
+        self.mbti_ns = np.array([_mbti_letter(c.persona.mbti, 1) for c in self.candidates], dtype=np.int32)
+
+        vocab = {}
+        for c in self.candidates:
+            for tag in c.persona.interests or []:
+                vocab.setdefault(tag, len(vocab))
+        self.vocab = list(vocab)
+        self.interests = np.zeros((n, len(vocab)), dtype=np.int8)
+        for i, c in enumerate(self.candidates):
+            for tag in c.persona.interests or []:
+                self.interests[i, vocab[tag]] = 1
+
+    def __len__(self):
+        return len(self.candidates)
+
+
+def batch_score(user: AgentProfile, matrix: CandidateMatrix) -> np.ndarray:
+    """
+    向量化打分，语义与 AgentProfile._evaluate_match 完全一致 (0-10 分)
+    """
+    n = len(matrix)
+    score = np.full(n, 5, dtype=np.int32)
+    prefs = getattr(user, "preferences", None)
+
+    # 1. 硬性条件 - 年龄 (任一方无法解析时不加不减)
+    my_age = _to_int(user.attributes.age)
+    if not np.isnan(my_age):
+        age_diff = np.abs(matrix.ages - my_age)
+        valid = ~np.isnan(age_diff)
+        if hasattr(prefs, "max_age_gap"):
+            within = age_diff <= prefs.max_age_gap
+            score += np.where(valid & within, 1, 0) + np.where(valid & ~within, -2, 0)
+        else:
+            score += np.where(valid & (age_diff <= 5), 1, 0)
+
+    # 2. 硬性条件 - 身高
+    if hasattr(prefs, "min_height"):
+        min_height = _to_int(prefs.min_height)
+        if not np.isnan(min_height):
+            valid = ~np.isnan(matrix.heights)
+            tall_enough = matrix.heights >= min_height
+            score += np.where(valid & tall_enough, 1, 0) + np.where(valid & ~tall_enough, -2, 0)
+
+    # 3. 兴趣重叠 (文本模糊匹配：任一方向子串即算共同兴趣)
+    my_interests = set(user.persona.interests or [])
+    if my_interests and matrix.vocab:
+        related = np.array(
+            [any(mi in tag or tag in mi for mi in my_interests) for tag in matrix.vocab],
+            dtype=np.int8
+        )
+        common = matrix.interests @ related
+        score += np.where(common > 0, 3, 0)
+
+    # 4. MBTI 匹配 (E/I 互补加分，N/S 相似加分)
+    if user.persona.mbti:
+        my_ei = _mbti_letter(user.persona.mbti, 0)
+        my_ns = _mbti_letter(user.persona.mbti, 1)
+        score += np.where(matrix.has_mbti & (matrix.mbti_ei != my_ei), 1, 0)
+        score += np.where(matrix.has_mbti & (matrix.mbti_ns == my_ns), 1, 0)
+
+    return np.clip(score, 0, 10)
+
+
+def rank_candidates(user: AgentProfile, candidates, top_k: int = 5, tiebreak: Optional[Sequence[float]] = None) -> List[Tuple[AgentProfile, int]]:
+    """
+    对候选池一次性打分并返回前 top_k 名 (分数相同按原顺序，结果确定)
+
+    candidates 可以是档案列表，也可以是预先编码好的 CandidateMatrix
+    tiebreak: 可选，与候选人一一对应的次级排序值 (越大越靠前，如语义相似度)，只在规则分数相同时生效
+    """
+    matrix = candidates if isinstance(candidates, CandidateMatrix) else CandidateMatrix(candidates)
+    if len(matrix) == 0:
+        return []
+    scores = batch_score(user, matrix)
+    secondary = -np.asarray(tiebreak, dtype=np.float64) if tiebreak is not None else np.zeros(len(matrix))
+    order = np.lexsort((np.arange(len(matrix)), secondary, -scores))[:top_k]
+    return [(matrix.candidates[i], int(scores[i])) for i in order]
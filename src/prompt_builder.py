@@ -0,0 +1,82 @@
+from typing import List, Dict, Optional
+
+_encoder = None
+_encoder_failed = False
+
+def count_tokens(text: str) -> int:
+    """
+    使用 tiktoken 统计 Token 数；编码表不可用时按字符数粗略估算 (中文约 1.5 字/Token)
+    """
+    global _encoder, _encoder_failed
+    if not text:
+        return 0
+    if _encoder is None and not _encoder_failed:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"[PromptBuilder] tiktoken unavailable, falling back to estimate: {e}")
+            _encoder_failed = True
+    if _encoder is not None:
+        return len(_encoder.encode(text))
+    return int(len(text) / 1.5) + 1
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    统计消息列表的 Token 数 (每条消息额外计 4 个格式开销)
+    """
+    return sum(count_tokens(m.get("content") or "") + 4 for m in messages)
+
+
+class PromptBuilder:
+    """
+    前缀友好的消息构造器
+
+    消息顺序固定为：
+        [静态人设 system] + [滚动摘要 system (可选)] + [历史对话 (按 Token 预算截断)] + [阶段增量 system]
+    静态人设整场对话不变，服务端可以复用前缀缓存；摘要只在折叠时变化，每轮只有末尾很短的阶段提示在变化。
+    """
+    def __init__(self, persona_prompt: str, history_token_budget: int = 2500):
+        self.persona_prompt = persona_prompt
+        self.history_token_budget = history_token_budget
+        self._token_cache: Dict[str, int] = {}
+
+    def _cost(self, msg: Dict[str, str]) -> int:
+        content = msg.get("content") or ""
+        cost = self._token_cache.get(content)
+        if cost is None:
+            cost = count_tokens(content) + 4
+            self._token_cache[content] = cost
+        return cost
+
+    def warm(self, history: List[Dict[str, str]]):
+        """
+        预先计算历史消息的 Token 数 (在对方生成回复期间调用，轮到自己时直接复用)
+        """
+        for msg in history:
+            self._cost(msg)
+
+    def trim_history(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        从最新的消息往回保留，直到超出预算；至少保留最后一条
+        """
+        kept = []
+        used = 0
+        for msg in reversed(history):
+            cost = self._cost(msg)
+            if kept and used + cost > self.history_token_budget:
+                break
+            kept.append(msg)
+            used += cost
+        kept.reverse()
+        return kept
+
+    def build(self, history: List[Dict[str, str]], phase_prompt: Optional[str] = None, summary: Optional[str] = None) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": self.persona_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": f"# 之前的对话摘要\n{summary}"})
+        messages.extend(self.trim_history(history))
+        if phase_prompt:
+            messages.append({"role": "system", "content": phase_prompt})
+        return messages
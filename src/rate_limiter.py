@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from enum import IntEnum
+from typing import List, Dict
+from src.prompt_builder import count_message_tokens
+
+
+class Priority(IntEnum):
+    """
+    调度优先级 (数值越小越优先)
+    """
+    INTERACTIVE = 0  # 深度聊天室：用户正在盯着屏幕
+    EVALUATION = 1   # 裁判报告
+    BATCH = 2        # 批量匹配等后台任务
+
+
+class TokenBucket:
+    """
+    令牌桶：容量 capacity，每秒补充 rate 个令牌
+    """
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """距离攒够 amount 个令牌还需要等待的秒数"""
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    客户端限流调度器：同时约束 请求数/分钟 与 Token数/分钟
+
+    - 请求按 (优先级, 到达顺序) 排队，只有队首可以取令牌，保证交互请求插队到后台任务之前
+    - 令牌不足时排队等待 (pacing)，而不是直接失败
+    - 状态由线程锁保护，可被多个事件循环/线程共享
+    """
+    def __init__(self, requests_per_minute: int = 60, tokens_per_minute: int = 64000):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        self._lock = threading.Lock()
+        self._waiters = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+
+    async def acquire(self, tokens: int, priority: Priority = Priority.BATCH):
+        """
+        排队直到同时拿到 1 个请求令牌和 tokens 个 Token 令牌
+        """
+        # 单次请求不能超过桶容量，否则永远等不到
+        tokens = min(tokens, self.tokens.capacity)
+        entry = (int(priority), next(self._seq))
+        with self._lock:
+            heapq.heappush(self._waiters, entry)
+
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+
+                    if now < self._paused_until:
+                        wait = self._paused_until - now
+                    elif self._waiters[0] != entry:
+                        # 不是队首，稍后再看
+                        wait = 0.05
+                    else:
+                        wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            self.requests.tokens -= 1
+                            self.tokens.tokens -= tokens
+                            heapq.heappop(self._waiters)
+                            return
+                await asyncio.sleep(min(wait, 1.0))
+        except BaseException:
+            # 被取消时从队列中移除，避免堵住后面的请求
+            with self._lock:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+            raise
+
+    def settle(self, estimated: int, actual: int):
+        """
+        请求完成后用真实用量校正 Token 桶 (可能透支为负数，从而放慢后续请求)
+        """
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.tokens -= (actual - estimated)
+
+    def pause(self, seconds: float):
+        """
+        服务端返回 429 时整体暂停发放令牌
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_completion_tokens: int = 300) -> int:
+    """
+    估算一次请求消耗的 Token 数 (输入按 tiktoken 计数 + 预留的输出上限)
+    """
+    return count_message_tokens(messages) + max_completion_tokens
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(api_key: str) -> RateLimiter:
+    """
+    每个 API Key 共享一个限流器 (配额可通过环境变量 MOONSHOT_RPM / MOONSHOT_TPM 调整)
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(api_key)
+        if limiter is None:
+            limiter = RateLimiter(
+                requests_per_minute=int(os.getenv("MOONSHOT_RPM", "60")),
+                tokens_per_minute=int(os.getenv("MOONSHOT_TPM", "64000")),
+            )
+            _limiters[api_key] = limiter
+        return limiter
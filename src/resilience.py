@@ -0,0 +1,145 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+import httpx
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+T = TypeVar("T")
+
+
+class LLMCallError(Exception):
+    """
+    重试耗尽 (或遇到不可重试错误) 后抛出，调用方据此中止本次对话，而不是把错误文本当作回复
+    """
+    pass
+
+
+@dataclass
+class RetryPolicy:
+    """重试/超时/对冲请求策略"""
+    max_attempts: int = 4          # 最多尝试次数 (含首次)
+    base_delay: float = 0.5        # 指数退避基数 (秒)
+    max_delay: float = 8.0         # 单次退避上限 (秒)
+    timeout: float = 30.0          # 单次请求超时 (秒)
+    hedge: bool = False            # 是否启用对冲请求
+    hedge_quantile: float = 0.95   # 超过该分位延迟仍未返回时，发出一个重复请求
+    hedge_min_samples: int = 20    # 样本不足时不对冲 (分位数不可靠)
+
+
+# 交互式对话 (深度聊天室) 启用对冲请求，用少量额外调用压低尾延迟
+INTERACTIVE_POLICY = RetryPolicy(hedge=True)
+
+
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+    httpx.TransportError,
+)
+
+
+class LatencyTracker:
+    """
+    滑动窗口延迟统计，用于计算对冲阈值
+    """
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[idx]
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy) -> float:
+    """
+    Full Jitter 指数退避：在 [0, min(max_delay, base * 2^attempt)] 内均匀取值
+    """
+    return random.uniform(0, min(policy.max_delay, policy.base_delay * (2 ** attempt)))
+
+
+Gate = Optional[Callable[[], Awaitable[None]]]
+
+
+async def _timed_attempt(factory: Callable[[], Awaitable[T]], policy: RetryPolicy, tracker: Optional[LatencyTracker], gate: Gate) -> T:
+    # 排队 (限流) 时间不计入超时，也不计入延迟统计
+    if gate:
+        await gate()
+    started = time.monotonic()
+    result = await asyncio.wait_for(factory(), timeout=policy.timeout)
+    if tracker:
+        tracker.record(time.monotonic() - started)
+    return result
+
+
+async def _hedged_attempt(factory: Callable[[], Awaitable[T]], policy: RetryPolicy, tracker: Optional[LatencyTracker], gate: Gate) -> T:
+    """
+    先发一个请求；若超过 p95 仍未返回，再发一个重复请求，取先成功的那个
+    """
+    threshold = None
+    if policy.hedge and tracker and len(tracker.samples) >= policy.hedge_min_samples:
+        threshold = tracker.quantile(policy.hedge_quantile)
+
+    primary = asyncio.ensure_future(_timed_attempt(factory, policy, tracker, gate))
+    if threshold is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=threshold)
+    if done:
+        return primary.result()
+
+    hedge = asyncio.ensure_future(_timed_attempt(factory, policy, tracker, gate))
+    pending = {primary, hedge}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_with_retry(
+    factory: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    tracker: Optional[LatencyTracker] = None,
+    describe: str = "LLM call",
+    gate: Gate = None
+) -> T:
+    """
+    带超时、抖动指数退避与可选对冲的调用包装
+
+    factory 每次调用都必须返回一个新的 awaitable (重试/对冲会多次调用)
+    gate 在每次尝试前等待 (如限流排队)，不计入超时
+    """
+    last_error = None
+    for attempt in range(policy.max_attempts):
+        try:
+            return await _hedged_attempt(factory, policy, tracker, gate)
+        except RETRYABLE_ERRORS as e:
+            last_error = e
+            if attempt + 1 >= policy.max_attempts:
+                break
+            delay = backoff_delay(attempt, policy)
+            print(f"[Retry] {describe} failed ({type(e).__name__}: {e}), retry {attempt + 1} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            # 鉴权失败、参数错误等不可重试
+            raise LLMCallError(f"{describe} failed: {e}") from e
+
+    raise LLMCallError(f"{describe} failed after {policy.max_attempts} attempts: {last_error}") from last_error
@@ -1,12 +1,50 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from sqlalchemy import text
 from src.agent_builder import AgentProfile, HardAttributes, HardPreferences, Persona
 import json
 import hashlib
+import time
+import numpy as np
+from collections import OrderedDict
+from src.embedding_index import HashingVectorizer, EmbeddingIndex, EMBEDDING_MODEL
+from src.write_behind import match_record_row
+
+# 每个浏览器会话最多缓存的完整对话数 (get_chat_log)
+CHAT_LOG_CACHE_SIZE = 32
+
+# 会话级查询缓存的有效期 (秒)。本会话内的写操作会立即失效对应查询，
+# TTL 只用来兜底其他会话 / 后台 Worker 写入的数据
+QUERY_TTLS = {
+    "top_matches": 300,
+    "recent_matches": 300,
+    "chatted_users": 300,
+    "candidate_page": 120,
+    "job_stats": 10,
+}
+# 写操作 -> 需要失效的查询
+MATCH_QUERIES = ("top_matches", "recent_matches", "chatted_users")
+USER_QUERIES = ("candidate_page",)
+# 每个会话最多缓存的查询结果数 (候选人分页的每个游标都是一个键)
+QUERY_CACHE_SIZE = 64
+
+def _notify_error(message: str):
+    """
+    页面中用 st.error 提示；Worker / 广场扫描等脱离 Streamlit 运行时打印到日志
+    (裸模式下 st.error 只会产生一条 “missing ScriptRunContext” 警告，真正的错误会被淹没)
+    """
+    if get_script_run_ctx() is None:
+        print(f"[Storage] {message}")
+    else:
+        st.error(message)
+
 
 class CloudStorage:
     """
     Supabase 数据库直连封装 (SQLAlchemy)
+
+    也可以在 Streamlit 之外使用 (worker.py / plaza_sweep.py)：st.connection 同样读取 .streamlit/secrets.toml，
+    错误信息改为打印到日志，会话级缓存不生效；调用方应检查 is_connected
     """
     def __init__(self):
         try:
@@ -14,9 +52,45 @@ class CloudStorage:
             self.conn = st.connection("supabase", type="sql")
             self.is_connected = True
         except Exception as e:
-            st.error(f"[系统错误] 数据库连接失败: {e}")
+            _notify_error(f"[系统错误] 数据库连接失败: {e}")
             self.is_connected = False
 
+    def _cached_query(self, name: str, sql: str, params: dict):
+        """
+        带会话级 TTL 缓存的 conn.query：同一浏览器会话内重复渲染 (每次点击都会 rerun) 不再访问数据库
+        查询失败时异常照常抛出，不会被缓存；不在 Streamlit 会话中 (Worker / 广场扫描) 时直接查询
+        过期条目在每次访问时清理，总条数超过 QUERY_CACHE_SIZE 时淘汰最久未用的 (LRU)
+        """
+        if get_script_run_ctx() is None:
+            return self.conn.query(sql, params=params, ttl=0)
+
+        cache = st.session_state.setdefault("storage_query_cache", OrderedDict())
+        now = time.monotonic()
+        for stale in [k for k, (ts, _) in cache.items() if now - ts >= QUERY_TTLS[k[0]]]:
+            del cache[stale]
+
+        key = (name, sql, json.dumps(params, sort_keys=True, default=str))
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key][1]
+        df = self.conn.query(sql, params=params, ttl=0)
+        cache[key] = (now, df)
+        while len(cache) > QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
+        return df
+
+    def invalidate_cache(self, *names: str):
+        """
+        失效会话级查询缓存；不传参数时全部失效
+        """
+        if get_script_run_ctx() is None:
+            return
+        cache = st.session_state.get("storage_query_cache")
+        if not cache:
+            return
+        for key in [k for k in cache if not names or k[0] in names]:
+            del cache[key]
+
     def _hash_password(self, password: str) -> str:
         """简单的 SHA256 哈希"""
         return hashlib.sha256(password.encode()).hexdigest()
@@ -26,7 +100,7 @@ class CloudStorage:
         注册或更新用户信息 (包含密码)
         """
         if not self.is_connected:
-            st.error("注册失败：数据库未连接，请检查配置或网络。")
+            _notify_error("注册失败：数据库未连接，请检查配置或网络。")
             return False
 
         # 密码加密 (SHA256)
@@ -68,11 +142,19 @@ class CloudStorage:
             with self.conn.session as s:
                 s.execute(sql, data)
                 s.commit()
-            return True
         except Exception as e:
-            st.error(f"注册失败: {e}")
+            _notify_error(f"注册失败: {e}")
             return False
 
+        self.invalidate_cache(*USER_QUERIES)
+        # 资料变更后同步刷新画像向量 (失败不影响注册)
+        # 按数据库中保存的档案编码 (与 build_embeddings.py 同一来源)：内存中的 profile 还带有
+        # values_keywords 等未入库的字段，直接编码会让同一用户因写入路径不同得到不同的向量
+        stored = self.get_user_by_username(username)
+        if stored is not None:
+            self.save_user_embeddings([(username, HashingVectorizer().encode(stored))])
+        return True
+
     def verify_user(self, username: str, password: str) -> bool:
         """
         验证用户登录
@@ -101,29 +183,173 @@ class CloudStorage:
             print(f"Login error: {e}")
             return False
 
-    def save_match_record(self, user_a: str, user_b: str, chat_log: list, score: int, report: str):
+    def save_match_record(self, user_a: str, user_b: str, chat_log: list, score: int, report: str, eval_status: str = "ok",
+                          user_a_name: str = None, user_b_name: str = None):
         """
-        保存匹配记录
+        保存匹配记录 (单条，立即提交)；批量场景使用 src.write_behind.MatchRecordWriter
+
+        eval_status: 'ok' / 'failed' (对话完成但评估失败，待重新评估) / 'screened' (漏斗提前淘汰，分数为快评)
+        user_a_name / user_b_name: 双方显示名，写入时冗余存储，列表查询不再关联 users 或解析 chat_log
+                                   (未传入时按 username 从 users 表补齐)
         """
         if not self.is_connected: return
         
+        try:
+            self.save_match_records([match_record_row(user_a, user_b, chat_log, score, report, eval_status, user_a_name, user_b_name)])
+        except Exception as e:
+            _notify_error(f"保存匹配记录失败: {e}")
+
+    def save_match_records(self, rows: list[dict]) -> int:
+        """
+        在一个事务中用一条多行 INSERT 写入多条匹配记录 (rows 由 match_record_row 生成)
+        失败时抛出异常、整批回滚，由调用方决定重试或落盘
+        """
+        if not rows: return 0
+        if not self.is_connected:
+            raise ConnectionError("database not connected")
+
+        values, params = [], {}
+        for i, row in enumerate(rows):
+            values.append(f"""(
+                :user_a_{i}, :user_b_{i}, :chat_log_{i}, :score_{i}, :report_{i}, :eval_status_{i},
+                COALESCE(:user_a_name_{i}, (SELECT name FROM users WHERE username = :user_a_{i})),
+                COALESCE(:user_b_name_{i}, (SELECT name FROM users WHERE username = :user_b_{i})),
+                :user_b_virtual_{i}
+            )""")
+            params.update({f"{k}_{i}": v for k, v in row.items()})
+        sql = text(f"""
+            INSERT INTO match_records (user_a, user_b, chat_log, match_score, report, eval_status, user_a_name, user_b_name, user_b_virtual)
+            VALUES {", ".join(values)}
+        """)
+
+        with self.conn.session as s:
+            s.execute(sql, params)
+            s.commit()
+        self.invalidate_cache(*MATCH_QUERIES)
+        return len(rows)
+
+    def enqueue_match_jobs(self, user_a: str, targets: list[AgentProfile]) -> int:
+        """
+        将批量匹配任务写入队列，由后台 Worker 执行
+        返回成功入队的任务数
+        """
+        if not self.is_connected: return 0
+        
         try:
             sql = text("""
-                INSERT INTO match_records (user_a, user_b, chat_log, match_score, report)
-                VALUES (:user_a, :user_b, :chat_log, :score, :report)
+                INSERT INTO match_jobs (user_a, user_b, target_profile)
+                VALUES (:user_a, :user_b, :target_profile)
             """)
-            
-            with self.conn.session as s:
-                s.execute(sql, {
+            rows = []
+            for target in targets:
+                # 虚拟嘉宾不在 users 表里，需要保存档案快照
+                is_virtual = target.user_id.startswith("guest_")
+                rows.append({
                     "user_a": user_a,
-                    "user_b": user_b,
-                    "chat_log": json.dumps(chat_log, ensure_ascii=False),
-                    "score": score,
-                    "report": report
+                    "user_b": target.user_id,
+                    "target_profile": target.to_json() if is_virtual else None
                 })
+            
+            with self.conn.session as s:
+                s.execute(sql, rows)
                 s.commit()
+            self.invalidate_cache("job_stats")
+            return len(rows)
         except Exception as e:
-            st.error(f"保存匹配记录失败: {e}")
+            _notify_error(f"任务入队失败: {e}")
+            return 0
+
+    def claim_match_job(self, worker_id: str, stale_minutes: int = 15, max_attempts: int = 3) -> dict:
+        """
+        领取一个待处理任务 (FOR UPDATE SKIP LOCKED，多个 Worker 并发领取互不冲突)
+        超过 stale_minutes 仍处于 running 的任务视为 Worker 已崩溃，可被重新领取；
+        已尝试 max_attempts 次仍超时的任务 (每次都让 Worker 崩溃的“毒任务”) 直接标记为 failed
+        """
+        if not self.is_connected: return None
+        
+        poison_sql = text("""
+            UPDATE match_jobs
+            SET status = 'failed',
+                error = concat_ws('; ', error, 'worker lost after ' || attempts || ' attempts'),
+                locked_by = NULL,
+                updated_at = now()
+            WHERE status = 'running'
+              AND locked_at < now() - make_interval(mins => :stale)
+              AND attempts >= :max_attempts
+        """)
+        sql = text("""
+            UPDATE match_jobs
+            SET status = 'running',
+                attempts = attempts + 1,
+                locked_by = :worker_id,
+                locked_at = now(),
+                updated_at = now()
+            WHERE id = (
+                SELECT id FROM match_jobs
+                WHERE attempts < :max_attempts
+                  AND (status = 'pending'
+                       OR (status = 'running' AND locked_at < now() - make_interval(mins => :stale)))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, user_a, user_b, target_profile, attempts
+        """)
+        try:
+            with self.conn.session as s:
+                limits = {"stale": stale_minutes, "max_attempts": max_attempts}
+                s.execute(poison_sql, limits)
+                row = s.execute(sql, {"worker_id": worker_id, **limits}).mappings().fetchone()
+                s.commit()
+            return dict(row) if row else None
+        except Exception as e:
+            print(f"Claim job error: {e}")
+            return None
+
+    def complete_match_job(self, job_id: int):
+        """
+        标记任务完成
+        """
+        if not self.is_connected: return
+        try:
+            with self.conn.session as s:
+                s.execute(text("UPDATE match_jobs SET status = 'done', error = NULL, updated_at = now() WHERE id = :id"), {"id": job_id})
+                s.commit()
+        except Exception as e:
+            print(f"Complete job error: {e}")
+
+    def fail_match_job(self, job_id: int, error: str, max_attempts: int = 3):
+        """
+        任务失败：未超过重试次数则放回队列，否则标记为 failed
+        """
+        if not self.is_connected: return
+        try:
+            sql = text("""
+                UPDATE match_jobs
+                SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+                    error = :error,
+                    locked_by = NULL,
+                    updated_at = now()
+                WHERE id = :id
+            """)
+            with self.conn.session as s:
+                s.execute(sql, {"id": job_id, "error": error[:1000], "max_attempts": max_attempts})
+                s.commit()
+        except Exception as e:
+            print(f"Fail job error: {e}")
+
+    def get_match_job_stats(self, username: str) -> dict:
+        """
+        获取某用户发起的任务进度
+        返回: { 'pending': n, 'running': n, 'done': n, 'failed': n }
+        """
+        if not self.is_connected: return {}
+        try:
+            sql = "SELECT status, COUNT(*) AS n FROM match_jobs WHERE user_a = :u GROUP BY status"
+            df = self._cached_query("job_stats", sql, {"u": username})
+            return {row["status"]: int(row["n"]) for _, row in df.iterrows()}
+        except Exception as e:
+            return {}
 
     def get_user_by_username(self, username: str) -> AgentProfile:
         """
@@ -145,134 +371,287 @@ class CloudStorage:
             print(f"Fetch user error: {e}")
             return None
 
-    def get_candidate_pool(self, current_username: str, limit: int = 20) -> list[AgentProfile]:
+    def get_all_usernames(self) -> list[str]:
+        """
+        获取全部注册用户名 (广场扫描按用户名分片)
+        """
+        if not self.is_connected: return []
+        try:
+            df = self.conn.query("SELECT username FROM users ORDER BY id", ttl=0)
+            return df["username"].tolist()
+        except Exception as e:
+            print(f"Fetch usernames error: {e}")
+            return []
+
+    def get_all_profiles(self) -> list[AgentProfile]:
+        """
+        获取全部用户档案 (离线构建画像向量时使用)
+        """
+        if not self.is_connected: return []
+        try:
+            df = self.conn.query("SELECT * FROM users ORDER BY id", ttl=0)
+            return [self._record_to_profile(record.to_dict()) for _, record in df.iterrows()]
+        except Exception as e:
+            print(f"Fetch profiles error: {e}")
+            return []
+
+    def save_user_embeddings(self, rows: list[tuple]) -> int:
+        """
+        批量写入画像向量
+        rows: [(username, np.ndarray), ...]
+        """
+        if not self.is_connected or not rows: return 0
+        try:
+            sql = text("""
+                INSERT INTO user_embeddings (username, embedding, model, updated_at)
+                VALUES (:username, :embedding, :model, now())
+                ON CONFLICT (username)
+                DO UPDATE SET embedding = EXCLUDED.embedding, model = EXCLUDED.model, updated_at = now()
+            """)
+            params = [{"username": u, "embedding": [float(x) for x in vec], "model": EMBEDDING_MODEL} for u, vec in rows]
+            with self.conn.session as s:
+                s.execute(sql, params)
+                s.commit()
+            return len(params)
+        except Exception as e:
+            print(f"Save embeddings error: {e}")
+            return 0
+
+    def load_embedding_index(self) -> EmbeddingIndex:
+        """
+        从数据库加载当前版本的全部画像向量并构建近似最近邻索引
+        """
+        index = EmbeddingIndex()
+        if not self.is_connected: return index
+        try:
+            df = self.conn.query("SELECT username, embedding FROM user_embeddings WHERE model = :model", params={"model": EMBEDDING_MODEL}, ttl=0)
+            if not df.empty:
+                vectors = np.array(df["embedding"].tolist(), dtype=np.float32)
+                index.build(df["username"].tolist(), vectors)
+        except Exception as e:
+            print(f"Load embeddings error: {e}")
+        return index
+
+    def get_candidate_pool(self, current_username: str, limit: int = 20, profile: AgentProfile = None) -> list[AgentProfile]:
         """
         获取广场嘉宾（排除自己）
+        传入 profile 时按其硬性择偶标准在 SQL 中过滤 (性别 / 年龄差 / 城市)
+        """
+        profiles, _ = self.get_candidate_page(current_username, limit=limit, profile=profile)
+        return profiles
+
+    def get_candidate_page(self, current_username: str, limit: int = 20, profile: AgentProfile = None, cursor: dict = None) -> tuple[list[AgentProfile], dict]:
+        """
+        分页获取符合硬性条件的嘉宾 (Keyset 分页，按 created_at, id 倒序)
+
+        cursor: 上一页返回的游标 {"created_at": ..., "id": ...}，None 表示第一页
+        返回: (嘉宾列表, 下一页游标；没有更多时为 None)
         """
         if not self.is_connected:
-            return []
+            return [], None
             
         try:
-            sql = "SELECT * FROM users WHERE username != :username ORDER BY created_at DESC LIMIT :limit"
-            df = self.conn.query(sql, params={"username": current_username, "limit": limit}, ttl=0)
+            conditions = ["username != :username"]
+            params = {"username": current_username, "limit": limit}
+            
+            # 硬筛选下推到 WHERE，配合 idx_users_gender_location_age
+            if profile is not None:
+                prefs = profile.preferences
+                if prefs.preferred_gender:
+                    conditions.append("gender = :gender")
+                    params["gender"] = prefs.preferred_gender
+                if prefs.allowed_locations:
+                    conditions.append("location = ANY(:locations)")
+                    params["locations"] = list(prefs.allowed_locations)
+                if prefs.max_age_gap is not None and profile.attributes.age is not None:
+                    conditions.append("age BETWEEN :min_age AND :max_age")
+                    params["min_age"] = int(profile.attributes.age) - int(prefs.max_age_gap)
+                    params["max_age"] = int(profile.attributes.age) + int(prefs.max_age_gap)
+            
+            # Keyset 分页：从上一页最后一条之后继续，不随页数变慢
+            if cursor:
+                conditions.append("(created_at, id) < (:cursor_created_at, :cursor_id)")
+                params["cursor_created_at"] = cursor["created_at"]
+                params["cursor_id"] = cursor["id"]
+            
+            sql = f"""
+                SELECT * FROM users
+                WHERE {" AND ".join(conditions)}
+                ORDER BY created_at DESC, id DESC
+                LIMIT :limit
+            """
+            df = self._cached_query("candidate_page", sql, params)
             
             profiles = []
             # 遍历 DataFrame 的每一行
             for _, record in df.iterrows():
                 profiles.append(self._record_to_profile(record.to_dict()))
-            return profiles
+            
+            next_cursor = None
+            if len(df) == limit:
+                last = df.iloc[-1]
+                next_cursor = {"created_at": last["created_at"], "id": int(last["id"])}
+            return profiles, next_cursor
         except Exception as e:
-            st.error(f"获取嘉宾失败: {e}")
-            return []
+            _notify_error(f"获取嘉宾失败: {e}")
+            return [], None
 
-    def get_match_history(self, username: str, current_user_name: str = None) -> list[dict]:
+    def get_match_history(self, username: str, limit: int = 100, current_user_name: str = None) -> list[dict]:
         """
-        [Deprecated] 旧接口，为了兼容性保留，内部调用 get_top_matches
+        排行榜页的完整列表 (按分数降序)，只含摘要字段；展开某条记录时再调用 get_chat_log
         """
-        return self.get_top_matches(username, limit=100, current_user_name=current_user_name)
+        return self.get_top_matches(username, limit=limit, current_user_name=current_user_name)
+
+    # 列表查询只取摘要字段，chat_log 按需由 get_chat_log 单独加载
+    # 对方名字在写入时已冗余存储；按发起方/接受方拆成两段 UNION ALL，各自走 (user_x, 排序列) 索引，
+    # 每段最多取 limit 条再合并排序
+    # 名字未能回填的旧记录 (对方已注销等) 显示为 'AI Guest'，与旧版一致
+    # 评估失败 (eval_status = 'failed') 与漏斗淘汰 ('screened'，只有快评) 的记录没有可比的分数：
+    # match_score 返回 NULL，排行榜中直接排除
+    _MATCH_SUMMARY_SQL = """
+        SELECT * FROM (
+            (SELECT id, created_at, user_a, user_b, eval_status, report,
+                    CASE WHEN eval_status = 'ok' THEN match_score END AS match_score,
+                    COALESCE(CASE WHEN user_b_virtual THEN user_b_name || ' (AI)' ELSE user_b_name END, 'AI Guest') AS partner_name
+             FROM match_records
+             WHERE user_a = :u {where}
+             ORDER BY {order}
+             LIMIT :limit)
+            UNION ALL
+            (SELECT id, created_at, user_a, user_b, eval_status, report,
+                    CASE WHEN eval_status = 'ok' THEN match_score END AS match_score,
+                    COALESCE(user_a_name, 'AI Guest') AS partner_name
+             FROM match_records
+             WHERE user_b = :u AND user_a <> :u {where}
+             ORDER BY {order}
+             LIMIT :limit)
+        ) AS r
+        ORDER BY {order}
+        LIMIT :limit
+    """
 
     def get_top_matches(self, username: str, limit: int = 3, current_user_name: str = None) -> list[dict]:
         """
-        获取排行榜 (按分数降序)
+        获取排行榜 (按分数降序)，不含 chat_log；评估失败、漏斗淘汰的记录不参与排名
+        current_user_name 已不再需要 (对方名字写入时已存储)，保留参数以兼容旧调用
         """
         if not self.is_connected: return []
         
         try:
-            # 关联查询对方的名字 (使用 LEFT JOIN 以包含虚拟用户)
-            # 如果是虚拟用户 (u.name 为 NULL)，暂时用 ID 代替，后续 UI 层可以优化显示
-            sql = """
-                SELECT r.*, COALESCE(u.name, 'AI Guest') as partner_name 
-                FROM match_records r
-                LEFT JOIN users u ON (u.username = r.user_b AND r.user_a = :u) OR (u.username = r.user_a AND r.user_b = :u)
-                WHERE r.user_a = :u OR r.user_b = :u
-                ORDER BY r.match_score DESC
-                LIMIT :limit
-            """
-            df = self.conn.query(sql, params={"u": username, "limit": limit}, ttl=0)
-            records = df.to_dict(orient="records")
-            
-            # 后处理：如果是 AI Guest，尝试从 chat_log 中解析名字
-            self._enrich_virtual_user_names(records, current_user_name)
-            
-            return records
+            sql = self._MATCH_SUMMARY_SQL.format(order="match_score DESC", where="AND eval_status = 'ok'")
+            df = self._cached_query("top_matches", sql, {"u": username, "limit": limit})
+            return df.to_dict(orient="records")
         except Exception as e:
-            st.error(f"获取排行榜失败: {e}")
+            _notify_error(f"获取排行榜失败: {e}")
             return []
 
     def get_recent_matches(self, username: str, limit: int = 5, current_user_name: str = None) -> list[dict]:
         """
-        获取最近对话记录 (按时间倒序)
+        获取最近对话记录 (按时间倒序)，不含 chat_log；评估失败的记录 match_score 为空 (待重新评估)
         """
         if not self.is_connected: return []
         
         try:
-            sql = """
-                SELECT r.*, COALESCE(u.name, 'AI Guest') as partner_name 
-                FROM match_records r
-                LEFT JOIN users u ON (u.username = r.user_b AND r.user_a = :u) OR (u.username = r.user_a AND r.user_b = :u)
-                WHERE r.user_a = :u OR r.user_b = :u
-                ORDER BY r.created_at DESC
-                LIMIT :limit
-            """
-            df = self.conn.query(sql, params={"u": username, "limit": limit}, ttl=0)
-            records = df.to_dict(orient="records")
-            
-            self._enrich_virtual_user_names(records, current_user_name)
-            
-            return records
+            sql = self._MATCH_SUMMARY_SQL.format(order="created_at DESC", where="")
+            df = self._cached_query("recent_matches", sql, {"u": username, "limit": limit})
+            return df.to_dict(orient="records")
         except Exception as e:
-            st.error(f"获取最近记录失败: {e}")
+            _notify_error(f"获取最近记录失败: {e}")
             return []
 
-    def _enrich_virtual_user_names(self, records: list[dict], current_user_name: str = None):
-        """
-        辅助函数：尝试从 chat_log 中解析虚拟用户的名字
-        """
-        for r in records:
-            if r['partner_name'] == 'AI Guest':
-                try:
-                    chat_log = r.get('chat_log')
-                    if isinstance(chat_log, str):
-                        chat_log = json.loads(chat_log)
-                    
-                    names = set()
-                    for msg in chat_log:
-                        if msg.get('name') and msg.get('name') != 'System':
-                            names.add(msg.get('name'))
-                    
-                    # 排除当前用户的名字
-                    if current_user_name and current_user_name in names:
-                        names.remove(current_user_name)
-                    
-                    if names:
-                        # 简单策略：取列表里出现的第一个名字，加上 (AI)
-                        r['partner_name'] = list(names)[0] + " (AI)"
-                except:
-                    pass
+    def get_chat_log(self, record_id: int) -> list:
+        """
+        获取单条匹配记录的完整对话 (用户展开记录时按需加载)
+        同一会话内反复展开不再访问数据库：最近的 CHAT_LOG_CACHE_SIZE 条保存在 st.session_state 中 (LRU)
+        不在 Streamlit 会话中 (Worker / 广场扫描) 时不缓存，直接查询
+        """
+        record_id = int(record_id)
+        cache = st.session_state.setdefault("chat_log_cache", OrderedDict()) if get_script_run_ctx() is not None else None
+        if cache is not None and record_id in cache:
+            cache.move_to_end(record_id)
+            return cache[record_id]
+        if not self.is_connected: return []
+
+        try:
+            df = self.conn.query("SELECT chat_log FROM match_records WHERE id = :id", params={"id": record_id}, ttl=0)
+            if df.empty:
+                return []
+            chat_log = df.iloc[0]["chat_log"]
+            if isinstance(chat_log, str):
+                chat_log = json.loads(chat_log)
+            chat_log = chat_log or []
+        except Exception as e:
+            print(f"Fetch chat log error: {e}")
+            return []
+
+        # 匹配记录写入后不再修改，可以一直缓存到被挤出
+        if cache is not None:
+            cache[record_id] = chat_log
+            while len(cache) > CHAT_LOG_CACHE_SIZE:
+                cache.popitem(last=False)
+        return chat_log
 
     def get_chatted_users(self, username: str) -> dict:
         """
-        获取已聊过的用户ID及其最高分数
-        返回: { 'target_username': max_score }
+        获取已聊过的用户ID及其最高分数 (在数据库中聚合，每个对象一行)
+        评估失败的配对不算“已聊过”，等待重新评估；漏斗淘汰的配对算已聊过，但快评分数不参与统计
+        返回: { 'target_username': max_score }，只被漏斗淘汰过的对象 max_score 为 None
         """
         if not self.is_connected: return {}
         try:
             sql = """
-                SELECT user_a, user_b, match_score FROM match_records 
-                WHERE user_a = :u OR user_b = :u
+                SELECT CASE WHEN user_a = :u THEN user_b ELSE user_a END AS partner,
+                       MAX(CASE WHEN eval_status = 'ok' THEN COALESCE(match_score, 0) END) AS max_score
+                FROM match_records
+                WHERE (user_a = :u OR user_b = :u) AND eval_status <> 'failed'
+                GROUP BY 1
             """
-            df = self.conn.query(sql, params={"u": username}, ttl=0)
-            
-            result = {}
-            for _, row in df.iterrows():
-                partner = row['user_b'] if row['user_a'] == username else row['user_a']
-                score = row['match_score']
-                if partner not in result or score > result[partner]:
-                    result[partner] = score
-            return result
+            df = self._cached_query("chatted_users", sql, {"u": username})
+            return {p: None if np.isnan(s) else int(s) for p, s in zip(df["partner"], df["max_score"].astype(float))}
         except Exception as e:
             return {}
 
+    def get_failed_evaluations(self, username: str, limit: int = 50) -> list[dict]:
+        """
+        获取某用户发起、对话已完成但评估失败的记录 (含 chat_log)，用于重新评估
+        """
+        if not self.is_connected: return []
+        try:
+            sql = """
+                SELECT id, user_a, user_b, chat_log FROM match_records
+                WHERE user_a = :u AND eval_status = 'failed'
+                ORDER BY id
+                LIMIT :limit
+            """
+            df = self.conn.query(sql, params={"u": username, "limit": limit}, ttl=0)
+            records = df.to_dict(orient="records")
+            for r in records:
+                if isinstance(r["chat_log"], str):
+                    r["chat_log"] = json.loads(r["chat_log"])
+            return records
+        except Exception as e:
+            print(f"Fetch failed evaluations error: {e}")
+            return []
+
+    def update_match_evaluation(self, record_id: int, score: int, report: str, eval_status: str = "ok") -> bool:
+        """
+        写回重新评估的结果
+        """
+        if not self.is_connected: return False
+        try:
+            sql = text("""
+                UPDATE match_records SET match_score = :score, report = :report, eval_status = :eval_status
+                WHERE id = :id
+            """)
+            with self.conn.session as s:
+                s.execute(sql, {"id": int(record_id), "score": score, "report": report, "eval_status": eval_status})
+                s.commit()
+            self.invalidate_cache(*MATCH_QUERIES)
+            return True
+        except Exception as e:
+            print(f"Update evaluation error: {e}")
+            return False
+
     def _record_to_profile(self, record: dict) -> AgentProfile:
         """
         将数据库记录转换为 AgentProfile 对象
@@ -306,7 +685,7 @@ class CloudStorage:
         preferences = HardPreferences(
             max_age_gap=pref_data.get("max_age_gap", 5),
             min_height=pref_data.get("min_height", 160),
-            allowed_locations=pref_data.get("allowed_locations", ["杭州"]),
+            allowed_locations=pref_data.get("allowed_locations") or [], # 未填写视为不限城市 (候选人查询按此过滤)
             preferred_gender=pref_data.get("preferred_gender", "female")
         )
 
@@ -0,0 +1,124 @@
+import re
+from typing import Dict, List, Optional
+
+# 告别用语：双方最近一条发言都命中才算“聊完了”
+FAREWELL_KEYWORDS = (
+    "拜拜", "再见", "晚安", "下次聊", "回头聊", "改天聊", "先不聊", "先去忙", "我先忙",
+    "不打扰", "bye", "886",
+)
+FAREWELL_PATTERN = re.compile(r"(下次|回头|改天|明天|周[一二三四五六日末]|到时候?)见")
+
+# 敷衍用语：去掉标点后只剩这些字，视为没有信息量
+FILLER_CHARS = set("嗯哈呵嘿哦噢喔啊呀嗷好的是对呢吧啦哟")
+FILLER_WORDS = ("ok", "okay", "hh", "hhh", "lol", "emmm", "emm")
+
+_PUNCT_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# 双方道别是对话的正常结束 (聊完了)，其余终止原因都表示冷场/止损
+FAREWELL_REASON = "双方已道别"
+
+
+def _strip(text: str) -> str:
+    return _PUNCT_PATTERN.sub("", text or "").lower()
+
+
+def _ngrams(text: str, n: int = 3) -> set:
+    text = _strip(text)
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def ngram_overlap(a: str, b: str, n: int = 3) -> float:
+    """
+    字符 n-gram 的 Jaccard 相似度 (0-1)，用于判断两句话是否几乎一样
+    """
+    ga, gb = _ngrams(a, n), _ngrams(b, n)
+    if not ga or not gb:
+        return 0.0
+    return len(ga & gb) / len(ga | gb)
+
+
+def is_farewell(text: str) -> bool:
+    lowered = (text or "").lower()
+    return any(k in lowered for k in FAREWELL_KEYWORDS) or bool(FAREWELL_PATTERN.search(lowered))
+
+
+def is_filler(text: str, max_len: int = 6) -> bool:
+    """
+    “嗯嗯”“哈哈哈”“好的呢”这类敷衍回复
+    """
+    stripped = _strip(text)
+    if not stripped:
+        return True
+    if stripped in FILLER_WORDS:
+        return True
+    return len(stripped) <= max_len and all(ch in FILLER_CHARS for ch in stripped)
+
+
+class TerminationDetector:
+    """
+    本地 (不调用 LLM) 的对话终止检测，每轮结束后对 ChatSession.history 调用 check()
+
+    - 双方都已道别
+    - 最近的发言与之前的发言高度重复 (字符 n-gram 重叠)
+    - 一方连续只回“嗯嗯/哈哈”，或回复长度远短于对方
+    """
+    def __init__(
+        self,
+        min_turns: int = 2,
+        repeat_threshold: float = 0.6,
+        repeat_window: int = 4,
+        collapse_window: int = 2,
+        length_ratio: float = 0.2,
+        short_reply_len: int = 8
+    ):
+        self.min_turns = min_turns
+        self.repeat_threshold = repeat_threshold
+        self.repeat_window = repeat_window
+        self.collapse_window = collapse_window
+        self.length_ratio = length_ratio
+        self.short_reply_len = short_reply_len
+
+    def check(self, history: List[Dict[str, str]]) -> Optional[str]:
+        """
+        返回终止原因；对话应继续时返回 None
+        """
+        by_speaker: Dict[str, List[str]] = {}
+        for msg in history:
+            by_speaker.setdefault(msg["name"], []).append(msg.get("content") or "")
+        if len(by_speaker) < 2:
+            return None
+
+        # 1. 双方都已道别 (不受最少轮数限制)
+        if all(is_farewell(msgs[-1]) for msgs in by_speaker.values()):
+            return FAREWELL_REASON
+
+        turns = min(len(msgs) for msgs in by_speaker.values())
+        if turns < self.min_turns:
+            return None
+
+        # 2. 复读：最近 repeat_window 条发言，每条都与更早的某条发言高度重叠
+        recent = history[-self.repeat_window:]
+        earlier = history[:-self.repeat_window][-self.repeat_window * 2:]
+        if len(recent) == self.repeat_window and earlier:
+            if all(
+                max(ngram_overlap(m["content"], e["content"]) for e in earlier) >= self.repeat_threshold
+                for m in recent
+            ):
+                return "对话陷入重复"
+
+        # 3. 一方敷衍：连续只回语气词，或回复长度远短于对方
+        for name, msgs in by_speaker.items():
+            tail = msgs[-self.collapse_window:]
+            if len(tail) < self.collapse_window:
+                continue
+            if all(is_filler(t) for t in tail):
+                return f"{name} 只在回复语气词"
+            others = [t for other, o_msgs in by_speaker.items() if other != name for t in o_msgs[-self.collapse_window:]]
+            mine = sum(len(_strip(t)) for t in tail) / len(tail)
+            theirs = sum(len(_strip(t)) for t in others) / max(1, len(others))
+            if mine <= self.short_reply_len and mine < theirs * self.length_ratio:
+                return f"{name} 的回复越来越敷衍"
+
+        return None
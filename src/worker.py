@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from typing import Optional
+from src.agent_builder import AgentProfile
+from src.engine import ChatSession
+from src.evaluator import MatchEvaluator, EvaluationBatcher, EvaluationError
+from src.rate_limiter import Priority
+from src.storage import CloudStorage
+from src.write_behind import MatchRecordWriter
+
+
+class MatchWorker:
+    """
+    后台匹配 Worker：脱离 Streamlit 运行，持续从 match_jobs 队列领取任务
+
+    每个任务执行 ChatSession + MatchEvaluator，结果经 MatchRecordWriter 批量写回，入库后才标记任务完成。
+    多个 Worker 进程可以同时运行 (领取时使用 SKIP LOCKED)，吞吐随 Worker 数线性扩展。
+    CloudStorage 在 Streamlit 之外运行：连接失败等错误打印到日志，启动时需检查 storage.is_connected。
+    """
+    PROFILE_TTL = 300 # 用户档案缓存秒数，用户修改资料后最迟该时间内生效
+    def __init__(
+        self,
+        storage: CloudStorage,
+        api_key: str,
+        worker_id: Optional[str] = None,
+        concurrency: int = 4,
+        max_turns: int = 5,
+        poll_interval: float = 3.0,
+        max_attempts: int = 3
+    ):
+        self.storage = storage
+        self.api_key = api_key
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = max(1, concurrency)
+        self.max_turns = max_turns
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.evaluator = MatchEvaluator(api_key, priority=Priority.BATCH)
+        self.batcher = EvaluationBatcher(self.evaluator, max_pack_size=min(MatchEvaluator.MAX_PACK_SIZE, self.concurrency))
+        self.writer = MatchRecordWriter(storage)
+        self._profiles = {}
+
+    def _load_profile(self, username: str) -> Optional[AgentProfile]:
+        # 同一用户的档案短时间内复用 (同一批任务通常来自同一发起方)，过期后重新查询以反映资料修改
+        cached = self._profiles.get(username)
+        if cached is None or time.monotonic() - cached[0] >= self.PROFILE_TTL:
+            cached = (time.monotonic(), self.storage.get_user_by_username(username))
+            self._profiles[username] = cached
+        return cached[1]
+
+    def _resolve_target(self, job: dict) -> Optional[AgentProfile]:
+        snapshot = job.get("target_profile")
+        if snapshot:
+            if isinstance(snapshot, str):
+                snapshot = json.loads(snapshot)
+            return AgentProfile.from_dict(snapshot)
+        return self._load_profile(job["user_b"])
+
+    async def process_job(self, job: dict):
+        """
+        执行单个任务：对话 -> 评估 -> 写回结果
+        """
+        try:
+            user = await asyncio.to_thread(self._load_profile, job["user_a"])
+            target = await asyncio.to_thread(self._resolve_target, job)
+            if user is None or target is None:
+                raise ValueError(f"profile not found: {job['user_a']} / {job['user_b']}")
+
+            session = ChatSession(user, target, model_config_name=self.api_key, priority=Priority.BATCH)
+            history = await session.run_async(self.max_turns)
+            eval_status = "ok"
+            try:
+                report = await self.batcher.submit(history, user, target)
+            except EvaluationError as e:
+                # 对话已完成，保存记录并标记待重新评估，而不是让整个任务重跑
+                report = e.report
+                eval_status = "failed"
+
+            score = report.get("total_score", 0)
+            summary = report.get("final_verdict", "")
+            # 记录写入 (或安全落盘) 后再标记完成；Worker 中途退出时任务会因超时被重新领取
+            # 记录被数据库拒绝 (数据问题) 时直接标记失败，重跑对话也不会成功
+            self.writer.add(user.user_id, target.user_id, history, score, summary, eval_status, user.name, target.name,
+                            on_saved=lambda job_id=job["id"]: self.storage.complete_match_job(job_id),
+                            on_failed=lambda error, job_id=job["id"]: self.storage.fail_match_job(job_id, error, max_attempts=0))
+            print(f"[Worker {self.worker_id}] job {job['id']} done: {user.name} x {target.name} = {score}")
+        except Exception as e:
+            print(f"[Worker {self.worker_id}] job {job['id']} failed: {e}")
+            await asyncio.to_thread(self.storage.fail_match_job, job["id"], str(e), self.max_attempts)
+
+    async def run_async(self, once: bool = False):
+        """
+        主循环：保持最多 concurrency 个任务并发执行；队列为空时按 poll_interval 轮询
+        once=True 时处理完当前队列即退出 (便于定时任务调用)
+        """
+        try:
+            await self._loop(once)
+        finally:
+            await asyncio.to_thread(self.writer.close)
+        print(f"[Worker {self.worker_id}] queue drained, exiting")
+
+    async def _loop(self, once: bool):
+        running = set()
+        print(f"[Worker {self.worker_id}] started (concurrency={self.concurrency})")
+        while True:
+            while len(running) < self.concurrency:
+                job = await asyncio.to_thread(self.storage.claim_match_job, self.worker_id, max_attempts=self.max_attempts)
+                if not job:
+                    break
+                running.add(asyncio.ensure_future(self.process_job(job)))
+
+            if not running:
+                if once:
+                    break
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            done, running = await asyncio.wait(running, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
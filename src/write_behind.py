@@ -0,0 +1,231 @@
+import glob
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+# 数据库不可达时，未写入的批次落盘到这里，恢复后自动补写
+DEFAULT_SPOOL_DIR = os.path.join("spool", "match_records")
+# 补写进程崩溃后遗留的认领文件，超过该时间 (秒) 视为无人处理，重新放回队列
+STALE_CLAIM_SECONDS = 600
+
+
+def match_record_row(user_a: str, user_b: str, chat_log: list, score: int, report: str, eval_status: str = "ok",
+                     user_a_name: str = None, user_b_name: str = None) -> dict:
+    """
+    一条匹配记录的写入参数 (纯 JSON 数据，可以直接落盘)；CloudStorage.save_match_record 也使用同一格式
+    """
+    return {
+        "user_a": user_a,
+        "user_b": user_b,
+        "chat_log": json.dumps(chat_log, ensure_ascii=False),
+        "score": score,
+        "report": report,
+        "eval_status": eval_status,
+        "user_a_name": user_a_name,
+        "user_b_name": user_b_name,
+        # 虚拟嘉宾不在 users 表里 (与 CloudStorage.enqueue_match_jobs 同一约定)
+        "user_b_virtual": user_b.startswith("guest_")
+    }
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    连接断开、超时、连接池耗尽等可以重试的错误；SQL / 数据错误重试也不会成功
+    """
+    if isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class MatchRecordWriter:
+    """
+    匹配记录的异步写入缓冲 (write-behind)
+
+    - add() 只把记录放进内存缓冲，立即返回，不阻塞对话 / UI 线程
+    - 后台线程攒满 batch_size 条或每隔 flush_interval 秒，用一条多行 INSERT 在一个事务中写入
+    - 临时性错误按指数退避重试 max_retries 次，仍失败则整批落盘到 spool_dir，数据库恢复后自动补写
+    - 非临时性错误 (数据本身有问题) 落盘为 .rejected 文件，不再自动重试，需人工处理
+    - on_saved 回调在记录写入数据库或安全落盘后调用，on_failed(error) 在记录被拒绝时调用
+      (均在后台线程中执行)，用于推进检查点 / 任务状态
+    - written / spooled / rejected 统计本实例处理的记录数，close() 返回最终统计
+    """
+    def __init__(
+        self,
+        storage,
+        batch_size: int = 50,
+        flush_interval: float = 2.0,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+        spool_dir: Optional[str] = None
+    ):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spool_dir = spool_dir or os.getenv("MATCH_SPOOL_DIR", DEFAULT_SPOOL_DIR)
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._buffer: List[Tuple[dict, Optional[Callable[[], None]], Optional[Callable[[str], None]]]] = []
+        self.written = 0
+        self.spooled = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # 同一时间只有一个线程在写库 (后台线程 / flush 调用方)
+        self._wake = threading.Event()
+        self._closed = False
+        self._has_spool = bool(self._spool_files())
+        self._thread = threading.Thread(target=self._run, name="match-record-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, user_a: str, user_b: str, chat_log: list, score: int, report: str, eval_status: str = "ok",
+            user_a_name: str = None, user_b_name: str = None, on_saved: Optional[Callable[[], None]] = None,
+            on_failed: Optional[Callable[[str], None]] = None):
+        """
+        参数与 CloudStorage.save_match_record 相同
+        """
+        if self._closed:
+            raise RuntimeError("MatchRecordWriter is closed")
+        row = match_record_row(user_a, user_b, chat_log, score, report, eval_status, user_a_name, user_b_name)
+        with self._lock:
+            self._buffer.append((row, on_saved, on_failed))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        同步写出当前缓冲中的全部记录
+        """
+        while True:
+            with self._lock:
+                batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def close(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """
+        停止后台线程并写出剩余记录，返回 {"written": n, "spooled": n, "rejected": n}
+        """
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._thread.join(timeout)
+            self.flush()
+        return {"written": self.written, "spooled": self.spooled, "rejected": self.rejected}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._has_spool:
+                    self.replay_spool()
+            except Exception as e:
+                # 后台线程不能退出，否则后续记录都不会再写入
+                print(f"[WriteBehind] flush loop error: {e}")
+
+    def _insert_with_retry(self, rows: List[dict]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.storage.save_match_records(rows)
+                return
+            except Exception as e:
+                if not is_transient(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                print(f"[WriteBehind] transient error ({e.__class__.__name__}), retry in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _write_batch(self, batch: List[Tuple[dict, Optional[Callable[[], None]], Optional[Callable[[str], None]]]]):
+        rows = [row for row, _, _ in batch]
+        error = None
+        with self._write_lock:
+            try:
+                self._insert_with_retry(rows)
+                self.written += len(rows)
+            except Exception as e:
+                rejected = not is_transient(e)
+                path = self._spool(rows, rejected=rejected)
+                print(f"[WriteBehind] {len(rows)} records {'rejected' if rejected else 'spooled'} -> {path}: {e}")
+                if rejected:
+                    self.rejected += len(rows)
+                    error = f"match record rejected ({path}): {e}"
+                else:
+                    self.spooled += len(rows)
+                    self._has_spool = True
+        for _, on_saved, on_failed in batch:
+            callback, args = (on_saved, ()) if error is None else (on_failed, (error,))
+            if callback is None:
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"[WriteBehind] callback error: {e}")
+
+    # ------------------------------------------------------------------
+    # 磁盘 spool
+    # ------------------------------------------------------------------
+    def _spool(self, rows: List[dict], rejected: bool = False) -> str:
+        name = f"batch_{time.time_ns()}_{os.getpid()}_{threading.get_ident()}.json"
+        path = os.path.join(self.spool_dir, name + (".rejected" if rejected else ""))
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path) # 原子替换：补写方不会读到半个文件
+        return path
+
+    def _spool_files(self) -> List[str]:
+        # 认领超时的文件 (补写进程中途崩溃) 放回队列
+        for claimed in glob.glob(os.path.join(self.spool_dir, "*.json.*.claimed")):
+            try:
+                if time.time() - os.path.getmtime(claimed) > STALE_CLAIM_SECONDS:
+                    os.replace(claimed, claimed.rsplit(".", 2)[0])
+            except OSError:
+                continue
+        return sorted(glob.glob(os.path.join(self.spool_dir, "*.json")))
+
+    def replay_spool(self) -> int:
+        """
+        补写落盘的批次，返回补写的记录数；数据库仍不可用时保留文件，下次再试
+        多个进程共用同一目录时，先通过原子 rename 认领文件，避免重复写入
+        """
+        written = 0
+        with self._write_lock:
+            for path in self._spool_files():
+                claimed = f"{path}.{os.getpid()}.claimed"
+                try:
+                    os.replace(path, claimed)
+                except OSError:
+                    continue # 已被其他进程认领
+                try:
+                    with open(claimed, "r", encoding="utf-8") as f:
+                        rows = json.load(f)
+                    self._insert_with_retry(rows)
+                except Exception as e:
+                    if is_transient(e):
+                        os.replace(claimed, path)
+                        print(f"[WriteBehind] spool replay deferred: {e}")
+                        return written
+                    os.replace(claimed, f"{path}.rejected")
+                    print(f"[WriteBehind] spool batch rejected {path}: {e}")
+                    continue
+                os.remove(claimed)
+                written += len(rows)
+            self._has_spool = False
+        if written:
+            print(f"[WriteBehind] replayed {written} spooled records")
+        return written
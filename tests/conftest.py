@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与根目录下的脚本一致，以项目根目录为导入起点 (import src.xxx)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+import numpy as np
+
+from src.agent_builder import AgentProfile, HardAttributes, HardPreferences, Persona
+from src.embedding_index import EmbeddingIndex, HashingVectorizer, recall_candidates
+
+
+def make_profile(user_id: str, interests, values=(), calibration=()) -> AgentProfile:
+    return AgentProfile(
+        user_id=user_id,
+        name=user_id,
+        attributes=HardAttributes(age=28, height=170, weight=60, job="设计师", annual_salary="保密", location="杭州"),
+        preferences=HardPreferences(5, 160, ["杭州"]),
+        persona=Persona(mbti="INFP", interests=list(interests), values_keywords=list(values),
+                        turing_calibration_data=list(calibration)),
+    )
+
+
+def test_encode_is_deterministic_and_normalized():
+    vectorizer = HashingVectorizer()
+    profile = make_profile("a", ["科幻电影", "爬山"], ["真诚"], [{"question": "周末?", "answer": "去山里徒步"}])
+    first, second = vectorizer.encode(profile), HashingVectorizer().encode(profile)
+    assert np.array_equal(first, second)
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert not HashingVectorizer().encode(make_profile("empty", [])).any()
+
+
+def test_shared_interests_are_more_similar():
+    vectorizer = HashingVectorizer()
+    user = make_profile("me", ["科幻", "爬山"])
+    close = make_profile("close", ["科幻电影", "爬山徒步"])
+    far = make_profile("far", ["烘焙", "钢琴"])
+    assert vectorizer.encode(close) @ vectorizer.encode(user) > vectorizer.encode(far) @ vectorizer.encode(user)
+
+    recalled = recall_candidates(user, [far, close], top_k=1)
+    assert [c.user_id for c, _ in recalled] == ["close"]
+    assert recall_candidates(user, []) == []
+
+
+def test_lsh_query_matches_brute_force_on_exact_neighbours():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((3000, 64)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"u{i}" for i in range(len(vectors))]
+
+    exact = EmbeddingIndex(dim=64, brute_force_below=10 ** 9)
+    approx = EmbeddingIndex(dim=64, brute_force_below=0)
+    exact.build(ids, vectors)
+    approx.build(ids, vectors)
+
+    query = vectors[123]
+    assert exact.query(query, top_k=1)[0][0] == "u123"
+    assert approx.query(query, top_k=1)[0][0] == "u123"
+    # exclude 过滤自身后仍返回 top_k 个，按相似度降序
+    result = approx.query(query, top_k=5, exclude={"u123"})
+    assert len(result) == 5 and "u123" not in {i for i, _ in result}
+    assert [s for _, s in result] == sorted((s for _, s in result), reverse=True)
+
+
+def test_empty_index():
+    index = EmbeddingIndex()
+    index.build([], np.zeros((0, index.dim)))
+    assert len(index) == 0
+    assert index.query(np.ones(index.dim, dtype=np.float32)) == []
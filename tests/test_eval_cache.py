@@ -0,0 +1,52 @@
+from src.agent_builder import AgentProfile, HardAttributes, HardPreferences, Persona
+from src.eval_cache import EvaluationCache, evaluation_key
+
+
+def make_profile(name: str, job: str = "老师", calibration=()) -> AgentProfile:
+    return AgentProfile(
+        user_id=name,
+        name=name,
+        attributes=HardAttributes(age=27, height=165, weight=50, job=job, annual_salary="保密", location="杭州"),
+        preferences=HardPreferences(5, 160, ["杭州"]),
+        persona=Persona(mbti="ISFJ", interests=["读书"], turing_calibration_data=list(calibration)),
+    )
+
+
+HISTORY = [{"name": "甲", "content": "你好呀"}, {"name": "乙", "content": "你好，很高兴认识你"}]
+
+
+def test_key_ignores_whitespace_but_not_content():
+    a, b = make_profile("甲"), make_profile("乙")
+    key = evaluation_key(HISTORY, a, b, "v1")
+    spaced = [{"name": "甲", "content": "  你好呀\n"}, {"name": "乙", "content": "你好，很高兴认识你 "}]
+    assert evaluation_key(spaced, a, b, "v1") == key
+
+    assert evaluation_key(HISTORY[:1], a, b, "v1") != key
+    assert evaluation_key(HISTORY, a, b, "v2") != key
+    assert evaluation_key(HISTORY, a, make_profile("乙", job="医生"), "v1") != key
+    calibrated = make_profile("甲", calibration=[{"question": "周末?", "answer": "看书"}])
+    assert evaluation_key(HISTORY, calibrated, b, "v1") != key
+
+
+def test_memory_lru_returns_copies():
+    cache = EvaluationCache(capacity=2)
+    cache.put("k1", {"total_score": 70})
+    cache.put("k2", {"total_score": 80})
+    cache.get("k1")["total_score"] = 0 # 调用方修改返回值不影响缓存
+    assert cache.get("k1") == {"total_score": 70}
+    cache.put("k3", {"total_score": 90}) # 挤出最久未用的 k2
+    assert cache.get("k2") is None
+    assert cache.get("k3") == {"total_score": 90}
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_disk_entries_survive_a_new_instance(tmp_path):
+    EvaluationCache(disk_dir=str(tmp_path)).put("ab" + "0" * 62, {"total_score": 66})
+    fresh = EvaluationCache(disk_dir=str(tmp_path))
+    assert fresh.get("ab" + "0" * 62) == {"total_score": 66}
+
+    # 损坏的文件视为未命中
+    broken = tmp_path / "cd" / ("cd" + "0" * 62 + ".json")
+    broken.parent.mkdir()
+    broken.write_text("{not json", encoding="utf-8")
+    assert fresh.get("cd" + "0" * 62) is None
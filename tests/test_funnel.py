@@ -0,0 +1,96 @@
+import asyncio
+
+from src.funnel import STAGE_DEEP, STAGE_EARLY_EXIT, STAGE_ICEBREAK, FunnelConfig, MatchFunnel, verdict_report
+from src.termination import FAREWELL_REASON
+
+
+class FakeSession:
+    """按轮推进的假对话：在 stop_at 轮以 reason 结束 (completed 表示正常聊完)"""
+    def __init__(self, stop_at=None, reason=None, completed=False):
+        self.history = []
+        self.turns_done = 0
+        self.stop_at, self.reason, self.finish = stop_at, reason, completed
+        self.stop_reason = None
+        self.completed = False
+
+    async def run_async(self, max_turns, on_turn=None, should_stop=None):
+        while self.turns_done < max_turns:
+            self.turns_done += 1
+            self.history.append({"name": "A", "content": f"第 {self.turns_done} 轮"})
+            if on_turn:
+                on_turn(self.turns_done)
+            if self.turns_done == self.stop_at:
+                self.stop_reason, self.completed = self.reason, self.finish
+                return self.history
+            if should_stop:
+                reason = await should_stop(self.turns_done, self.history)
+                if reason:
+                    self.stop_reason = reason
+                    return self.history
+        return self.history
+
+
+class FakeEvaluator:
+    def __init__(self, scores):
+        self.scores = list(scores)
+        self.calls = 0
+
+    async def quick_judge_async(self, history, a, b):
+        self.calls += 1
+        score = self.scores.pop(0) if self.scores else 80
+        if score is None:
+            return None
+        return {"score": score, "continue": True, "reason": f"快评 {score}"}
+
+
+CONFIG = FunnelConfig(icebreak_turns=3, promote_threshold=60, deep_turns=10, judge_every=3, exit_threshold=40)
+
+
+def run(session, evaluator, config=CONFIG):
+    return asyncio.run(MatchFunnel(evaluator, config).run_async(session, None, None))
+
+
+def test_stalled_icebreak_skips_the_quick_judge():
+    evaluator = FakeEvaluator([80])
+    outcome = run(FakeSession(stop_at=2, reason="对话陷入重复"), evaluator)
+    assert (outcome.stage, outcome.verdict, outcome.reason) == (STAGE_ICEBREAK, None, "对话陷入重复")
+    assert evaluator.calls == 0
+
+
+def test_low_icebreak_score_is_not_promoted():
+    outcome = run(FakeSession(), FakeEvaluator([30]))
+    assert outcome.stage == STAGE_ICEBREAK and outcome.verdict["score"] == 30
+
+
+def test_promoted_chat_runs_to_deep_turns():
+    session, evaluator = FakeSession(), FakeEvaluator([80, 70, 75])
+    outcome = run(session, evaluator)
+    assert outcome.stage == STAGE_DEEP and session.turns_done == 10
+    assert evaluator.calls == 3 # 破冰后 1 次 + 第 6、9 轮各 1 次
+
+
+def test_failed_quick_judge_does_not_eliminate():
+    outcome = run(FakeSession(), FakeEvaluator([None, None, None]))
+    assert outcome.stage == STAGE_DEEP and outcome.verdict is None
+
+
+def test_deep_chat_exits_early_on_low_score():
+    session = FakeSession()
+    outcome = run(session, FakeEvaluator([80, 20]))
+    assert outcome.stage == STAGE_EARLY_EXIT and session.turns_done == 6
+    assert outcome.verdict["score"] == 20
+
+
+def test_farewell_counts_as_finished():
+    assert run(FakeSession(stop_at=2, reason=FAREWELL_REASON, completed=True), FakeEvaluator([30])).stage == STAGE_ICEBREAK
+    assert run(FakeSession(stop_at=2, reason=FAREWELL_REASON, completed=True), FakeEvaluator([80])).stage == STAGE_DEEP
+    outcome = run(FakeSession(stop_at=7, reason=FAREWELL_REASON, completed=True), FakeEvaluator([80]))
+    assert outcome.stage == STAGE_DEEP and outcome.reason == FAREWELL_REASON
+
+
+def test_verdict_report():
+    outcome = run(FakeSession(), FakeEvaluator([30]))
+    report = verdict_report(outcome)
+    assert report["total_score"] == 30 and report["stage"] == STAGE_ICEBREAK
+    assert report["final_verdict"].startswith("破冰阶段未晋级")
+    assert verdict_report(run(FakeSession(stop_at=1, reason="冷场"), FakeEvaluator([])))["total_score"] == 0
@@ -0,0 +1,52 @@
+from src.json_repair import IncrementalJSONParser, parse_partial_json
+
+
+def test_plain_and_wrapped_json():
+    assert parse_partial_json('{"total_score": 80, "tags": ["a", "b"]}') == {"total_score": 80, "tags": ["a", "b"]}
+    text = '好的，评估如下：\n```json\n{"total_score": 72, "final_verdict": "可以继续"}\n```\n以上。'
+    assert parse_partial_json(text) == {"total_score": 72, "final_verdict": "可以继续"}
+    assert parse_partial_json("没有 JSON") is None
+    assert parse_partial_json("") is None
+
+
+def test_common_model_mistakes():
+    text = "{'total_score': 65, 'ok': True, 'note': None, 'tags': ['x', 'y',],}"
+    assert parse_partial_json(text) == {"total_score": 65, "ok": True, "note": None, "tags": ["x", "y"]}
+    assert parse_partial_json('{total_score: 88, verdict: 合适}') == {"total_score": 88, "verdict": "合适"}
+    assert parse_partial_json('{"s": "a\\"b\\n\\u4f60"}') == {"s": 'a"b\n你'}
+
+
+def test_comments():
+    assert parse_partial_json('{\n  // 总分\n  "total_score": 70 /* 满分 100 */\n}') == {"total_score": 70}
+    assert parse_partial_json('{"x": 1 /* c */, "y": 2}') == {"x": 1, "y": 2}
+    assert parse_partial_json('{"x": 1 // c\n, "y": 2}') == {"x": 1, "y": 2}
+    assert parse_partial_json('{"x": 合适 /* 备注 */, "y": 2}') == {"x": "合适", "y": 2}
+    # 文本里的 // 不是注释
+    assert parse_partial_json('{"url": http://example.com/a, "n": 1}') == {"url": "http://example.com/a", "n": 1}
+
+
+def test_bare_text_with_commas():
+    text = '{"interaction_comment": 不错, 可以继续, "total_score": 80}'
+    assert parse_partial_json(text) == {"interaction_comment": "不错, 可以继续", "total_score": 80}
+    assert parse_partial_json('{"c": 不错, 可以继续}') == {"c": "不错, 可以继续"}
+    assert parse_partial_json('{"c": 好, total_score: 60}') == {"c": "好", "total_score": 60}
+    # 数组里的逗号始终是分隔符
+    assert parse_partial_json("[a, b, c]") == ["a", "b", "c"]
+
+
+def test_truncated_output_keeps_complete_fields():
+    assert parse_partial_json('{"a": 1, "b": {"c": [1, 2') == {"a": 1, "b": {"c": [1]}}
+    assert parse_partial_json('{"a": 1, "b": "未写完') == {"a": 1}
+    assert parse_partial_json('{"a": 1, "b"') == {"a": 1}
+    # 截断在数字中途：可能还没输出完，丢弃
+    assert parse_partial_json('{"a": 1, "total_score": 8') == {"a": 1}
+
+
+def test_incremental_parser_keeps_last_good_state():
+    parser = IncrementalJSONParser()
+    full = '{"interaction_score": 70, "values_score": 80, "total_score": 75}'
+    seen = [parser.feed(full[:i]) for i in range(1, len(full) + 1)]
+    assert seen[-1] == {"interaction_score": 70, "values_score": 80, "total_score": 75}
+    assert {"interaction_score": 70} in seen
+    # 重试从空串重新开始时保留已恢复的部分
+    assert parser.feed("") == seen[-1]
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+from src.llm_replay import (
+    MISS_ERROR, MISS_LIVE, MODE_OFF, MODE_RECORD, MODE_REPLAY,
+    ReplayLayer, ReplayStore, dialogue_key, dialogue_key_for_messages, request_key,
+)
+
+MESSAGES = [{"role": "user", "content": "你好"}]
+
+
+def agent_messages(speaker, partner, *context):
+    system = f"你是 **{speaker}**，正在相亲。\n# 对方资料\n- 名字: {partner}\n"
+    return [{"role": "system", "content": system}] + [{"role": "user", "content": c} for c in context]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ReplayStore(str(tmp_path / "replay.sqlite"))
+
+
+def test_request_key_covers_output_affecting_params():
+    key = request_key("m", MESSAGES, 0.7, {})
+    assert request_key("m", MESSAGES, 0.7, {"timeout": 5}) == key
+    assert request_key("m", MESSAGES, 0.7, {"max_tokens": 100}) != key
+    assert request_key("m", MESSAGES, 0.2, {}) != key
+    assert request_key("other", MESSAGES, 0.7, {}) != key
+
+
+def test_dialogue_key_from_agent_prompt():
+    messages = agent_messages("小美", "小明", "你好", "  你好呀\n最近忙吗 ")
+    assert dialogue_key_for_messages(messages) == dialogue_key("小美", "小明", ["你好", "你好呀 最近忙吗"])
+    # 同一句开场白，对不同的人是不同的键
+    assert dialogue_key_for_messages(agent_messages("小美", "小刚")) != dialogue_key_for_messages(agent_messages("小美", "小明"))
+    assert dialogue_key_for_messages(MESSAGES) is None
+
+
+def test_record_then_replay(store):
+    ReplayLayer(MODE_RECORD, store).record("m", MESSAGES, 0.7, {"max_tokens": 50}, "你好呀", 1.5)
+    layer = ReplayLayer(MODE_REPLAY, store, latency=0)
+    assert layer.replaying and not layer.recording
+    assert asyncio.run(layer.serve("m", MESSAGES, 0.7, {"max_tokens": 50})) == "你好呀"
+
+    chunks = []
+    assert asyncio.run(layer.serve("m", MESSAGES, 0.7, {"max_tokens": 50}, on_chunk=chunks.append)) == "你好呀"
+    assert chunks[-1] == "你好呀" and all("你好呀".startswith(c) for c in chunks)
+
+
+def test_replay_miss(store):
+    live = ReplayLayer(MODE_REPLAY, store, latency=0, miss=MISS_LIVE)
+    assert live.recording
+    assert asyncio.run(live.serve("m", MESSAGES, 0.7, {})) is None
+
+    pytest.importorskip("httpx")
+    pytest.importorskip("openai")
+    from src.resilience import LLMCallError
+    with pytest.raises(LLMCallError):
+        asyncio.run(ReplayLayer(MODE_REPLAY, store, latency=0, miss=MISS_ERROR).serve("m", MESSAGES, 0.7, {}))
+
+
+def test_synthetic_latency_is_reproducible(store):
+    layer = ReplayLayer(MODE_REPLAY, store, latency=1.0, jitter=0.5)
+    delays = {layer._delay("a" * 64, None), layer._delay("a" * 64, 9.0)}
+    assert len(delays) == 1 and 0.5 <= delays.pop() <= 1.5
+    assert ReplayLayer(MODE_REPLAY, store, latency=None)._delay("b" * 64, 2.5) == 2.5
+
+
+def test_seed_from_logs(store, tmp_path):
+    log = {
+        "participants": ["小美", "小明"],
+        "history": [{"name": "小美", "content": "你好"}, {"name": "小明", "content": "你好呀"}],
+    }
+    (tmp_path / "chat_as_1.json").write_text(json.dumps(log, ensure_ascii=False), encoding="utf-8")
+    layer = ReplayLayer(MODE_REPLAY, store, latency=0)
+    assert layer.seed_from_logs(str(tmp_path / "chat_as_*.json")) == 2
+    reply = asyncio.run(layer.serve("m", agent_messages("小明", "小美", "你好"), 0.7, {}))
+    assert reply == "你好呀"
+    assert store.stats() == {"dialogue": 2}
+
+
+def test_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("LLM_REPLAY_MODE", "off")
+    assert ReplayLayer.from_env().mode == MODE_OFF
+
+    monkeypatch.setenv("LLM_REPLAY_MODE", "Replay")
+    monkeypatch.setenv("LLM_REPLAY_DB", str(tmp_path / "env.sqlite"))
+    monkeypatch.setenv("LLM_REPLAY_LATENCY", "recorded")
+    monkeypatch.setenv("LLM_REPLAY_JITTER", "0.2")
+    layer = ReplayLayer.from_env()
+    assert layer.replaying and layer.latency is None and layer.jitter == 0.2
+
+    # 格式错误的数值回退为默认值，而不是让网关初始化失败
+    monkeypatch.setenv("LLM_REPLAY_LATENCY", "fast")
+    monkeypatch.setenv("LLM_REPLAY_JITTER", "-1")
+    layer = ReplayLayer.from_env()
+    assert layer.latency == 0.0 and layer.jitter == 0.0
@@ -0,0 +1,66 @@
+from src.agent_builder import AgentProfile, HardAttributes, HardPreferences, Persona
+from src.prejudge import PreJudge, calibration_alignment, prejudge_report
+
+
+def make_profile(name: str, age: int = 28, height: int = 170, calibration=()) -> AgentProfile:
+    return AgentProfile(
+        user_id=name,
+        name=name,
+        attributes=HardAttributes(age=age, height=height, weight=60, job="产品经理", annual_salary="保密", location="杭州"),
+        preferences=HardPreferences(5, 160, ["杭州"]),
+        persona=Persona(mbti="ENFP", interests=["旅行"], turing_calibration_data=list(calibration)),
+    )
+
+
+def dialogue(a: str, b: str, *pairs):
+    history = []
+    for x, y in pairs:
+        history.append({"name": a, "content": x})
+        history.append({"name": b, "content": y})
+    return history
+
+
+GOOD_CHAT = (
+    ("你好呀！看到你也喜欢旅行，最近去过哪里？", "去了云南！大理的风景特别好，你呢？"),
+    ("我上个月去了新疆，草原太美了！你喜欢自由行吗？", "喜欢，自己安排节奏更舒服，你一般怎么做攻略？"),
+    ("我会先看看当地的博物馆和小吃，你有推荐的吗？", "大理的乳扇和烤饵块一定要试试！"),
+)
+
+
+def test_failed_and_empty_chats_are_confident_low_scores():
+    a, b = make_profile("甲"), make_profile("乙")
+    errors = [{"name": "甲", "content": "[Model Error] timeout"}, {"name": "乙", "content": "Error code: 500"}]
+    assert PreJudge().judge(errors, a, b).score == 0
+
+    short = PreJudge().judge(dialogue("甲", "乙", ("你好", "你好")), a, b)
+    assert short.confident and short.score == 10
+
+    filler = PreJudge().judge(dialogue("甲", "乙", ("你平时喜欢做什么？", "嗯嗯"), ("我喜欢徒步，你呢？", "哈哈")), a, b)
+    assert filler.confident and filler.score == 15
+
+
+def test_hard_violations_are_confident():
+    judgement = PreJudge().judge(dialogue("甲", "乙", *GOOD_CHAT), make_profile("甲", age=28), make_profile("乙", age=40, height=150))
+    assert judgement.confident and judgement.score == 20
+    assert len(judgement.violations) == 2
+
+
+def test_good_chat_is_left_to_the_llm():
+    judgement = PreJudge().judge(dialogue("甲", "乙", *GOOD_CHAT), make_profile("甲"), make_profile("乙"))
+    assert not judgement.confident
+    assert judgement.score >= PreJudge().uncertain_low
+
+
+def test_calibration_alignment():
+    a = make_profile("甲", calibration=[{"question": "周末?", "answer": "去博物馆看展"}, {"question": "吵架?", "answer": "冷静沟通"}])
+    history = dialogue("甲", "乙", ("周末做什么？", "我喜欢去博物馆，最近看了一个展"))
+    assert calibration_alignment(history, a, "乙") == 0.5
+    assert calibration_alignment(history, make_profile("丙"), "乙") is None
+
+
+def test_prejudge_report_has_evaluator_fields():
+    judgement = PreJudge().judge(dialogue("甲", "乙", ("你好", "你好")), make_profile("甲"), make_profile("乙"))
+    report = prejudge_report(judgement)
+    for key in ("interaction_score", "values_score", "chemistry_score", "total_score", "final_verdict", "suggestion"):
+        assert key in report
+    assert report["total_score"] == judgement.score and report["source"] == "prejudge"
@@ -0,0 +1,54 @@
+import random
+
+from src.agent_builder import AgentProfile, HardAttributes, HardPreferences, Persona
+from src.prescreen import CandidateMatrix, batch_score, rank_candidates
+
+INTERESTS = ["爬山", "徒步", "看电影", "电影", "咖啡", "摄影", "编程", "读书", "猫", "旅行"]
+MBTIS = ["INFP", "ENTJ", "ISTJ", "ESFP", "INTP", "ENFJ", "", None]
+
+
+def make_profile(rng: random.Random, user_id: str) -> AgentProfile:
+    return AgentProfile(
+        user_id=user_id,
+        name=user_id,
+        attributes=HardAttributes(
+            age=rng.choice([22, 25, 28, 30, 33, 38, "保密", None]),
+            height=rng.choice([155, 160, 168, 175, 182, "未知", None]),
+            weight=60,
+            job="工程师",
+            annual_salary="保密",
+            location="杭州",
+        ),
+        preferences=HardPreferences(rng.choice([2, 3, 5, 8]), rng.choice([150, 160, 170, "不限"]), ["杭州"]),
+        persona=Persona(mbti=rng.choice(MBTIS) or "", interests=rng.sample(INTERESTS, rng.randint(0, 4))),
+    )
+
+
+def test_batch_score_matches_evaluate_match():
+    rng = random.Random(7)
+    candidates = [make_profile(rng, f"c{i}") for i in range(200)]
+    matrix = CandidateMatrix(candidates)
+    for u in range(30):
+        user = make_profile(rng, f"u{u}")
+        scores = batch_score(user, matrix)
+        assert [int(s) for s in scores] == [user._evaluate_match(c) for c in candidates]
+
+
+def test_rank_candidates_is_stable_and_uses_tiebreak():
+    rng = random.Random(1)
+    user = make_profile(rng, "me")
+    candidates = [make_profile(rng, f"c{i}") for i in range(50)]
+
+    ranked = rank_candidates(user, candidates, top_k=len(candidates))
+    expected = sorted(range(len(candidates)), key=lambda i: -user._evaluate_match(candidates[i]))
+    assert [c.user_id for c, _ in ranked] == [candidates[i].user_id for i in expected]
+
+    # 同分时按 tiebreak 降序，规则分数仍是第一排序键
+    tiebreak = [rng.random() for _ in candidates]
+    ranked = rank_candidates(user, candidates, top_k=len(candidates), tiebreak=tiebreak)
+    expected = sorted(range(len(candidates)), key=lambda i: (-user._evaluate_match(candidates[i]), -tiebreak[i]))
+    assert [c.user_id for c, _ in ranked] == [candidates[i].user_id for i in expected]
+
+
+def test_rank_candidates_empty_pool():
+    assert rank_candidates(make_profile(random.Random(0), "me"), []) == []
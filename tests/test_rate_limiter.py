@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from src.rate_limiter import Priority, RateLimiter, TokenBucket
+
+
+def test_token_bucket_refill_and_wait():
+    bucket = TokenBucket(capacity=10, rate=5)
+    bucket.tokens = 0
+    assert bucket.wait_time(5) == 1.0
+    bucket.refill(bucket.updated_at + 10) # 补充不超过容量
+    assert bucket.tokens == 10 and bucket.wait_time(5) == 0.0
+
+
+def test_higher_priority_is_served_first():
+    async def scenario():
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10 ** 6)
+        limiter.requests.tokens = 0 # 桶已空：所有请求都要排队，每 0.1s 放行一个
+        order = []
+
+        async def call(name, priority):
+            await limiter.acquire(10, priority)
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(call(f"batch{i}", Priority.BATCH)) for i in range(2)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.ensure_future(call("interactive", Priority.INTERACTIVE)))
+        tasks.append(asyncio.ensure_future(call("evaluation", Priority.EVALUATION)))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "evaluation", "batch0", "batch1"]
+
+
+def test_pause_and_settle():
+    async def scenario():
+        limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=6000)
+        limiter.pause(0.2)
+        started = time.monotonic()
+        await limiter.acquire(10)
+        waited = time.monotonic() - started
+        before = limiter.tokens.tokens
+        limiter.settle(10, 110) # 实际用量超出估计，透支令牌
+        limiter.settle(10, None)
+        return waited, before - limiter.tokens.tokens
+
+    waited, overdraft = asyncio.run(scenario())
+    assert waited >= 0.2
+    assert overdraft == 100
+
+
+def test_cancelled_waiter_does_not_block_the_queue():
+    async def scenario():
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10 ** 6)
+        limiter.requests.tokens = 0
+        blocked = asyncio.ensure_future(limiter.acquire(10, Priority.INTERACTIVE))
+        await asyncio.sleep(0.01)
+        blocked.cancel()
+        await asyncio.wait_for(limiter.acquire(10, Priority.BATCH), timeout=1.0)
+        return limiter._waiters
+
+    assert asyncio.run(scenario()) == []
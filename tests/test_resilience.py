@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("openai")
+
+from src.resilience import LatencyTracker, LLMCallError, RetryPolicy, backoff_delay, call_with_retry
+
+FAST = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001, timeout=0.2)
+
+
+def test_backoff_delay_is_capped():
+    policy = RetryPolicy(base_delay=0.5, max_delay=2.0)
+    assert all(0 <= backoff_delay(attempt, policy) <= 2.0 for attempt in range(10))
+
+
+def test_latency_tracker_quantile():
+    tracker = LatencyTracker(window=100)
+    assert tracker.quantile(0.95) is None
+    for i in range(1, 101):
+        tracker.record(float(i))
+    assert tracker.quantile(0.95) == 96.0
+
+
+def test_retries_transient_errors_then_succeeds():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise asyncio.TimeoutError()
+        return "ok"
+
+    assert asyncio.run(call_with_retry(flaky, FAST)) == "ok"
+    assert len(calls) == 3
+
+
+def test_timeout_counts_as_retryable_and_exhausts():
+    async def hang():
+        await asyncio.sleep(10)
+
+    with pytest.raises(LLMCallError, match="after 2 attempts"):
+        asyncio.run(call_with_retry(hang, RetryPolicy(max_attempts=2, base_delay=0.001, timeout=0.05)))
+
+
+def test_non_retryable_error_fails_immediately():
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise ValueError("invalid api key")
+
+    with pytest.raises(LLMCallError, match="invalid api key"):
+        asyncio.run(call_with_retry(bad_request, FAST))
+    assert len(calls) == 1
+
+
+def test_gate_is_awaited_before_every_attempt():
+    gated = []
+
+    async def gate():
+        gated.append(1)
+
+    async def flaky():
+        if len(gated) < 2:
+            raise asyncio.TimeoutError()
+        return "ok"
+
+    assert asyncio.run(call_with_retry(flaky, FAST, gate=gate)) == "ok"
+    assert len(gated) == 2
+
+
+def test_hedged_request_wins_over_slow_primary():
+    tracker = LatencyTracker()
+    for _ in range(20):
+        tracker.record(0.01)
+    calls = []
+
+    async def slow_then_fast():
+        calls.append(1)
+        await asyncio.sleep(1.0 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    policy = RetryPolicy(max_attempts=1, timeout=2.0, hedge=True, hedge_min_samples=20)
+    assert asyncio.run(call_with_retry(slow_then_fast, policy, tracker)) == 2
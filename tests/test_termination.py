@@ -0,0 +1,62 @@
+from src.termination import FAREWELL_REASON, TerminationDetector, is_farewell, is_filler, ngram_overlap
+
+
+def dialogue(*pairs):
+    history = []
+    for a, b in pairs:
+        history.append({"name": "A", "content": a})
+        history.append({"name": "B", "content": b})
+    return history
+
+
+def test_helpers():
+    assert is_filler("嗯嗯") and is_filler("哈哈哈！") and is_filler("OK") and is_filler("")
+    assert not is_filler("好的，周六一起去爬山吧")
+    assert is_farewell("那就周六见！") and is_farewell("好呀，拜拜～") and is_farewell("Bye")
+    assert not is_farewell("你平时周末都做什么？")
+    assert ngram_overlap("我也很喜欢爬山", "我也很喜欢爬山！") == 1.0
+    assert ngram_overlap("我也很喜欢爬山", "最近在学做饭") == 0.0
+
+
+def test_normal_conversation_continues():
+    history = dialogue(
+        ("你好呀，看到你也喜欢爬山", "是的！上周刚去了龙井，你常去哪里？"),
+        ("我一般去九溪，周末人少一点", "九溪很美，秋天的时候特别好看"),
+        ("你平时工作忙吗？", "还好，偶尔加班，周末基本能休息"),
+    )
+    assert TerminationDetector().check(history) is None
+
+
+def test_mutual_farewell_ends_even_before_min_turns():
+    history = dialogue(("今天聊得很开心，下次聊，拜拜", "好的，晚安～"))
+    assert TerminationDetector(min_turns=3).check(history) == FAREWELL_REASON
+    # 只有一方道别不算结束
+    assert TerminationDetector().check(dialogue(("你好", "你好呀"), ("我先去忙啦，拜拜", "你做什么工作的？"))) is None
+
+
+def test_repetition_is_detected():
+    history = dialogue(
+        ("我们以后可以一起成长，互相支持", "是的，一起成长，成为更好的自己"),
+        ("我们以后可以一起成长，互相支持！", "是的，一起成长，成为更好的自己～"),
+        ("我们以后可以一起成长，互相支持呀", "是的，一起成长，成为更好的自己呢"),
+    )
+    assert TerminationDetector().check(history) == "对话陷入重复"
+
+
+def test_filler_and_collapsing_replies():
+    history = dialogue(
+        ("你周末一般做什么？我喜欢去图书馆看书", "嗯嗯"),
+        ("最近在看一本关于城市规划的书，挺有意思的", "哈哈哈"),
+    )
+    assert TerminationDetector().check(history) == "B 只在回复语气词"
+
+    history = dialogue(
+        ("你周末一般做什么？我喜欢去图书馆看书，然后找家咖啡店坐一下午", "看书"),
+        ("最近在看一本关于城市规划的书，讲老城区怎么改造，挺有意思的", "还行吧"),
+    )
+    assert TerminationDetector().check(history) == "B 的回复越来越敷衍"
+
+
+def test_min_turns_and_single_speaker():
+    assert TerminationDetector().check([{"name": "A", "content": "嗯"}]) is None
+    assert TerminationDetector(min_turns=3).check(dialogue(("你好", "嗯嗯"), ("在吗", "哈哈"))) is None
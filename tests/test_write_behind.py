@@ -0,0 +1,139 @@
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from src import write_behind
+from src.write_behind import MatchRecordWriter, is_transient, match_record_row
+
+
+class FakeStorage:
+    """记录写入的行；errors 中的异常按顺序在前几次写入时抛出"""
+    def __init__(self, errors=()):
+        self.rows = []
+        self.calls = 0
+        self.errors = list(errors)
+
+    def save_match_records(self, rows):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        self.rows.extend(rows)
+
+
+def make_writer(storage, spool_dir, **kwargs):
+    # 后台线程基本不醒来，由测试显式 flush / replay
+    kwargs.setdefault("flush_interval", 3600)
+    return MatchRecordWriter(storage, retry_backoff=0, spool_dir=str(spool_dir), **kwargs)
+
+
+def add(writer, target, **kwargs):
+    writer.add("alice", target, [{"name": "Alice", "content": "你好"}], 80, "合适", user_a_name="Alice", user_b_name=target, **kwargs)
+
+
+def spool_files(spool_dir, pattern="*.json"):
+    return sorted(p.name for p in spool_dir.glob(pattern))
+
+
+def test_match_record_row():
+    row = match_record_row("alice", "guest_1", [{"name": "A", "content": "你好"}], 70, "ok", "screened")
+    assert json.loads(row["chat_log"]) == [{"name": "A", "content": "你好"}]
+    assert row["eval_status"] == "screened" and row["user_b_virtual"]
+    assert not match_record_row("alice", "bob", [], 0, "")["user_b_virtual"]
+
+
+def test_is_transient():
+    assert is_transient(ConnectionError("reset"))
+    assert not is_transient(ValueError("bad data"))
+
+
+def test_flush_writes_in_batches_and_calls_on_saved(tmp_path):
+    storage = FakeStorage()
+    saved = []
+    writer = make_writer(storage, tmp_path, batch_size=2)
+    for i in range(5):
+        add(writer, f"bob{i}", on_saved=lambda i=i: saved.append(i))
+    stats = writer.close()
+    assert [r["user_b"] for r in storage.rows] == [f"bob{i}" for i in range(5)]
+    assert storage.calls == 3
+    assert sorted(saved) == list(range(5))
+    assert stats == {"written": 5, "spooled": 0, "rejected": 0}
+    with pytest.raises(RuntimeError):
+        add(writer, "late")
+
+
+def test_transient_failure_spools_then_replays(tmp_path):
+    storage = FakeStorage(errors=[ConnectionError("db down")] * 2)
+    saved = []
+    writer = make_writer(storage, tmp_path, max_retries=1)
+    add(writer, "bob", on_saved=lambda: saved.append("bob"))
+    writer.flush()
+    # 重试耗尽后整批落盘，记录没有丢失，on_saved 照常回调
+    assert storage.rows == [] and storage.calls == 2
+    assert len(spool_files(tmp_path)) == 1 and saved == ["bob"]
+    assert writer.spooled == 1
+
+    # 数据库恢复后补写并删除 spool 文件
+    assert writer.replay_spool() == 1
+    assert [r["user_b"] for r in storage.rows] == ["bob"]
+    assert spool_files(tmp_path) == [] and spool_files(tmp_path, "*") == []
+    writer.close()
+
+
+def test_replay_keeps_file_while_database_is_still_down(tmp_path):
+    storage = FakeStorage(errors=[ConnectionError("down")] * 3)
+    writer = make_writer(storage, tmp_path, max_retries=0)
+    add(writer, "bob")
+    writer.flush()
+    assert writer.replay_spool() == 0
+    assert len(spool_files(tmp_path)) == 1 # 认领后放回原处，下次再试
+    assert writer.replay_spool() == 0
+    assert writer.replay_spool() == 1
+    writer.close()
+
+
+def test_spool_left_by_another_process_is_replayed(tmp_path):
+    rows = [match_record_row("alice", "bob", [], 60, "")]
+    (tmp_path / "batch_1.json").write_text(json.dumps(rows), encoding="utf-8")
+
+    storage = FakeStorage()
+    writer = make_writer(storage, tmp_path)
+    assert writer._has_spool
+    assert writer.replay_spool() == 1
+    assert storage.rows == rows and spool_files(tmp_path) == []
+    writer.close()
+
+
+def test_rejected_batch_calls_on_failed_and_is_not_replayed(tmp_path):
+    storage = FakeStorage(errors=[ValueError("value too long")])
+    saved, failed = [], []
+    writer = make_writer(storage, tmp_path)
+    add(writer, "bob", on_saved=lambda: saved.append("bob"), on_failed=failed.append)
+    stats = writer.close()
+    assert storage.calls == 1 # 非临时性错误不重试
+    assert saved == [] and len(failed) == 1 and "value too long" in failed[0]
+    assert stats["rejected"] == 1
+    assert spool_files(tmp_path) == [] and len(spool_files(tmp_path, "*.rejected")) == 1
+    assert make_writer(storage, tmp_path).replay_spool() == 0
+
+
+def test_stale_claims_are_returned_to_the_queue(tmp_path):
+    rows = [match_record_row("alice", "bob", [], 60, "")]
+    path = tmp_path / "batch_1.json"
+    claimed = tmp_path / "batch_1.json.999.claimed"
+    claimed.write_text(json.dumps(rows), encoding="utf-8")
+
+    storage = FakeStorage()
+    writer = make_writer(storage, tmp_path)
+    assert writer.replay_spool() == 0 # 认领时间不长，可能还有进程在处理
+    assert claimed.exists()
+
+    old = time.time() - write_behind.STALE_CLAIM_SECONDS - 1
+    os.utime(claimed, (old, old))
+    assert writer.replay_spool() == 1
+    assert not claimed.exists() and not path.exists()
+    assert storage.rows == rows
+    writer.close()
@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import os
+import src.boot as boot
+
+# 1. Bootstrap Environment
+boot.bootstrap_environment()
+
+from src.storage import CloudStorage
+from src.worker import MatchWorker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="恋与代理人 - 后台匹配 Worker (消费 match_jobs 队列)")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的对话组数")
+    parser.add_argument("--max-turns", type=int, default=5, help="每组对话的轮数")
+    parser.add_argument("--poll-interval", type=float, default=3.0, help="队列为空时的轮询间隔 (秒)")
+    parser.add_argument("--worker-id", default=None, help="Worker 标识，默认 主机名-进程号")
+    parser.add_argument("--once", action="store_true", help="处理完当前队列后退出")
+    args = parser.parse_args()
+
+    # API Key 从环境变量读取，不要写在代码里
+    api_key = os.getenv("KIMI_API_KEY") or os.getenv("MOONSHOT_API_KEY")
+    if not api_key:
+        raise SystemExit("请设置环境变量 KIMI_API_KEY")
+
+    # 数据库连接信息与 app.py 相同，读取 .streamlit/secrets.toml
+    storage = CloudStorage()
+    if not storage.is_connected:
+        raise SystemExit("数据库连接失败")
+
+    worker = MatchWorker(
+        storage,
+        api_key,
+        worker_id=args.worker_id,
+        concurrency=args.concurrency,
+        max_turns=args.max_turns,
+        poll_interval=args.poll_interval
+    )
+    asyncio.run(worker.run_async(once=args.once))
+
+
+if __name__ == "__main__":
+    main()